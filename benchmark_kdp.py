@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""
+Bancs de mesure des performances du générateur de factures KDP.
+Usage : python benchmark_kdp.py [banc ...] [--tailles 1000,10000] [--json resultats.json]
+                                [--comparer reference.json [--seuil 0.10]]
+        (sans banc : tous les bancs)
+"""
+
+import argparse
+import inspect
+import io
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from kdp_invoice_generator import (
+    DetailsMarche, en_centimes, convertir_centimes, formater_montants, creer_facture_pdf,
+    _ecrire_lignes_tableau, lire_fichier_kdp, extraire_donnees_periode, regrouper_par_marche,
+    creer_facture_word, VERSION_GENERATEUR,
+)
+
+CONFIG_BANC = {
+    'entreprise': {'nom': "DUBOIS Jean", 'adresse': "12, Rue des Lilas\n44340 Bouguenais\nFRANCE",
+                   'siret': "123 456 789 00012", 'tva_intra': "FRXX123456789",
+                   'iban': "FR7612345987650123456789012", 'bic': "BDFEFRPPXXX"},
+    'client': {'nom': "Amazon Media EU S.à r.l.", 'adresse': "5 rue Plaetis\nL-2338 Luxembourg\nLUXEMBOURG",
+               'tva_intra': "LU20260743"},
+    'facture': {'prefixe_numero': "FACT", 'format_numero': "{annee}-{mois:02d}-01",
+                'date_paiement_defaut': "30 jours date de facture", 'mode_reglement': "Virement bancaire"},
+    'fichiers': {'dossier_sortie': "./", 'format_nom_sortie': "Facture_KDP_{annee}-{mois:02d}.docx"},
+    'messages': {'autoliquidation': "Autoliquidation -- TVA due par le preneur."},
+}
+
+
+def marches_synthetiques(lignes, marches=(("Amazon.fr", "EUR", None), ("Amazon.com", "USD", 0.921))):
+    """Données regroupées (format de regrouper_par_marche) réparties sur quelques marchés."""
+    rng = np.random.default_rng(0)
+    par_marche = lignes // len(marches)
+    marches_data = {}
+    for marche, devise, taux in marches:
+        montants = np.round(rng.uniform(0.1, 50, par_marche), 2)
+        details = DetailsMarche([f"Livre n°{i} – édition brochée" for i in range(par_marche)],
+                                [devise] * par_marche, montants, taux or 1)
+        marches_data[marche] = {
+            'devise_origine': devise,
+            'taux_change': taux,
+            'total_origine_cts': details.total_cts(),
+            'total_eur_cts': details.total_eur_cts(),
+            'total_origine': details.total_cts() / 100,
+            'total_eur': details.total_eur_cts() / 100,
+            'details': details,
+        }
+    return marches_data
+
+TAILLES = (1_000, 10_000, 100_000)
+
+
+def _chronometrer(fonction, repetitions=5):
+    """Meilleur temps (en secondes) sur plusieurs exécutions."""
+    meilleur = float('inf')
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        fonction()
+        meilleur = min(meilleur, time.perf_counter() - debut)
+    return meilleur
+
+
+# ---------- MONTANTS : FLOTTANTS vs CENTIMES -----------------------------------
+def bench_monnaie(tailles=TAILLES, taux=0.921):
+    """
+    Compare l'ancien calcul (float par ligne + formatage) au calcul en centimes
+    (conversion vectorisée + formatage) sur n lignes de détail.
+    """
+    rng = np.random.default_rng(0)
+    resultats = []
+    for n in tailles:
+        montants = np.round(rng.uniform(0.1, 50, n), 2)
+
+        def chemin_float():
+            total = 0.0
+            for montant in montants.tolist():
+                montant_eur = montant * taux
+                total += montant_eur
+                f"{montant:.2f}", f"{montant_eur:.2f}"
+            return total
+
+        def chemin_centimes():
+            centimes = en_centimes(montants)
+            centimes_eur = convertir_centimes(centimes, taux)
+            formater_montants(centimes), formater_montants(centimes_eur)
+            return int(centimes_eur.sum())
+
+        resultats.append({
+            'banc': 'monnaie',
+            'lignes': n,
+            'float_s': _chronometrer(chemin_float),
+            'centimes_s': _chronometrer(chemin_centimes),
+        })
+    return resultats
+
+
+# ---------- TABLEAUX WORD : add_row vs ÉCRITURE EN BLOC -----------------------
+def bench_tableau_docx(tailles=(10, 100, 1_000, 10_000)):
+    """
+    Compare table.add_row() + cell.text (chemin historique) à l'écriture en bloc
+    des lignes w:tr via lxml, pour un tableau de marché de n lignes.
+    """
+    from docx import Document
+
+    resultats = []
+    for n in tailles:
+        lignes = [("Amazon.com", f"Livre {i}", "USD", "12.34", "0.921", "11.37 €") for i in range(n)]
+
+        def chemin_add_row():
+            table = Document().add_table(rows=1, cols=6)
+            for valeurs in lignes:
+                cellules = table.add_row().cells
+                for cellule, texte in zip(cellules, valeurs):
+                    cellule.text = texte
+
+        def chemin_bloc():
+            table = Document().add_table(rows=1, cols=6)
+            _ecrire_lignes_tableau(table, lignes)
+
+        repetitions = 1 if n >= 10_000 else 3
+        resultats.append({
+            'banc': 'tableau_docx',
+            'lignes': n,
+            'add_row_s': _chronometrer(chemin_add_row, repetitions),
+            'bloc_s': _chronometrer(chemin_bloc, repetitions),
+        })
+    return resultats
+
+
+# ---------- PDF : PAGES PAR SECONDE ------------------------------------------
+def bench_pdf(tailles=(5_000,)):
+    """
+    Rendu complet (construction + sérialisation) d'une facture PDF de n lignes.
+    """
+    resultats = []
+    for n in tailles:
+        marches_data = marches_synthetiques(n)
+        creer_facture_pdf(marches_synthetiques(10), 2025, 1, CONFIG_BANC)  # chargement de la police
+        debut = time.perf_counter()
+        pdf, _ = creer_facture_pdf(marches_data, 2025, 1, CONFIG_BANC)
+        octets = pdf.output()
+        duree = time.perf_counter() - debut
+        resultats.append({
+            'banc': 'pdf',
+            'lignes': n,
+            'pages': pdf.pages_count,
+            'duree_s': duree,
+            'pages_par_s': pdf.pages_count / duree,
+            'octets': len(octets),
+        })
+    return resultats
+
+
+# ---------- DÉMARRAGE : TEMPS D'IMPORT (-X importtime) -------------------------
+_RENDU = ("import benchmark_kdp as b, kdp_invoice_generator as k; "
+          "k.rendre_octets(k.construire_mise_en_page(b.marches_synthetiques(100), 2025, 1, b.CONFIG_BANC), '{}')")
+
+SCENARIOS_DEMARRAGE = {
+    'import': "import kdp_invoice_generator",
+    'aide': "import kdp_invoice_generator as k; k.main(['--help'])",
+    'config': "import kdp_invoice_generator as k; k.charger_configuration('config.json')",
+    'rendu_pdf': _RENDU.format('pdf'),
+    'rendu_docx': _RENDU.format('docx'),
+}
+MODULES_LOURDS = ('numpy', 'pandas', 'docx', 'fpdf', 'openpyxl')
+
+
+def _importtime(code):
+    """
+    Exécute code dans un nouvel interpréteur avec -X importtime.
+    Renvoie (durée totale des imports en s, modules importés, durée du processus en s).
+    """
+    debut = time.perf_counter()
+    sortie = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=Path(__file__).parent,
+                            capture_output=True, text=True, check=True)
+    duree = time.perf_counter() - debut
+    total_us, modules = 0, set()
+    for ligne in sortie.stderr.splitlines():
+        if not ligne.startswith('import time:') or 'cumulative' in ligne:
+            continue
+        _, cumul, nom = ligne[len('import time:'):].split('|')
+        modules.add(nom.strip())
+        if not nom[1:].startswith(' '):  # import de premier niveau
+            total_us += int(cumul)
+    return total_us / 1e6, modules, duree
+
+
+def bench_demarrage(scenarios=SCENARIOS_DEMARRAGE, repetitions=3):
+    """
+    Temps d'import au démarrage de chaque scénario (meilleur de plusieurs
+    processus) et dépendances lourdes effectivement chargées.
+    """
+    resultats = []
+    for nom, code in scenarios.items():
+        mesures = [_importtime(code) for _ in range(repetitions)]
+        import_s, modules, _ = min(mesures, key=lambda m: m[0])
+        resultats.append({
+            'banc': 'demarrage',
+            'scenario': nom,
+            'imports_s': import_s,
+            'processus_s': min(m[2] for m in mesures),
+            'modules_lourds': ",".join(m for m in MODULES_LOURDS if m in modules) or "-",
+        })
+    return resultats
+
+
+# ---------- CLASSEUR KDP SYNTHÉTIQUE -------------------------------------------
+MARCHES_BANC = (("Amazon.fr", "EUR", None), ("Amazon.com", "USD", 0.921),
+                ("Amazon.co.uk", "GBP", 1.172), ("Amazon.de", "EUR", None))
+ENTETES_PAIEMENTS = ['Période de vente - Date de début', 'Période de vente - Date de fin', 'Marché',
+                     'Numéro de paiement', 'Devise', 'Redevance accumulée', 'Taux de change',
+                     'Montant du paiement', 'Détail', 'Source']
+
+def classeur_synthetique(chemin, lignes, marches=MARCHES_BANC, mois=12, annee=2025,
+                         disposition='source', graine=0):
+    """
+    Écrit un export KDP synthétique d'environ `lignes` lignes : pour chaque mois
+    et chaque marché, une ligne principale (numéro de paiement, redevance et
+    montant converti en EUR) suivie de ses lignes de détail.
+    disposition 'source' : détails avec les colonnes Détail (période) et Source
+    (titre) ; 'detail' : colonne Détail seule ("AAAA-MM titre").
+    Renvoie le nombre de lignes écrites.
+    """
+    from openpyxl import Workbook
+
+    rng = np.random.default_rng(graine)
+    details_par_paiement = max(0, lignes // (mois * len(marches)) - 1)
+    entetes = ENTETES_PAIEMENTS if disposition == 'source' else ENTETES_PAIEMENTS[:-1]
+    classeur = Workbook(write_only=True)
+    feuille = classeur.create_sheet("Paiements")
+    feuille.append(entetes)
+    ecrites = 0
+    numero = 0
+    for m in range(1, mois + 1):
+        debut = datetime(annee, m, 1)
+        fin = datetime(annee, m, 28)
+        for marche, devise, taux in marches:
+            numero += 1
+            montants = np.round(rng.uniform(0.1, 50, details_par_paiement), 2)
+            redevance = round(float(montants.sum()), 2)
+            principale = [debut, fin, marche, f"P{numero:06d}", devise, redevance, taux,
+                          round(redevance * (taux or 1), 2), None, None]
+            feuille.append(principale[:len(entetes)])
+            for i, montant in enumerate(montants.tolist()):
+                titre = f"Livre n°{i} – édition brochée"
+                if disposition == 'source':
+                    feuille.append([None] * 4 + [devise, montant, None, None, f"{annee}-{m:02d} eBook", titre])
+                else:
+                    feuille.append([None] * 4 + [devise, montant, None, None, f"{annee}-{m:02d} {titre}"])
+            ecrites += 1 + details_par_paiement
+    classeur.save(chemin)
+    return ecrites
+
+
+# ---------- CHAÎNE COMPLÈTE : LECTURE → FACTURES ------------------------------
+def _rss_max_mo():
+    """Pic de mémoire résidente du processus (Mo), None si indisponible (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+def _mesurer_chaine(chemin, annee, mois):
+    """
+    Exécute chaque étape une fois sur le classeur `chemin` (dans un processus
+    neuf, pour que le pic RSS ne dépende que de ce classeur).
+    Renvoie [(étape, durée, pic RSS après l'étape, octets produits)].
+    """
+    mesures = []
+
+    def etape(nom, fonction, octets=None):
+        debut = time.perf_counter()
+        valeur = fonction()
+        duree = time.perf_counter() - debut
+        mesures.append((nom, duree, _rss_max_mo(), octets(valeur) if octets else None))
+        return valeur
+
+    df = etape('lecture', lambda: lire_fichier_kdp(chemin)[0], lambda _: Path(chemin).stat().st_size)
+    donnees = etape('extraction', lambda: extraire_donnees_periode(df, annee, mois)[0])
+    marches_data = etape('regroupement', lambda: regrouper_par_marche(donnees)[0])
+
+    def word():
+        tampon = io.BytesIO()
+        creer_facture_word(marches_data, annee, mois, CONFIG_BANC)[0].save(tampon)
+        return tampon.getvalue()
+
+    etape('word', word, len)
+    etape('pdf', lambda: creer_facture_pdf(marches_data, annee, mois, CONFIG_BANC)[0].output(), len)
+    return mesures
+
+def bench_chaine(tailles=TAILLES, dispositions=('source', 'detail'), mois=12):
+    """
+    Chaîne complète sur un export synthétique de n lignes : lecture du fichier,
+    extraction d'un mois (index compris), regroupement par marché, facture Word
+    et PDF de ce mois. Pour chaque étape : durée, pic RSS et taille produite.
+    """
+    resultats = []
+    contexte = get_context('spawn')
+    with tempfile.TemporaryDirectory() as dossier:
+        for n in tailles:
+            for disposition in dispositions:
+                chemin = Path(dossier) / f"Paiements_{n}_{disposition}.xlsx"
+                ecrites = classeur_synthetique(chemin, n, mois=mois, disposition=disposition)
+                with ProcessPoolExecutor(max_workers=1, mp_context=contexte) as pool:
+                    mesures = pool.submit(_mesurer_chaine, chemin, 2025, (mois + 1) // 2).result()
+                for etape, duree, rss, octets in mesures:
+                    resultats.append({
+                        'banc': 'chaine',
+                        'lignes': n,
+                        'disposition': disposition,
+                        'etape': etape,
+                        'lignes_ecrites': ecrites,
+                        'duree_s': duree,
+                        'rss_max_mo': rss,
+                        'octets': octets,
+                    })
+    return resultats
+
+
+# ---------- LECTURE : EXCEL vs CSV vs JSON -----------------------------------
+def _exports_equivalents(dossier, n):
+    """
+    Écrit le même export synthétique de n lignes en xlsx, en CSV (',' et
+    décimales à point), en CSV « à la française » (';' et décimales à virgule)
+    et en JSON (liste d'objets). Renvoie {format: chemin}.
+    """
+    xlsx = Path(dossier) / f"Paiements_{n}.xlsx"
+    classeur_synthetique(xlsx, n)
+    df = lire_fichier_kdp(xlsx)[0]
+    # Dates converties explicitement : le CSV et le JSON reçoivent 'AAAA-MM-JJ' quel que soit le moteur xlsx
+    dates = pd.to_datetime(df['Période de vente - Date de début'], errors='coerce')
+    df['Période de vente - Date de début'] = dates.dt.strftime('%Y-%m-%d').where(dates.notna())
+    chemins = {'xlsx': xlsx, 'csv': xlsx.with_suffix('.csv'),
+               'csv_fr': xlsx.with_name(f"Paiements_{n}_fr.csv"), 'json': xlsx.with_suffix('.json')}
+    df.to_csv(chemins['csv'], index=False, encoding='utf-8')
+    df.to_csv(chemins['csv_fr'], index=False, sep=';', decimal=',', encoding='utf-8-sig')
+    df.to_json(chemins['json'], orient='records', force_ascii=False)
+    return chemins
+
+def bench_lecture(tailles=TAILLES, repetitions=3):
+    """
+    Débit de lire_fichier_kdp sur le même export en xlsx, CSV et JSON (moteur
+    choisi selon l'extension). `identique` vérifie que le total des redevances
+    lues est celui de l'export Excel.
+    """
+    resultats = []
+    with tempfile.TemporaryDirectory() as dossier:
+        for n in tailles:
+            chemins = _exports_equivalents(dossier, n)
+            reference = None
+            for fmt, chemin in chemins.items():
+                df, msg = lire_fichier_kdp(chemin)
+                if df is None:
+                    raise RuntimeError(msg)
+                total = round(float(df['Redevance accumulée'].sum()), 2)
+                reference = total if reference is None else reference
+                duree = _chronometrer(lambda: lire_fichier_kdp(chemin), repetitions)
+                resultats.append({
+                    'banc': 'lecture',
+                    'lignes': n,
+                    'format': fmt,
+                    'moteur': msg.rsplit('moteur ', 1)[-1].rstrip(').'),
+                    'lecture_s': duree,
+                    'lignes_par_s': len(df) / duree,
+                    'octets': Path(chemin).stat().st_size,
+                    'identique': total == reference,
+                })
+    return resultats
+
+
+BANCS = {
+    'monnaie': bench_monnaie,
+    'tableau_docx': bench_tableau_docx,
+    'pdf': bench_pdf,
+    'demarrage': bench_demarrage,
+    'chaine': bench_chaine,
+    'lecture': bench_lecture,
+}
+
+
+# ---------- RÉSULTATS JSON ET COMPARAISON -------------------------------------
+# Champs qui identifient une mesure d'une exécution à l'autre ; les champs en _s
+# sont des durées comparées entre deux exécutions.
+CLES_IDENTITE = ('banc', 'lignes', 'disposition', 'etape', 'scenario', 'format')
+
+def _identite(resultat):
+    return tuple((cle, resultat[cle]) for cle in CLES_IDENTITE if cle in resultat)
+
+def _afficher(resultat):
+    print("  ".join(f"{cle}={valeur:.4f}" if isinstance(valeur, float) else f"{cle}={valeur}"
+                    for cle, valeur in resultat.items()))
+
+def enregistrer_resultats(chemin, resultats):
+    Path(chemin).write_text(json.dumps({
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'version': VERSION_GENERATEUR,
+        'python': platform.python_version(),
+        'plateforme': platform.platform(),
+        'resultats': resultats,
+    }, ensure_ascii=False, indent=2), encoding='utf-8')
+
+def comparer_resultats(reference, resultats, seuil=0.10):
+    """
+    Compare les durées (champs en _s) aux mesures correspondantes de
+    `reference` (contenu d'un fichier --json). Affiche l'écart de chacune et
+    renvoie le nombre de régressions supérieures à `seuil` (0.10 = +10 %).
+    """
+    anciens = {_identite(r): r for r in reference['resultats']}
+    print(f"Comparaison avec la version {reference.get('version', '?')} du {reference.get('date', '?')}")
+    regressions = 0
+    for resultat in resultats:
+        ancien = anciens.get(_identite(resultat))
+        if ancien is None:
+            continue
+        for cle, valeur in resultat.items():
+            if not cle.endswith('_s') or not ancien.get(cle):
+                continue
+            ecart = valeur / ancien[cle] - 1
+            alerte = ecart > seuil
+            regressions += alerte
+            identite = " ".join(f"{c}={v}" for c, v in _identite(resultat))
+            print(f"{'⚠️ ' if alerte else '   '}{identite}  {cle} {ancien[cle]:.4f} → {valeur:.4f} ({ecart:+.1%})")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bancs de mesure des performances du générateur de factures KDP.")
+    parser.add_argument('bancs', nargs='*', metavar='banc', help=f"Bancs à exécuter parmi {', '.join(BANCS)}")
+    parser.add_argument('--tailles', type=lambda t: tuple(int(n) for n in t.split(',')),
+                        help="Nombres de lignes, ex. 1000,10000 (bancs qui le permettent)")
+    parser.add_argument('--json', metavar='FICHIER', help="Enregistrer les résultats dans ce fichier JSON")
+    parser.add_argument('--comparer', metavar='FICHIER', help="Comparer à des résultats enregistrés avec --json")
+    parser.add_argument('--seuil', type=float, default=0.10,
+                        help="Ralentissement toléré avant de signaler une régression (défaut : 0.10)")
+    args = parser.parse_args(argv)
+    inconnus = [nom for nom in args.bancs if nom not in BANCS]
+    if inconnus:
+        parser.error(f"banc(s) inconnu(s) : {', '.join(inconnus)}")
+
+    resultats = []
+    for nom in args.bancs or BANCS:
+        fonction = BANCS[nom]
+        options = {'tailles': args.tailles} if args.tailles and 'tailles' in inspect.signature(fonction).parameters else {}
+        for resultat in fonction(**options):
+            _afficher(resultat)
+            resultats.append(resultat)
+
+    if args.json:
+        enregistrer_resultats(args.json, resultats)
+    if args.comparer:
+        reference = json.loads(Path(args.comparer).read_text(encoding='utf-8'))
+        if comparer_resultats(reference, resultats, args.seuil):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Données des exports KDP partagées par le générateur de factures et les
+registres SQLite : lecture et typage de la feuille 'Paiements', index par
+période (KdpReport), montants en centimes et numéros de facture.
+Ce module n'importe ni kdp_invoice_generator ni les registres.
+"""
+
+import calendar
+import csv
+import importlib
+import importlib.util
+import io
+import json
+import time
+import tracemalloc
+from pathlib import Path
+
+# pandas et numpy chargés au premier accès à l'un de leurs attributs (voir
+# kdp_invoice_generator) : importer ce module reste instantané.
+class _ImportDiffere:
+    def __init__(self, nom):
+        self._nom = nom
+
+    def __getattr__(self, attribut):
+        module = importlib.import_module(self._nom)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attribut)
+
+np = _ImportDiffere('numpy')
+pd = _ImportDiffere('pandas')
+
+# ---------- LECTURE DES DONNÉES ----------------------------------------------
+COLONNES_REQUISES = [
+    'Période de vente - Date de début', 'Marché', 'Numéro de paiement',
+    'Devise', 'Redevance accumulée', 'Montant du paiement'
+]
+COLONNES_OPTIONNELLES = ['Détail', 'Source', 'Taux de change']
+# Type de chaque colonne, imposé quel que soit le moteur de lecture (et à la
+# relecture du cache) : une même feuille donne toujours le même DataFrame.
+COLONNES_NUMERIQUES = ['Redevance accumulée', 'Montant du paiement', 'Taux de change']
+COLONNES_DATES = ['Période de vente - Date de début']
+COLONNES_TEXTE = ['Marché', 'Numéro de paiement', 'Devise', 'Détail', 'Source']
+
+def normaliser_numeros_paiement(valeurs):
+    """
+    Numéros de paiement en texte canonique ('string') : 1234567005 (openpyxl),
+    1234567005.0 (calamine) et ' 1234567005 ' donnent tous '1234567005'.
+    Les cellules vides restent manquantes.
+    """
+    textes = pd.Series(valeurs).astype('string').str.strip()
+    return textes.str.replace(r'^(\d+)\.0$', r'\1', regex=True).replace('', pd.NA)
+
+def typer_colonnes(df):
+    """
+    Convertit les colonnes connues dans leur type : float64 pour les montants,
+    datetime64[ns] pour les dates, 'string' pour les textes et identifiants.
+    """
+    for col in df.columns:
+        if col in COLONNES_NUMERIQUES:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+        elif col in COLONNES_DATES:
+            df[col] = pd.to_datetime(df[col], errors='coerce').astype('datetime64[ns]')
+        elif col == 'Numéro de paiement':
+            df[col] = normaliser_numeros_paiement(df[col])
+        elif col in COLONNES_TEXTE:
+            df[col] = df[col].astype('string')
+    return df
+
+def _moteur_excel_disponible():
+    # calamine (python-calamine) lit les xlsx bien plus vite qu'openpyxl
+    return 'calamine' if importlib.util.find_spec('python_calamine') else 'streaming'
+
+def _lire_paiements_calamine(excel_path):
+    colonnes = set(COLONNES_REQUISES + COLONNES_OPTIONNELLES)
+    return pd.read_excel(excel_path, sheet_name='Paiements', engine='calamine',
+                         usecols=lambda c: str(c).strip() in colonnes)
+
+def _lire_paiements_streaming(excel_path):
+    """
+    Lecture en flux de la feuille 'Paiements' (openpyxl en lecture seule),
+    en ne conservant que les colonnes utiles.
+    """
+    from openpyxl import load_workbook
+
+    classeur = load_workbook(excel_path, read_only=True, data_only=True)
+    try:
+        lignes = classeur['Paiements'].iter_rows(values_only=True)
+        entete = next(lignes, None) or ()
+        colonnes = set(COLONNES_REQUISES + COLONNES_OPTIONNELLES)
+        indices = [(str(nom).strip(), i) for i, nom in enumerate(entete)
+                   if nom is not None and str(nom).strip() in colonnes]
+        if not indices:
+            return pd.DataFrame()
+        noms = [nom for nom, _ in indices]
+        positions = [i for _, i in indices]
+        largeur = max(positions) + 1
+        valeurs = []
+        for ligne in lignes:
+            if len(ligne) < largeur:
+                ligne = ligne + (None,) * (largeur - len(ligne))
+            selection = [ligne[i] for i in positions]
+            if any(v is not None for v in selection):
+                valeurs.append(selection)
+    finally:
+        classeur.close()
+    return pd.DataFrame(valeurs, columns=noms, dtype=object)
+
+MOTEURS_PAR_EXTENSION = {'.csv': 'csv', '.json': 'json'}
+
+def _moteur_csv_disponible():
+    # le moteur pyarrow de pandas découpe et convertit les CSV bien plus vite que le moteur C
+    return 'pyarrow' if importlib.util.find_spec('pyarrow') else 'c'
+
+def _lire_paiements_csv(chemin):
+    """
+    Paiements exportés en CSV (par KDP ou depuis un tableur) : séparateur détecté
+    parmi ',', ';' et tabulation, UTF-8 avec ou sans BOM, seules les colonnes
+    utiles sont lues. Les décimales à la française (12,34) sont acceptées.
+    """
+    with open(chemin, encoding='utf-8-sig', newline='') as f:
+        echantillon = f.read(1 << 16)
+    try:
+        separateur = csv.Sniffer().sniff(echantillon, delimiters=',;\t').delimiter
+    except csv.Error:
+        separateur = ','
+    entete = next(csv.reader(io.StringIO(echantillon), delimiter=separateur), [])
+    colonnes = set(COLONNES_REQUISES + COLONNES_OPTIONNELLES)
+    utiles = [nom for nom in dict.fromkeys(entete) if nom.strip() in colonnes]
+    if not utiles:
+        return pd.DataFrame()
+    # Textes lus tels quels : un numéro de paiement garde ses zéros de tête
+    df = pd.read_csv(chemin, sep=separateur, encoding='utf-8-sig', usecols=utiles,
+                     dtype={nom: str for nom in utiles if nom.strip() in COLONNES_TEXTE},
+                     engine=_moteur_csv_disponible())
+    for col in df.columns:
+        if col.strip() in COLONNES_NUMERIQUES and not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = df[col].str.replace(',', '.', regex=False)
+    return df
+
+def _lire_paiements_json(chemin):
+    """
+    Paiements au format JSON : une liste d'objets {colonne: valeur}, ou un objet
+    {"Paiements": [...]} à l'image de la feuille de l'export Excel.
+    """
+    with open(chemin, encoding='utf-8-sig') as f:
+        enregistrements = json.load(f)
+    if isinstance(enregistrements, dict):
+        enregistrements = enregistrements.get('Paiements', [])
+    if not isinstance(enregistrements, list):
+        raise ValueError("liste de paiements attendue")
+    colonnes = set(COLONNES_REQUISES + COLONNES_OPTIONNELLES)
+    df = pd.DataFrame.from_records(enregistrements)
+    return df[[nom for nom in df.columns if str(nom).strip() in colonnes]]
+
+def lire_fichier_kdp(chemin_fichier, moteur='auto', mesurer_memoire=False):
+    """
+    Lit la feuille 'Paiements' d'un export KDP, ou les mêmes colonnes depuis un
+    fichier CSV ou JSON.
+    moteur : 'calamine', 'streaming' (openpyxl en lecture seule), 'pandas'
+    (lecture complète historique), 'csv', 'json' ou 'auto' (selon l'extension ;
+    pour un xlsx, calamine si disponible, sinon streaming).
+    Le message indique le débit (lignes/s) et, si mesurer_memoire, le pic mémoire.
+    """
+    try:
+        excel_path = Path(chemin_fichier)
+        if not excel_path.is_file():
+            return None, f"ERREUR: Le fichier KDP '{chemin_fichier}' est introuvable."
+        if moteur == 'auto':
+            moteur = MOTEURS_PAR_EXTENSION.get(excel_path.suffix.lower()) or _moteur_excel_disponible()
+        suivi_externe = tracemalloc.is_tracing()
+        if mesurer_memoire:
+            tracemalloc.start() if not suivi_externe else tracemalloc.reset_peak()
+        debut = time.perf_counter()
+        try:
+            if moteur == 'calamine':
+                df = _lire_paiements_calamine(excel_path)
+            elif moteur == 'streaming':
+                df = _lire_paiements_streaming(excel_path)
+            elif moteur == 'csv':
+                df = _lire_paiements_csv(excel_path)
+            elif moteur == 'json':
+                df = _lire_paiements_json(excel_path)
+            else:
+                df = pd.read_excel(excel_path, sheet_name='Paiements')
+            df.columns = df.columns.astype(str).str.strip()
+            for col in COLONNES_REQUISES:
+                if col not in df.columns:
+                    return None, f"ERREUR: La colonne '{col}' est manquante."
+            df = typer_colonnes(df)
+            duree = time.perf_counter() - debut
+        finally:
+            pic = tracemalloc.get_traced_memory()[1] if mesurer_memoire else None
+            if mesurer_memoire and not suivi_externe:
+                tracemalloc.stop()
+        debit = f"{len(df) / duree:,.0f}".replace(",", " ") if duree else "-"
+        if moteur == 'csv':
+            moteur = f"csv/{_moteur_csv_disponible()}"
+        mesures = f"{debit} lignes/s, moteur {moteur}"
+        if pic is not None:
+            mesures += f", pic mémoire {pic / 1024 / 1024:.1f} Mo"
+        return df, f"Fichier lu avec succès: {len(df)} lignes ({mesures})."
+    except Exception as e:
+        return None, f"Erreur lors de la lecture du fichier KDP: {e}"
+
+class KdpReport:
+    """
+    Rapport KDP lu une seule fois, indexé par période.
+    L'index est construit au chargement : une colonne 'Période' normalisée
+    (Period mensuelle) et, pour chaque (année, mois), les positions des lignes
+    concernées. Extraire un mois revient alors à une simple recherche dans l'index.
+    """
+    def __init__(self, df):
+        periode_principale = self._periode_principale(df)
+        periode_detail = self._periode_detail(df)
+        self.df = df.assign(**{'Période': periode_principale.combine_first(periode_detail)})
+
+        # Positions des lignes de chaque période, dans l'ordre du fichier
+        positions = pd.Series(np.arange(len(df)))
+        index_principal = self._indexer(positions, periode_principale)
+        index_detail = self._indexer(positions, periode_detail)
+        self._periodes = sorted(index_principal)
+        self._index = dict(index_detail)
+        for cle, pos in index_principal.items():
+            self._index[cle] = np.union1d(pos, self._index[cle]) if cle in self._index else pos
+
+    @staticmethod
+    def _periode_principale(df):
+        # Lignes principales : 'Période de vente - Date de début' au premier du mois
+        dates = pd.to_datetime(df['Période de vente - Date de début'], errors='coerce')
+        return dates.where(dates.dt.day == 1).dt.to_period('M')
+
+    @staticmethod
+    def _periode_detail(df):
+        # Lignes de détail : colonne 'Détail' commençant par 'AAAA-MM'
+        if 'Détail' not in df.columns:
+            return pd.Series(pd.NaT, index=df.index, dtype='period[M]')
+        prefixes = df['Détail'].astype(str).str[:7]
+        return pd.to_datetime(prefixes, format='%Y-%m', errors='coerce').dt.to_period('M')
+
+    @staticmethod
+    def _indexer(positions, periodes):
+        valides = periodes.notna().to_numpy()
+        groupes = positions[valides].groupby(periodes[valides].to_numpy()).indices
+        return {(p.year, p.month): positions[valides].to_numpy()[pos] for p, pos in groupes.items()}
+
+    def __len__(self):
+        return len(self.df)
+
+    def periodes(self):
+        """
+        Liste triée des périodes (année, mois) ayant au moins une ligne principale.
+        """
+        return list(self._periodes)
+
+    def extraire_periode(self, annee, mois):
+        """
+        Extrait les données pour une période donnée (année/mois).
+        Inclut les lignes principales et leurs détails même sans date.
+        """
+        positions = self._index.get((annee, mois))
+        if positions is None:
+            return None, f"Aucune donnée trouvée pour {calendar.month_name[mois]} {annee}"
+        donnees = self.df.iloc[positions]
+        return donnees, f"Données trouvées : {len(donnees)} lignes."
+
+# ---------- MONTANTS EN CENTIMES ----------------------------------------------
+# Les montants sont manipulés en centimes (entiers int64) : les sommes sont exactes
+# et la conversion en EUR se fait par lot, avec un taux lui aussi mis à l'échelle
+# entière (ECHELLE_TAUX) et un arrondi commercial au centime (demi vers l'extérieur).
+ECHELLE_TAUX = 1_000_000
+
+def en_centimes(valeurs):
+    """
+    Convertit des montants décimaux (scalaires ou tableau) en centimes int64.
+    """
+    return np.rint(np.asarray(valeurs, dtype=np.float64) * 100).astype(np.int64)
+
+def convertir_centimes(centimes, taux):
+    """
+    Applique un taux de change à des montants en centimes, arrondi au centime.
+    """
+    centimes = np.asarray(centimes, dtype=np.int64)
+    taux_entier = int(round(taux * ECHELLE_TAUX))
+    produit = np.abs(centimes) * taux_entier
+    return np.sign(centimes) * ((produit + ECHELLE_TAUX // 2) // ECHELLE_TAUX)
+
+def formater_montant(centimes):
+    """
+    Formate un montant en centimes avec deux décimales ('1234.56').
+    Exact tant que |centimes| < 2**53 : la division ne peut pas déplacer l'arrondi.
+    """
+    return f"{int(centimes) / 100:.2f}"
+
+def formater_montants(centimes):
+    """
+    Version par lot de formater_montant pour un tableau de centimes.
+    """
+    return [f"{m:.2f}" for m in (np.asarray(centimes, dtype=np.int64) / 100).tolist()]
+
+# ---------- NUMÉROS DE FACTURE -------------------------------------------------
+def generer_numero_facture(config, annee, mois, numero_personnalise=None, sequence=None):
+    if numero_personnalise:
+        return numero_personnalise
+    fmt = config['facture'].get('format_numero', "{annee}-{mois:02d}-01")
+    prefixe = config['facture'].get('prefixe_numero', "FACT")
+    num = fmt.format(annee=annee, mois=mois, sequence=sequence)
+    return f"{prefixe}-{num}" if prefixe else num
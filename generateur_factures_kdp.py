@@ -6,25 +6,11 @@ import subprocess
 import platform
 from datetime import datetime, timedelta
 import threading
+import queue
 
-# Assuming kdp_invoice_generator is available
-# from kdp_invoice_generator import generer_facture_logic
-
-# Placeholder for generer_facture_logic for testing purposes
-def generer_facture_logic(filepath, year, month, output_format):
-    # Simulate some work
-    print(f"Generating invoice for {month}/{year} from {filepath} in {output_format} format.")
-    if "error" in filepath:
-        return False, "Simulated error during generation.", []
-    
-    # Simulate success and return dummy file paths
-    dummy_files = []
-    if output_format == "docx" or output_format == "both":
-        dummy_files.append(f"facture_{year}_{month}.docx")
-    if output_format == "pdf" or output_format == "both":
-        dummy_files.append(f"facture_{year}_{month}.pdf")
-        
-    return True, f"Facture(s) générée(s) pour {month}/{year}.", dummy_files
+# Import léger : pandas, python-docx et fpdf2 ne sont chargés qu'au moment de la
+# génération, dans le thread de travail, et pas à l'ouverture de la fenêtre.
+from kdp_invoice_generator import generer_factures_lot, periodes_entre, Instrumentation
 
 
 CONFIG_PATH = "config.json"
@@ -79,6 +65,7 @@ class InvoiceApp(tk.Tk):
         self.setup_generation_tab()
         self.setup_config_tab()
         self.setup_version_tab()  # Ajout de l'onglet version
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
         
         # Define a style for invalid entries (ttk widgets)
         self.style = ttk.Style()
@@ -100,13 +87,25 @@ class InvoiceApp(tk.Tk):
         period_frame = ttk.LabelFrame(gen_frame, text="Période de la facture", padding=10)
         period_frame.pack(fill=tk.X, padx=10, pady=5)
 
+        annee_precedente, mois_precedent = self.get_previous_month()
+        mois = [str(i) for i in range(1, 13)]
+
         ttk.Label(period_frame, text="Année :").pack(side=tk.LEFT, padx=5)
-        self.year_var = tk.StringVar(value=str(self.get_previous_month()[0]))
+        self.year_var = tk.StringVar(value=str(annee_precedente))
         ttk.Entry(period_frame, textvariable=self.year_var, width=10).pack(side=tk.LEFT)
 
         ttk.Label(period_frame, text="Mois :").pack(side=tk.LEFT, padx=5)
-        self.month_var = tk.StringVar(value=str(self.get_previous_month()[1]))
-        ttk.Combobox(period_frame, textvariable=self.month_var, values=[str(i) for i in range(1, 13)], state="readonly", width=5).pack(side=tk.LEFT)
+        self.month_var = tk.StringVar(value=str(mois_precedent))
+        ttk.Combobox(period_frame, textvariable=self.month_var, values=mois, state="readonly", width=5).pack(side=tk.LEFT)
+
+        # Fin de période : plusieurs mois générés en un seul lot
+        ttk.Label(period_frame, text="jusqu'à  Année :").pack(side=tk.LEFT, padx=(20, 5))
+        self.end_year_var = tk.StringVar(value=str(annee_precedente))
+        ttk.Entry(period_frame, textvariable=self.end_year_var, width=10).pack(side=tk.LEFT)
+
+        ttk.Label(period_frame, text="Mois :").pack(side=tk.LEFT, padx=5)
+        self.end_month_var = tk.StringVar(value=str(mois_precedent))
+        ttk.Combobox(period_frame, textvariable=self.end_month_var, values=mois, state="readonly", width=5).pack(side=tk.LEFT)
 
         format_frame = ttk.LabelFrame(gen_frame, text="Format de sortie", padding=10)
         format_frame.pack(fill=tk.X, padx=10, pady=5)
@@ -115,8 +114,19 @@ class InvoiceApp(tk.Tk):
         for fmt in [("DOCX", "docx"), ("PDF", "pdf"), ("Les deux", "both")]:
             ttk.Radiobutton(format_frame, text=fmt[0], variable=self.format_var, value=fmt[1]).pack(side=tk.LEFT, padx=10)
 
-        self.generate_button = ttk.Button(gen_frame, text="Générer la facture", command=self.start_generation)
-        self.generate_button.pack(pady=15, fill=tk.X, padx=10)
+        button_frame = ttk.Frame(gen_frame)
+        button_frame.pack(pady=15, fill=tk.X, padx=10)
+        self.generate_button = ttk.Button(button_frame, text="Générer la facture", command=self.start_generation)
+        self.generate_button.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.cancel_button = ttk.Button(button_frame, text="Annuler", command=self.cancel_generation, state='disabled')
+        self.cancel_button.pack(side=tk.LEFT, padx=(10, 0))
+
+        progress_frame = ttk.Frame(gen_frame)
+        progress_frame.pack(fill=tk.X, padx=10)
+        self.progress = ttk.Progressbar(progress_frame, mode='determinate')
+        self.progress.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.progress_label = ttk.Label(progress_frame, text="", width=30, anchor="e")
+        self.progress_label.pack(side=tk.LEFT, padx=(10, 0))
 
         log_frame = ttk.LabelFrame(gen_frame, text="Journal", padding=10)
         log_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
@@ -126,8 +136,13 @@ class InvoiceApp(tk.Tk):
         self.log_text.tag_config('ERROR', foreground='red')
         self.log_text.tag_config('SUCCESS', foreground='green')
 
+        # État de la génération en cours : le thread de travail ne touche jamais
+        # aux widgets, il dépose ses événements dans une file lue par poll_events().
+        self.events = None
+        self.cancel_event = None
+
     def browse_file(self):
-        filepath = filedialog.askopenfilename(title="Sélectionnez le fichier KDP", filetypes=[("Excel", "*.xlsx")])
+        filepath = filedialog.askopenfilename(title="Sélectionnez le fichier KDP", filetypes=[("Excel", "*.xlsx"), ("CSV", "*.csv"), ("JSON", "*.json"), ("Registre des paiements", "*.sqlite")])
         if filepath:
             self.filepath_var.set(filepath)
 
@@ -139,47 +154,120 @@ class InvoiceApp(tk.Tk):
 
     def start_generation(self):
         filepath = self.filepath_var.get()
-        year = self.year_var.get()
-        month = self.month_var.get()
+        champs = (self.year_var.get(), self.month_var.get(), self.end_year_var.get(), self.end_month_var.get())
 
         if not filepath:
             self.log("Veuillez sélectionner un fichier.", "ERROR")
             return
-        if not (year.isdigit() and month.isdigit()):
+        if not all(champ.isdigit() for champ in champs):
             self.log("Année et mois invalides.", "ERROR")
             return
+        year, month, end_year, end_month = (int(champ) for champ in champs)
+        if (end_year, end_month) < (year, month):
+            self.log("La fin de période doit être postérieure au début.", "ERROR")
+            return
+        periodes = periodes_entre((year, month), (end_year, end_month))
 
         self.generate_button.config(state='disabled')
+        self.cancel_button.config(state='normal')
         self.clear_log()
         self.log("Lancement de la génération...")
-
-        threading.Thread(target=self.run_generation_logic, args=(filepath, int(year), int(month))).start()
-
-    def run_generation_logic(self, filepath, year, month):
+        self.progress.config(mode='indeterminate', value=0)
+        self.progress.start(10)
+        self.progress_label.config(text="Lecture du fichier KDP...")
+
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+        threading.Thread(target=self.run_generation_logic, daemon=True,
+                         args=(self.events, self.cancel_event, filepath, periodes, self.format_var.get())).start()
+        self.after(100, self.poll_events)
+
+    def cancel_generation(self):
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+            self.cancel_button.config(state='disabled')
+            self.log("Annulation demandée, arrêt après la période en cours...")
+
+    @staticmethod
+    def run_generation_logic(events, cancel_event, filepath, periodes, output_format):
+        # Thread de travail : aucun accès à Tk, uniquement des événements dans la file
+        def progression(faites, total, resultat):
+            events.put(('progression', faites, total, resultat))
+
+        def etape(mesure):
+            events.put(('etape', mesure))
+
+        mesures = Instrumentation(rappel=etape)
         try:
-            success, message, fichiers = generer_facture_logic(filepath, year, month, self.format_var.get())
+            success, message, resultats = generer_factures_lot(
+                filepath, periodes, output_format, CONFIG_PATH,
+                progression=progression, annulation=cancel_event, instrumentation=mesures)
         except Exception as e:
-            self.log(f"Erreur : {e}", "ERROR")
-            self.generate_button.config(state='normal')
+            events.put(('fin', False, f"Erreur : {e}", [], mesures.resume()))
             return
+        events.put(('fin', success, message, resultats, mesures.resume()))
 
-        if success:
-            self.log(message, "SUCCESS")
-            for f in fichiers:
+    def poll_events(self):
+        try:
+            while True:
+                evenement = self.events.get_nowait()
+                if evenement[0] == 'progression':
+                    self.show_progress(*evenement[1:])
+                elif evenement[0] == 'etape':
+                    self.show_stage(*evenement[1:])
+                else:
+                    self.finish_generation(*evenement[1:])
+                    return
+        except queue.Empty:
+            pass
+        self.after(100, self.poll_events)
+
+    def show_progress(self, faites, total, resultat):
+        if resultat is None:
+            # Fichier chargé : la barre passe en mode période par période
+            self.progress.stop()
+            self.progress.config(mode='determinate', maximum=max(total, 1), value=0)
+        else:
+            self.progress.config(value=faites)
+            self.log(resultat['message'], "SUCCESS" if resultat['succes'] else "ERROR")
+        self.progress_label.config(text=f"{faites}/{total} période(s)")
+
+    def show_stage(self, mesure):
+        # Étape en cours de lot : affichée sous la barre de progression
+        periode = f"{mesure['periode']} : " if mesure['periode'] else ""
+        self.progress_label.config(text=f"{periode}{mesure['etape']} ({mesure['duree']:.2f} s)")
+
+    def finish_generation(self, success, message, resultats, resume):
+        self.progress.stop()
+        self.generate_button.config(state='normal')
+        self.cancel_button.config(state='disabled')
+        self.cancel_event = None
+
+        if not success:
+            self.log(message, "ERROR")
+            self.log("Durées par étape :\n" + resume)
+            return
+        self.log(message, "SUCCESS")
+        self.log("Durées par étape :\n" + resume)
+
+        # Ouverture automatique seulement pour une facture isolée, pas pour un lot
+        if len(resultats) == 1:
+            for f in resultats[0]['fichiers']:
                 self.log(f"Ouverture : {f}")
                 try:
                     if platform.system() == 'Windows':
                         os.startfile(f)
                     elif platform.system() == 'Darwin':
-                        subprocess.run(['open', f])
+                        subprocess.Popen(['open', f])
                     else:
-                        subprocess.run(['xdg-open', f])
+                        subprocess.Popen(['xdg-open', f])
                 except Exception as e:
                     self.log(f"Impossible d’ouvrir {f} : {e}", "ERROR")
-        else:
-            self.log(message, "ERROR")
 
-        self.generate_button.config(state='normal')
+    def on_close(self):
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+        self.destroy()
 
     def log(self, message, level=None):
         self.log_text.config(state='normal')
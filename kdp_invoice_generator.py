@@ -5,19 +5,41 @@ Auteur: Sébastien Baudry - assisté de Claude 4 Sonnet, Gemini Pro 2.5, ChatGPT
 Version: 3.2 – correction détails + ajout format PDF
 """
 
-import pandas as pd
 from datetime import datetime, timedelta
-from docx import Document
-from docx.shared import Inches
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.enum.table import WD_ALIGN_VERTICAL
 import calendar
 import locale
 import json
+import argparse
+import csv
+import html
+import copy
+import io
+import hashlib
+import os
+import tracemalloc
+import sqlite3
+import tempfile
+import zipfile
+from contextlib import contextmanager
 from pathlib import Path
-from fpdf import FPDF
-from fpdf.enums import XPos, YPos
 import sys
+import time
+
+# Dépendances lourdes chargées à la demande : pandas et numpy au premier accès
+# à l'un de leurs attributs ; python-docx, fpdf2, openpyxl, fontTools, le pool
+# de processus et les registres SQLite (registre_paiements_kdp.py,
+# registre_factures_kdp.py) dans les seules fonctions qui les utilisent.
+# Afficher l'aide, valider la configuration ou ouvrir l'interface graphique ne
+# paie donc pas leur import, et un rendu PDF n'importe jamais python-docx (ni
+# l'inverse).
+# La lecture des exports, les montants en centimes et les numéros de facture sont
+# dans donnees_kdp.py, partagé avec les registres : ceux-ci n'importent jamais ce
+# module (qui peut s'exécuter comme __main__).
+from donnees_kdp import (
+    np, pd, COLONNES_REQUISES, normaliser_numeros_paiement, typer_colonnes, lire_fichier_kdp,
+    KdpReport, en_centimes, convertir_centimes, formater_montant, formater_montants,
+    generer_numero_facture,
+)
 
 # ---------- CONFIG / UTILITAIRES ---------------------------------------------
 def charger_configuration(chemin_config="config.json"):
@@ -35,6 +57,13 @@ def charger_configuration(chemin_config="config.json"):
             valeur = config.get(section, {}).get(champ, "")
             if not valeur or '[' in str(valeur):
                 return None, f"ERREUR: Le champ '{section}.{champ}' n'est pas configuré dans {chemin_config}"
+        facture = config.get('facture', {})
+        if facture.get('registre'):
+            # Registre des numéros de facture : chemin relatif au dossier de config.json
+            facture['registre'] = str(config_path.parent / facture['registre'])
+        elif '{sequence' in facture.get('format_numero', ""):
+            return None, (f"ERREUR: 'facture.format_numero' utilise {{sequence}} mais "
+                          f"'facture.registre' n'est pas configuré dans {chemin_config}")
         return config, "Configuration chargée."
     except Exception as e:
         return None, f"ERREUR lors du chargement de la configuration: {e}"
@@ -45,226 +74,669 @@ def setup_locale():
     # 'fr_FR.UTF-8' est courant sur Linux/macOS.
     # 'fra_FRA.1252' ou 'French_France.1252' est courant sur Windows.
     # On essaie plusieurs options.
-    try:
-        locale.setlocale(locale.LC_TIME, 'fr_FR.UTF-8')
-    except locale.Error:
+    # Sans locale française installée (serveur, conteneur), on garde la locale
+    # courante plutôt que d'interrompre la génération.
+    for nom in ('fr_FR.UTF-8', 'fra_FRA.1252', 'French_France.1252'):
         try:
-            locale.setlocale(locale.LC_TIME, 'fra_FRA.1252') # Pour Windows
+            locale.setlocale(locale.LC_TIME, nom)
+            return True
         except locale.Error:
-            locale.setlocale(locale.LC_TIME, 'French_France.1252') # Autre pour Windows
+            continue
+    return False
+
+# ---------- CACHE DES RAPPORTS LUS -------------------------------------------
+# Les feuilles 'Paiements' déjà lues sont conservées dans un dossier à côté de
+# config.json, au format Parquet (ou pickle si pyarrow est absent ou si une colonne
+# n'est pas convertible). La clé est l'empreinte du contenu : deux copies d'un même
+# export partagent leur entrée ; les entrées les moins récemment utilisées sont
+# supprimées au-delà de TAILLE_MAX_CACHE.
+DOSSIER_CACHE = "cache_kdp"
+TAILLE_MAX_CACHE = 200 * 1024 * 1024
+VERSION_CACHE = 4
+
+def _empreinte_contenu(chemin_fichier):
+    h = hashlib.sha256()
+    with Path(chemin_fichier).open('rb') as f:
+        for bloc in iter(lambda: f.read(1 << 20), b''):
+            h.update(bloc)
+    return h.hexdigest()
+
+def _cle_cache(chemin_fichier, empreinte=None):
+    empreinte = empreinte or _empreinte_contenu(chemin_fichier)
+    return hashlib.sha256(f"{VERSION_CACHE}|{empreinte}".encode('utf-8')).hexdigest()
+
+def _lire_cache(dossier_cache, cle):
+    for extension, lecteur in (('.parquet', pd.read_parquet), ('.pkl', pd.read_pickle)):
+        fichier = Path(dossier_cache) / f"{cle}{extension}"
+        if fichier.is_file():
+            df = lecteur(fichier)
+            os.utime(fichier)  # marque l'entrée comme récemment utilisée
+            return df
+    return None
 
-# ---------- LECTURE DES DONNÉES ----------------------------------------------
-def lire_fichier_kdp(chemin_fichier):
+def _ecrire_cache(dossier_cache, cle, df, taille_max=TAILLE_MAX_CACHE):
+    dossier = Path(dossier_cache)
+    dossier.mkdir(parents=True, exist_ok=True)
+    temporaire = dossier / f"{cle}.{os.getpid()}.tmp"
     try:
-        excel_path = Path(chemin_fichier)
-        if not excel_path.is_file():
-            return None, f"ERREUR: Le fichier Excel '{chemin_fichier}' est introuvable."
-        df = pd.read_excel(excel_path, sheet_name='Paiements')
-        df.columns = df.columns.str.strip()
-        colonnes_requises = [
-            'Période de vente - Date de début', 'Marché', 'Numéro de paiement',
-            'Devise', 'Redevance accumulée', 'Montant du paiement'
-        ]
-        for col in colonnes_requises:
-            if col not in df.columns:
-                return None, f"ERREUR: La colonne '{col}' est manquante."
-        return df, f"Fichier lu avec succès: {len(df)} lignes."
-    except Exception as e:
-        return None, f"Erreur lors de la lecture du fichier Excel: {e}"
+        df.to_parquet(temporaire, index=False)
+        extension = '.parquet'
+    except Exception:
+        # pyarrow absent ou colonne de types mélangés : repli sur pickle
+        df.to_pickle(temporaire)
+        extension = '.pkl'
+    os.replace(temporaire, dossier / f"{cle}{extension}")
+    _purger_cache(dossier, taille_max)
+
+def _purger_cache(dossier_cache, taille_max=TAILLE_MAX_CACHE):
+    entrees = [f for f in Path(dossier_cache).iterdir() if f.suffix in ('.parquet', '.pkl')]
+    entrees.sort(key=lambda f: f.stat().st_mtime)
+    total = sum(f.stat().st_size for f in entrees)
+    for f in entrees:
+        if total <= taille_max:
+            break
+        total -= f.stat().st_size
+        f.unlink(missing_ok=True)
+
+def lire_paiements(chemin_fichier, dossier_cache=None, cle=None):
+    """
+    Feuille 'Paiements' du fichier KDP, réutilisée depuis dossier_cache ou lue
+    puis enregistrée dans le cache. `cle` évite de relire le fichier pour
+    calculer la clé de cache quand l'empreinte est déjà connue.
+    Renvoie (DataFrame ou None, message).
+    """
+    if dossier_cache and Path(chemin_fichier).is_file():
+        try:
+            cle = cle or _cle_cache(chemin_fichier)
+            df = _lire_cache(dossier_cache, cle)
+            if df is not None:
+                df = typer_colonnes(df)
+                return df, f"Fichier lu depuis le cache: {len(df)} lignes."
+        except Exception:
+            cle = None
+    else:
+        cle = None
+
+    df, msg = lire_fichier_kdp(chemin_fichier)
+    if df is None:
+        return None, msg
+    if cle:
+        try:
+            _ecrire_cache(dossier_cache, cle, df)
+        except Exception as e:
+            msg += f" (cache non enregistré : {e})"
+    return df, msg
+
+def charger_rapport_kdp(chemin_fichier, dossier_cache=None):
+    """
+    Lit le fichier KDP et construit son index par période.
+    Si dossier_cache est fourni, la feuille déjà lue y est réutilisée ou enregistrée.
+    Un registre SQLite (.sqlite, voir RegistrePaiements) est ouvert sans rien relire.
+    Renvoie (KdpReport ou RegistrePaiements ou None, message).
+    """
+    from registre_paiements_kdp import EXTENSIONS_REGISTRE, ouvrir_registre_paiements
+
+    if Path(chemin_fichier).suffix.lower() in EXTENSIONS_REGISTRE:
+        return ouvrir_registre_paiements(chemin_fichier)
+    df, msg = lire_paiements(chemin_fichier, dossier_cache)
+    if df is None:
+        return None, msg
+    return KdpReport(df), msg
 
 def extraire_donnees_periode(df, annee, mois):
     """
     Extrait les données pour une période donnée (année/mois).
     Inclut les lignes principales et leurs détails même sans date.
+    Accepte un KdpReport (recherche dans l'index), un RegistrePaiements
+    (requête SQL) ou un DataFrame brut.
+    """
+    rapport = df if hasattr(df, 'extraire_periode') else KdpReport(df)
+    return rapport.extraire_periode(annee, mois)
+
+def taux_conversion(devise_origine, taux_change):
+    """
+    Taux appliqué aux lignes de détail d'un marché (1 pour l'EUR ou sans taux connu).
+    Une devise absente (NaN ou pd.NA) n'est pas l'EUR : le taux s'applique.
     """
-    periode_debut = f"{annee}-{mois:02d}-01"
-    mois_str = f"{annee}-{mois:02d}"
+    if (not pd.isna(devise_origine) and devise_origine == 'EUR') or taux_change is None \
+            or pd.isna(taux_change) or not taux_change:
+        return 1
+    return float(taux_change)
 
-    # Filtre : lignes principales OU lignes dont la colonne 'Détail' contient le mois ciblé
-    mask_periode = (df['Période de vente - Date de début'] == periode_debut) | \
-                   (df['Détail'].astype(str).str.startswith(mois_str))
+class DetailsMarche:
+    """
+    Lignes de détail d'un marché, stockées en colonnes : désignations, devises
+    codées en entiers (avec la table des devises) et montants en centimes int64.
+    La conversion en EUR est calculée une seule fois, de façon vectorisée.
+    """
+    __slots__ = ('designations', 'devises', 'codes_devise', 'montants_cts', 'taux', 'montants_eur_cts')
+
+    def __init__(self, designations=(), devises=(), montants=(), taux=1):
+        codes, categories = pd.factorize(pd.Series(devises, dtype=object), use_na_sentinel=False)
+        self.designations = list(designations)
+        self.devises = list(categories)
+        self.codes_devise = codes.astype(np.int16)
+        self.montants_cts = en_centimes(montants)
+        self.taux = taux
+        self.montants_eur_cts = convertir_centimes(self.montants_cts, taux) if taux != 1 \
+            else self.montants_cts
+
+    def __len__(self):
+        return len(self.designations)
 
-    donnees_periode = df[mask_periode].copy()
+    def __iter__(self):
+        # Compatibilité avec l'ancienne représentation (un dict par ligne)
+        for designation, devise, montant, _ in self.lignes():
+            yield {'designation': designation, 'devise': devise, 'montant': montant / 100}
 
-    if donnees_periode.empty:
-        return None, f"Aucune donnée trouvée pour {calendar.month_name[mois]} {annee}"
+    def lignes(self):
+        """
+        Itère sur (désignation, devise, montant, montant EUR), montants en centimes.
+        """
+        devises = [self.devises[c] for c in self.codes_devise.tolist()]
+        return zip(self.designations, devises, self.montants_cts.tolist(), self.montants_eur_cts.tolist())
 
-    return donnees_periode, f"Données trouvées : {len(donnees_periode)} lignes."
+    def lignes_formatees(self):
+        """
+        Itère sur (désignation, devise, montant, montant EUR), montants déjà formatés.
+        """
+        devises = [self.devises[c] for c in self.codes_devise.tolist()]
+        return zip(self.designations, devises, formater_montants(self.montants_cts),
+                   formater_montants(self.montants_eur_cts))
+
+    def total_cts(self):
+        return int(self.montants_cts.sum())
+
+    def total_eur_cts(self):
+        return int(self.montants_eur_cts.sum())
+
+def rapprocher_totaux(marches_data):
+    """
+    Rapproche, pour chaque marché, la somme des lignes de détail des totaux
+    des lignes principales ('Redevance accumulée' et 'Montant du paiement').
+    Renvoie (total général EUR en centimes, écarts par marché, message).
+    """
+    total_cts = 0
+    ecarts = {}
+    for marche, data in marches_data.items():
+        total_cts += data['total_eur_cts']
+        details = data['details']
+        if not len(details):
+            continue
+        ecart_origine = data['total_origine_cts'] - details.total_cts()
+        ecart_eur = data['total_eur_cts'] - details.total_eur_cts()
+        if ecart_origine or ecart_eur:
+            ecarts[marche] = {'origine_cts': ecart_origine, 'eur_cts': ecart_eur}
+    if not ecarts:
+        return total_cts, ecarts, f"Totaux rapprochés : {formater_montant(total_cts)} €"
+    detail = ", ".join(
+        f"{m} ({formater_montant(e['origine_cts'])} {marches_data[m]['devise_origine']} / "
+        f"{formater_montant(e['eur_cts'])} €)" for m, e in ecarts.items())
+    return total_cts, ecarts, f"Écarts détails / paiement : {detail}"
 
 def regrouper_par_marche(donnees):
     """
-    Regroupe les données par marché (lignes principales + détails)
+    Regroupe les données par marché (lignes principales + détails).
+    Chaque ligne de détail est rattachée à la dernière ligne principale
+    qui la précède : on propage ce rattachement par un cumul vectorisé,
+    puis on agrège par groupby.
     """
     marches_data = {}
 
     # 1) Lignes principales (avec numéro de paiement)
-    principales = donnees[donnees['Numéro de paiement'].notna()].copy()
-    principales['Redevance accumulée'] = pd.to_numeric(
-        principales['Redevance accumulée'], errors='coerce').fillna(0)
-    principales['Montant du paiement'] = pd.to_numeric(
-        principales['Montant du paiement'], errors='coerce').fillna(0)
-
-    marche_par_idx = {}
-    for idx, ligne in principales.iterrows():
-        marche = ligne['Marché']
-        if marche not in marches_data:
-            marches_data[marche] = {
-                'devise_origine': ligne['Devise'],
-                'taux_change': ligne.get('Taux de change'),
-                'total_origine': 0.0,
-                'total_eur': 0.0,
-                'details': []
-            }
-        marches_data[marche]['total_origine'] += ligne['Redevance accumulée']
-        marches_data[marche]['total_eur'] += ligne['Montant du paiement']
-        marche_par_idx[idx] = marche
-
-    # 2) Détails (lignes sans numéro de paiement)
-    marche_actuel = None
-    for idx, ligne in donnees.iterrows():
-        if idx in marche_par_idx:
-            marche_actuel = marche_par_idx[idx]
-            continue
-        if marche_actuel and pd.notna(ligne.get('Redevance accumulée')):
-            col = 'Source' if 'Source' in donnees.columns else 'Détail'
-            designation = ligne.get(col, '') or 'Redevance KDP'
-            devise = ligne.get('Devise') or marches_data[marche_actuel]['devise_origine']
-            montant = float(ligne['Redevance accumulée'])
-            marches_data[marche_actuel]['details'].append({
-                'designation': designation,
-                'devise': devise,
-                'montant': montant
-            })
+    est_principale = donnees['Numéro de paiement'].notna().to_numpy()
+    # Numéro du bloc (1..n) auquel appartient chaque ligne ; 0 = avant toute ligne principale
+    bloc = est_principale.cumsum()
 
-    return marches_data, f"Marchés trouvés: {list(marches_data.keys())}"
+    principales = donnees[est_principale]
+    redevances = pd.to_numeric(principales['Redevance accumulée'], errors='coerce').fillna(0)
+    montants = pd.to_numeric(principales['Montant du paiement'], errors='coerce').fillna(0)
+    marches = principales['Marché']
 
+    totaux_sql = donnees.attrs.get('totaux_marches')
+    if totaux_sql is not None:
+        # Période lue dans un RegistrePaiements : totaux déjà agrégés par SQL
+        totaux = pd.DataFrame.from_dict(totaux_sql, orient='index', columns=['origine', 'eur'])
+    else:
+        totaux = pd.DataFrame({'origine': en_centimes(redevances), 'eur': en_centimes(montants)},
+                              index=principales.index) \
+            .groupby(marches, sort=False, dropna=False).sum()
+    premieres = principales.drop_duplicates('Marché')
+    taux = premieres['Taux de change'] if 'Taux de change' in premieres.columns \
+        else [None] * len(premieres)
+    for marche, devise, taux_change in zip(premieres['Marché'], premieres['Devise'], taux):
+        devise = '' if pd.isna(devise) else devise  # cellule vide : NaN, None ou pd.NA selon le lecteur
+        marches_data[marche] = {
+            'devise_origine': devise,
+            'taux_change': taux_change,
+            'total_origine_cts': int(totaux.at[marche, 'origine']),
+            'total_eur_cts': int(totaux.at[marche, 'eur']),
+            'total_origine': int(totaux.at[marche, 'origine']) / 100,
+            'total_eur': int(totaux.at[marche, 'eur']) / 100,
+            'details': DetailsMarche(taux=taux_conversion(devise, taux_change))
+        }
 
+    # 2) Détails (lignes sans numéro de paiement), rattachés au marché du bloc
+    marche_du_bloc = np.empty(len(principales) + 1, dtype=object)
+    marche_du_bloc[0] = None
+    marche_du_bloc[1:] = marches.to_numpy(dtype=object, na_value=None)
+    marche_ligne = marche_du_bloc[bloc]
 
+    rattachee = np.fromiter((bool(m) for m in marche_ligne), dtype=bool, count=len(marche_ligne))
+    masque = ~est_principale & rattachee & donnees['Redevance accumulée'].notna().to_numpy()
+    if not masque.any():
+        return marches_data, f"Marchés trouvés: {list(marches_data.keys())}"
 
-# ---------- GÉNÉRATION WORD --------------------------------------------------
-def generer_numero_facture(config, annee, mois, numero_personnalise=None):
-    if numero_personnalise:
-        return numero_personnalise
-    fmt = config['facture'].get('format_numero', "{annee}-{mois:02d}-01")
-    prefixe = config['facture'].get('prefixe_numero', "FACT")
-    num = fmt.format(annee=annee, mois=mois)
-    return f"{prefixe}-{num}" if prefixe else num
+    details = donnees[masque]
+    col = 'Source' if 'Source' in donnees.columns else 'Détail'
+    designations = details[col].astype(object)
+    designations = designations.where(designations.notna() & (designations != ''), 'Redevance KDP')
+    devises = details['Devise'].astype(object)
+    devises = devises.where(devises.notna() & (devises != ''), None)
+    marche_details = pd.Series(marche_ligne[masque], dtype=object)
+    devise_par_marche = {m: d['devise_origine'] for m, d in marches_data.items()}
+    cadre = pd.DataFrame({
+        'marche': marche_details,
+        'designation': designations.to_numpy(),
+        'devise': devises.to_numpy(),
+        'montant': details['Redevance accumulée'].astype(float).to_numpy()
+    })
+    cadre['devise'] = cadre['devise'].where(cadre['devise'].notna(), marche_details.map(devise_par_marche))
+    for marche, groupe in cadre.groupby('marche', sort=False):
+        marches_data[marche]['details'] = DetailsMarche(
+            groupe['designation'].tolist(), groupe['devise'].to_numpy(),
+            groupe['montant'].to_numpy(), marches_data[marche]['details'].taux)
+
+    return marches_data, f"Marchés trouvés: {list(marches_data.keys())}"
+
+
+# ---------- MISE EN PAGE INTERMÉDIAIRE -----------------------------------------
+def attribuer_numero_facture(config, annee, mois, donnees, numero_facture=None):
+    """
+    Numéro de facture de la période d'après le registre des factures, en y
+    indexant les paiements de `donnees` ; sans registre, numero_facture
+    inchangé (le numéro est alors dérivé de format_numero).
+    """
+    from registre_factures_kdp import registre_factures
+
+    registre = registre_factures(config)
+    if registre is None:
+        return numero_facture
+    paiements = donnees['Numéro de paiement'].dropna().unique().tolist()
+    return registre.numero(config, annee, mois, paiements, numero_facture)
 
 def obtenir_date_paiement(config, date_personnalisee=None):
     return date_personnalisee or config['facture'].get('date_paiement_defaut', "Non spécifiée")
 
+class MiseEnPageFacture:
+    """
+    Contenu d'une facture calculé une seule fois, indépendamment du format :
+    informations d'en-tête, lignes de chaque marché déjà formatées et totaux.
+    Les moteurs de rendu (docx, pdf, html, csv) ne font que le disposer.
+    Les montants EUR sont formatés sans symbole, chaque moteur ajoute le sien.
+    """
+    __slots__ = ('config', 'annee', 'mois', 'numero', 'date_facture', 'nom_mois',
+                 'date_paiement', 'marches', 'total_cts', 'total')
+
+    def __init__(self, marches_data, annee, mois, config, numero_facture=None, date_paiement=None):
+        self.config = config
+        self.annee = annee
+        self.mois = mois
+        self.numero = generer_numero_facture(config, annee, mois, numero_facture)
+        self.date_facture = f"{datetime.now():%d/%m/%Y}"
+        setup_locale()
+        self.nom_mois = calendar.month_name[mois]
+        self.date_paiement = obtenir_date_paiement(config, date_paiement)
+
+        # Un bloc par marché : nom, lignes de détail et ligne de total (6 colonnes)
+        self.marches = []
+        self.total_cts = 0
+        for marche, data in marches_data.items():
+            details = data['details']
+            taux_str = f"{details.taux:.3f}" if details.taux != 1 else ""
+            lignes = [(marche, designation, devise, montant, taux_str, montant_eur)
+                      for designation, devise, montant, montant_eur in details.lignes_formatees()]
+            taux_total = str(data['taux_change']) \
+                if data.get('taux_change') and pd.notna(data['taux_change']) else ""
+            total = (marche, "TOTAL", data['devise_origine'], formater_montant(data['total_origine_cts']),
+                     taux_total, formater_montant(data['total_eur_cts']))
+            self.marches.append({'nom': marche, 'lignes': lignes, 'total': total,
+                                 'devise': data['devise_origine'],
+                                 'total_origine_cts': data['total_origine_cts'],
+                                 'total_eur_cts': data['total_eur_cts']})
+            self.total_cts += data['total_eur_cts']
+        self.total = formater_montant(self.total_cts)
+
+def construire_mise_en_page(marches_data, annee, mois, config, numero_facture=None, date_paiement=None):
+    return MiseEnPageFacture(marches_data, annee, mois, config, numero_facture, date_paiement)
+
+
+# ---------- GÉNÉRATION WORD --------------------------------------------------
 def _cell_bold(cell):
     p = cell.paragraphs[0] if cell.paragraphs else cell.add_paragraph()
     if not p.runs:
         p.add_run('')
     p.runs[0].bold = True
 
-def creer_facture_word(marches_data, annee, mois, config, numero_facture=None, date_paiement=None):
-    setup_locale()
-    doc = Document()
-    for s in doc.sections:
-        s.top_margin, s.bottom_margin, s.left_margin, s.right_margin = (Inches(i) for i in (.5,.5,.8,.8))
+def _ecrire_lignes_tableau(table, lignes, gras=False):
+    """
+    Ajoute d'un bloc des lignes de texte à un tableau Word.
+    Les éléments w:tr sont produits en une seule chaîne XML analysée une fois par
+    lxml, au lieu d'un table.add_row() et de six cell.text par ligne.
+    """
+    from docx.oxml import parse_xml
+    from docx.oxml.ns import nsdecls
 
-    ent = config['entreprise']
-    cli = config['client']
-    num = generer_numero_facture(config, annee, mois, numero_facture)
-    date_pmt = obtenir_date_paiement(config, date_paiement)
-    nom_mois = calendar.month_name[mois]
+    tbl = table._tbl
+    largeurs = [col.w for col in tbl.tblGrid.gridCol_lst]
+    proprietes = '<w:rPr><w:b/></w:rPr>' if gras else ''
+    cellules = [f'<w:tc><w:tcPr><w:tcW w:w="{int(l.twips) if l is not None else 0}" w:type="dxa"/></w:tcPr><w:p>'
+                for l in largeurs]
+    morceaux = []
+    for valeurs in lignes:
+        morceaux.append('<w:tr>')
+        for debut_cellule, texte in zip(cellules, valeurs):
+            morceaux.append(debut_cellule)
+            if texte:
+                morceaux.append(f'<w:r>{proprietes}<w:t xml:space="preserve">{html.escape(texte, quote=False)}</w:t></w:r>')
+            morceaux.append('</w:p></w:tc>')
+        morceaux.append('</w:tr>')
+    if not morceaux:
+        return
+    bloc = parse_xml(f'<w:tbl {nsdecls("w")}>{"".join(morceaux)}</w:tbl>')
+    tbl.extend(bloc.getchildren())
 
-    # En-tête
-    p = doc.add_paragraph()
-    p.add_run(ent['nom']).bold = True
-    p.add_run(f"\n{ent['adresse']}\nSIRET : {ent['siret']}\nTVA intracommunautaire : {ent['tva_intra']}")
-    if ent.get('code_ape'):
-        p.add_run(f"\nCode APE : {ent['code_ape']}")
-    if ent.get('forme_juridique'):
-        p.add_run(f"\nForme juridique : {ent['forme_juridique']}")
+_MODELES_WORD = {}
 
-    doc.add_paragraph()
-    p = doc.add_paragraph()
-    p.add_run("Destinataire de la facture").bold = True
-    p.add_run(f"\n\n{cli['nom']}\n{cli['adresse']}\nTVA intracommunautaire : {cli['tva_intra']}")
+class ModeleFactureWord:
+    """
+    Squelette de facture Word compilé une fois par configuration : marges,
+    en-têtes entreprise / destinataire et ligne d'en-tête des tableaux de marché.
+    Chaque facture est rechargée depuis ce squelette sérialisé (un deepcopy du
+    Document ne copie pas ses parties de façon fiable) et n'ajoute que les
+    parties variables.
+    """
+    ENTETES = ['Marché','Désignation','Devise','Montant net','Taux','Montant EUR']
 
-    doc.add_paragraph()
-    p = doc.add_paragraph()
-    p.add_run(f"Facture n° : {num}").bold = True
-    p.add_run(f"\nDate de la facture : {datetime.now():%d/%m/%Y}")
-    p.add_run(f"\nPériode concernée : Revenus de {nom_mois} {annee}")
-    p.add_run(f"\nDate de paiement constatée : {date_pmt}")
-    p.add_run(f"\nMode de règlement : {config['facture']['mode_reglement']}")
-    p.add_run(f"\nIBAN : {ent['iban']}\nBIC : {ent['bic']}")
+    def __init__(self, config):
+        from docx import Document
+        from docx.shared import Inches
+        from docx.enum.text import WD_ALIGN_PARAGRAPH
+        from docx.enum.table import WD_ALIGN_VERTICAL
 
-    total_eur = 0
+        doc = Document()
+        for s in doc.sections:
+            s.top_margin, s.bottom_margin, s.left_margin, s.right_margin = (Inches(i) for i in (.5,.5,.8,.8))
+
+        ent = config['entreprise']
+        cli = config['client']
+
+        # En-tête
+        p = doc.add_paragraph()
+        p.add_run(ent['nom']).bold = True
+        p.add_run(f"\n{ent['adresse']}\nSIRET : {ent['siret']}\nTVA intracommunautaire : {ent['tva_intra']}")
+        if ent.get('code_ape'):
+            p.add_run(f"\nCode APE : {ent['code_ape']}")
+        if ent.get('forme_juridique'):
+            p.add_run(f"\nForme juridique : {ent['forme_juridique']}")
 
-    # Pour chaque marché, un tableau distinct
-    for marche, data in marches_data.items():
         doc.add_paragraph()
-        titre = doc.add_paragraph(f"Détail pour le marché : {marche}")
-        titre.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        titre.runs[0].bold = True
+        p = doc.add_paragraph()
+        p.add_run("Destinataire de la facture").bold = True
+        p.add_run(f"\n\n{cli['nom']}\n{cli['adresse']}\nTVA intracommunautaire : {cli['tva_intra']}")
 
+        doc.add_paragraph()
+
+        # Ligne d'en-tête des tableaux, conservée hors du document
         table = doc.add_table(rows=1, cols=6)
-        table.style = 'Table Grid'
-        headers = ['Marché','Désignation','Devise','Montant net','Taux','Montant EUR']
-        for i,h in enumerate(headers):
+        for i,h in enumerate(self.ENTETES):
             cell = table.rows[0].cells[i]
             cell.text = h
             _cell_bold(cell)
             cell.vertical_alignment = WD_ALIGN_VERTICAL.CENTER
             cell.paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
+        self._ligne_entete = table._tbl.tr_lst[0]
+        table._tbl.getparent().remove(table._tbl)
+
+        flux = io.BytesIO()
+        doc.save(flux)
+        self._octets = flux.getvalue()
 
-        for det in data.get('details', []):
-            montant = det['montant']
-            devise = det['devise']
-            taux = float(data['taux_change']) if data['taux_change'] and data['devise_origine'] != 'EUR' else 1
-            montant_eur = montant * taux
+    @classmethod
+    def pour_config(cls, config):
+        """
+        Renvoie le modèle de cette configuration, compilé au premier appel.
+        """
+        cle = json.dumps({s: config.get(s) for s in ('entreprise', 'client')},
+                         sort_keys=True, ensure_ascii=False)
+        if cle not in _MODELES_WORD:
+            _MODELES_WORD[cle] = cls(config)
+        return _MODELES_WORD[cle]
 
-            row = table.add_row().cells
-            row[0].text = marche
-            row[1].text = det['designation']
-            row[2].text = devise
-            row[3].text = f"{montant:.2f}"
-            row[4].text = f"{taux:.3f}" if taux != 1 else ""
-            row[5].text = f"{montant_eur:.2f} €"
+    def nouveau_document(self):
+        from docx import Document
+        return Document(io.BytesIO(self._octets))
+
+    def ajouter_tableau(self, doc):
+        """
+        Ajoute au document un tableau de marché avec sa ligne d'en-tête.
+        """
+        table = doc.add_table(rows=0, cols=len(self.ENTETES))
+        table.style = 'Table Grid'
+        table._tbl.append(copy.deepcopy(self._ligne_entete))
+        return table
+
+def rendre_docx(mise_en_page):
+    """
+    Moteur Word : dispose une MiseEnPageFacture dans un document python-docx.
+    """
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+
+    config = mise_en_page.config
+    modele = ModeleFactureWord.pour_config(config)
+    doc = modele.nouveau_document()
+
+    ent = config['entreprise']
+
+    p = doc.add_paragraph()
+    p.add_run(f"Facture n° : {mise_en_page.numero}").bold = True
+    p.add_run(f"\nDate de la facture : {mise_en_page.date_facture}")
+    p.add_run(f"\nPériode concernée : Revenus de {mise_en_page.nom_mois} {mise_en_page.annee}")
+    p.add_run(f"\nDate de paiement constatée : {mise_en_page.date_paiement}")
+    p.add_run(f"\nMode de règlement : {config['facture']['mode_reglement']}")
+    p.add_run(f"\nIBAN : {ent['iban']}\nBIC : {ent['bic']}")
+
+    # Pour chaque marché, un tableau distinct
+    for bloc in mise_en_page.marches:
+        doc.add_paragraph()
+        titre = doc.add_paragraph(f"Détail pour le marché : {bloc['nom']}")
+        titre.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        titre.runs[0].bold = True
+
+        table = modele.ajouter_tableau(doc)
+        _ecrire_lignes_tableau(table, (ligne[:5] + (f"{ligne[5]} €",) for ligne in bloc['lignes']))
 
         # Ligne de total du marché en gras
-        row = table.add_row().cells
-        for c in row: _cell_bold(c)
-        row[0].text = marche
-        row[1].text = "TOTAL"
-        row[2].text = data['devise_origine']
-        row[3].text = f"{data['total_origine']:.2f}"
-        if data.get('taux_change') and pd.notna(data['taux_change']):
-            row[4].text = str(data['taux_change'])
-        row[5].text = f"{data['total_eur']:.2f} €"
-
-        total_eur += data['total_eur']
+        total = bloc['total']
+        _ecrire_lignes_tableau(table, [total[:5] + (f"{total[5]} €",)], gras=True)
 
     doc.add_paragraph()
     p = doc.add_paragraph()
-    p.add_run(f"Montant total HT : {total_eur:.2f} €\n")
+    p.add_run(f"Montant total HT : {mise_en_page.total} €\n")
     p.add_run("TVA : 0,00 € (Autoliquidation)\n\n")
-    p.add_run(f"Montant TTC : {total_eur:.2f} €").bold = True
+    p.add_run(f"Montant TTC : {mise_en_page.total} €").bold = True
     doc.add_paragraph()
     p = doc.add_paragraph(config['messages']['autoliquidation'])
     p.italic = True
-    return doc, total_eur
+    return doc
+
+def creer_facture_word(marches_data, annee, mois, config, numero_facture=None, date_paiement=None):
+    mise_en_page = construire_mise_en_page(marches_data, annee, mois, config, numero_facture, date_paiement)
+    return rendre_docx(mise_en_page), mise_en_page.total_cts / 100
 
 
 # ---------- GÉNÉRATION PDF ---------------------------------------------------
-def creer_facture_pdf(marches_data, annee, mois, config, numero_facture=None, date_paiement=None):
+# Police Unicode : la première police TrueType trouvée (régulier, gras, italique).
+# Chaque fichier est réduit une fois pour toutes aux plages utiles (sous-ensemble
+# conservé dans le cache de l'utilisateur et en mémoire pour le processus), ce qui
+# rend son chargement et son intégration dans chaque PDF nettement plus rapides.
+# Sans police disponible, on revient à Helvetica (latin-1, € = chr(128)).
+POLICES_PDF = [
+    ("C:/Windows/Fonts/arial.ttf", "C:/Windows/Fonts/arialbd.ttf", "C:/Windows/Fonts/ariali.ttf"),
+    ("/System/Library/Fonts/Supplemental/Arial.ttf", "/System/Library/Fonts/Supplemental/Arial Bold.ttf",
+     "/System/Library/Fonts/Supplemental/Arial Italic.ttf"),
+    ("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+     "/usr/share/fonts/truetype/dejavu/DejaVuSans-Oblique.ttf"),
+    ("/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+     "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
+     "/usr/share/fonts/truetype/liberation/LiberationSans-Italic.ttf"),
+]
+# Latin étendu, diacritiques, grec, cyrillique, ponctuation, symboles monétaires
+PLAGES_UNICODE_PDF = [(0x20, 0x24F), (0x300, 0x36F), (0x370, 0x4FF), (0x2000, 0x214F)]
+_POLICE_PDF = {}
+
+def _dossier_polices():
+    """
+    Dossier de cache des sous-ensembles de polices, propre à l'utilisateur :
+    jamais un dossier partagé du répertoire temporaire, où un autre compte
+    pourrait déposer la police intégrée aux factures.
+    """
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or Path.home() / "AppData" / "Local"
+    elif sys.platform == 'darwin':
+        base = Path.home() / "Library" / "Caches"
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or Path.home() / ".cache"
+    return Path(base) / "kdp_factures" / "polices"
+
+def _dossier_polices_prive():
+    # Repli si le cache utilisateur n'est pas accessible en écriture : dossier
+    # temporaire privé (mkdtemp, mode 0700) supprimé à la fin du processus
+    if 'dossier_prive' not in _POLICE_PDF:
+        import atexit
+        import shutil
+
+        _POLICE_PDF['dossier_prive'] = Path(tempfile.mkdtemp(prefix="kdp_polices_"))
+        atexit.register(shutil.rmtree, _POLICE_PDF['dossier_prive'], ignore_errors=True)
+    return _POLICE_PDF['dossier_prive']
+
+def _sous_ensemble_police(chemin):
+    """
+    Chemin d'un sous-ensemble de la police limité à PLAGES_UNICODE_PDF,
+    créé au premier appel dans _dossier_polices() puis réutilisé (y compris par
+    les autres processus). Le fichier est écrit sous un nom temporaire unique
+    puis renommé : un lecteur ne voit jamais de police partiellement écrite.
+    """
+    source = Path(chemin)
+    st = source.stat()
+    cle = hashlib.sha256(f"{source.resolve()}|{st.st_size}|{st.st_mtime_ns}|{PLAGES_UNICODE_PDF}"
+                         .encode('utf-8')).hexdigest()[:16]
+    nom = f"{source.stem}-{cle}.ttf"
+    for dossier in (_dossier_polices(), _POLICE_PDF.get('dossier_prive')):
+        if dossier is not None and (dossier / nom).is_file():
+            return dossier / nom
+
+    from fontTools import subset as ftsubset
+
+    options = ftsubset.Options()
+    options.layout_features = ['*']
+    options.name_IDs = ['*']
+    options.notdef_outline = True
+    options.drop_tables += ['FFTM']
+    police = ftsubset.load_font(str(source), options)
+    sous_ensemble = ftsubset.Subsetter(options)
+    sous_ensemble.populate(unicodes=[c for debut, fin in PLAGES_UNICODE_PDF for c in range(debut, fin + 1)])
+    sous_ensemble.subset(police)
+    try:
+        dossier = _dossier_polices()
+        dossier.mkdir(mode=0o700, parents=True, exist_ok=True)
+        descripteur, temporaire = tempfile.mkstemp(dir=dossier, prefix=f"{source.stem}-", suffix=".tmp")
+    except OSError:
+        dossier = _dossier_polices_prive()
+        descripteur, temporaire = tempfile.mkstemp(dir=dossier, prefix=f"{source.stem}-", suffix=".tmp")
+    os.close(descripteur)
+    try:
+        ftsubset.save_font(police, temporaire, options)
+        os.replace(temporaire, dossier / nom)
+    except BaseException:
+        Path(temporaire).unlink(missing_ok=True)
+        raise
+    return dossier / nom
+
+def _police_pdf():
+    """
+    Renvoie {style: chemin} de la police Unicode à intégrer, ou None (Helvetica).
+    Résultat mis en cache pour la durée du processus.
+    """
+    if 'styles' not in _POLICE_PDF:
+        _POLICE_PDF['styles'] = None
+        for regulier, gras, italique in POLICES_PDF:
+            if not Path(regulier).is_file():
+                continue
+            try:
+                styles = {'': _sous_ensemble_police(regulier)}
+                styles['B'] = _sous_ensemble_police(gras) if Path(gras).is_file() else styles['']
+                styles['I'] = _sous_ensemble_police(italique) if Path(italique).is_file() else styles['']
+            except Exception:
+                continue
+            _POLICE_PDF['styles'] = styles
+            break
+    return _POLICE_PDF['styles']
+
+def _nouveau_pdf():
+    """
+    Crée le document PDF et sa police. Renvoie (pdf, famille de police, symbole €).
+    """
+    from fpdf import FPDF
+
     pdf = FPDF('P','mm','A4')
     pdf.set_auto_page_break(True,15)
     pdf.set_margins(20,20,20)
+    styles = _police_pdf()
+    if not styles:
+        return pdf, 'Helvetica', chr(128)
+    for style, chemin in styles.items():
+        pdf.add_font('KDP', style, str(chemin))
+    return pdf, 'KDP', '€'
+
+def _entete_tableau_pdf(pdf, font, largeurs, entetes):
+    pdf.set_font(font,'B',8)
+    for largeur, h in zip(largeurs, entetes):
+        pdf.cell(largeur,7,h,1,align='C')
+    pdf.ln()
+
+def _ligne_tableau_pdf(pdf, largeurs, alignements, valeurs, euro):
+    *textes, montant_eur = valeurs
+    for largeur, alignement, texte in zip(largeurs, alignements, textes):
+        pdf.cell(largeur,7,texte,1,align=alignement)
+    pdf.cell(largeurs[-1],7,f"{montant_eur} {euro}",1,align='R')
+
+def rendre_pdf(mise_en_page):
+    """
+    Moteur PDF : dispose une MiseEnPageFacture dans un document fpdf2.
+    """
+    pdf, font, euro = _nouveau_pdf()
+    _dessiner_facture_pdf(pdf, font, euro, mise_en_page)
+    return pdf
+
+def rendre_pdf_fusionne(mises_en_page):
+    """
+    Toutes les factures dans un seul document PDF, chacune commençant sur une
+    nouvelle page (police intégrée une seule fois).
+    """
+    pdf, font, euro = _nouveau_pdf()
+    for mise_en_page in mises_en_page:
+        _dessiner_facture_pdf(pdf, font, euro, mise_en_page)
+    return pdf
+
+def _dessiner_facture_pdf(pdf, font, euro, mise_en_page):
+    from fpdf.enums import XPos, YPos
+
     pdf.add_page()
-    font = 'Helvetica'
-    euro = chr(128)
 
+    config = mise_en_page.config
     ent = config['entreprise']
     cli = config['client']
-    num = generer_numero_facture(config, annee, mois, numero_facture)
-    date_pmt = obtenir_date_paiement(config, date_paiement)
-    nom_mois = calendar.month_name[mois]
 
     # En-tête entreprise
     pdf.set_font(font,'B',12)
@@ -288,142 +760,1576 @@ def creer_facture_pdf(marches_data, annee, mois, config, numero_facture=None, da
 
     # Infos facture
     pdf.set_font(font,'B',12)
-    pdf.cell(0,5,f"Facture n° : {num}",new_x=XPos.LMARGIN,new_y=YPos.NEXT)
+    pdf.cell(0,5,f"Facture n° : {mise_en_page.numero}",new_x=XPos.LMARGIN,new_y=YPos.NEXT)
     pdf.set_font(font,'',10)
-    pdf.cell(0,5,f"Date : {datetime.now():%d/%m/%Y}",new_x=XPos.LMARGIN,new_y=YPos.NEXT)
-    pdf.cell(0,5,f"Période : Revenus de {nom_mois} {annee}",new_x=XPos.LMARGIN,new_y=YPos.NEXT)
-    pdf.cell(0,5,f"Date paiement constatée : {date_pmt}",new_x=XPos.LMARGIN,new_y=YPos.NEXT)
+    pdf.cell(0,5,f"Date : {mise_en_page.date_facture}",new_x=XPos.LMARGIN,new_y=YPos.NEXT)
+    pdf.cell(0,5,f"Période : Revenus de {mise_en_page.nom_mois} {mise_en_page.annee}",new_x=XPos.LMARGIN,new_y=YPos.NEXT)
+    pdf.cell(0,5,f"Date paiement constatée : {mise_en_page.date_paiement}",new_x=XPos.LMARGIN,new_y=YPos.NEXT)
     pdf.cell(0,5,f"Mode règlement : {config['facture']['mode_reglement']}",new_x=XPos.LMARGIN,new_y=YPos.NEXT)
     pdf.cell(0,5,f"IBAN : {ent['iban']}",new_x=XPos.LMARGIN,new_y=YPos.NEXT)
     pdf.cell(0,5,f"BIC : {ent['bic']}",new_x=XPos.LMARGIN,new_y=YPos.NEXT)
     pdf.ln(10)
 
-    total_eur = 0
     w = [25,60,25,20,20,25]  # Largeurs des colonnes
+    headers = ['Marché','Désignation','Devise','Net','Tx',f'Montant {euro}']
+    alignements = ['L','L','L','R','R','R']
 
     # Un tableau par marché
-    for marche, data in marches_data.items():
+    for bloc in mise_en_page.marches:
+        # Titre, en-têtes et première ligne restent sur la même page
+        if pdf.will_page_break(22):
+            pdf.add_page()
         pdf.set_font(font,'B',11)
-        pdf.cell(0,7,f"Détail pour le marché : {marche}",0,1,'C')
+        pdf.cell(0,7,f"Détail pour le marché : {bloc['nom']}",align='C',new_x=XPos.LMARGIN,new_y=YPos.NEXT)
         pdf.ln(1)
 
-        # En-têtes du tableau
-        pdf.set_font(font,'B',8)
-        headers = ['Marché','Désignation','Devise','Net','Tx',f'Montant {euro}']
-        for i,h in enumerate(headers):
-            pdf.cell(w[i],7,h,1,0,'C')
-        pdf.ln()
+        # En-têtes du tableau, répétés en haut de chaque nouvelle page
+        _entete_tableau_pdf(pdf, font, w, headers)
 
         pdf.set_font(font,'',8)
-        for det in data.get('details', []):
-            montant = det['montant']
-            devise = det['devise']
-            taux = float(data['taux_change']) if data['taux_change'] and data['devise_origine'] != 'EUR' else 1
-            montant_eur = montant * taux
-
-            pdf.cell(w[0],7,marche,1)
-            pdf.cell(w[1],7,det['designation'],1)
-            pdf.cell(w[2],7,devise,1)
-            pdf.cell(w[3],7,f"{montant:.2f}",1,align='R')
-            pdf.cell(w[4],7,f"{taux:.3f}" if taux != 1 else "",1,align='R')
-            pdf.cell(w[5],7,f"{montant_eur:.2f} {euro}",1,align='R')
+        for ligne in bloc['lignes']:
+            if pdf.will_page_break(7):
+                pdf.add_page()
+                _entete_tableau_pdf(pdf, font, w, headers)
+                pdf.set_font(font,'',8)
+            _ligne_tableau_pdf(pdf, w, alignements, ligne, euro)
             pdf.ln()
 
         # Ligne total du marché en gras
+        if pdf.will_page_break(7):
+            pdf.add_page()
+            _entete_tableau_pdf(pdf, font, w, headers)
         pdf.set_font(font,'B',8)
-        pdf.cell(w[0],7,marche,1)
-        pdf.cell(w[1],7,"TOTAL",1)
-        pdf.cell(w[2],7,data['devise_origine'],1)
-        pdf.cell(w[3],7,f"{data['total_origine']:.2f}",1,align='R')
-        taux_str = str(data['taux_change']) if pd.notna(data.get('taux_change')) else ""
-        pdf.cell(w[4],7,taux_str,1,align='R')
-        pdf.cell(w[5],7,f"{data['total_eur']:.2f} {euro}",1,align='R')
+        _ligne_tableau_pdf(pdf, w, alignements, bloc['total'], euro)
         pdf.ln(10)
         pdf.set_font(font,'',8)
 
-        total_eur += data['total_eur']
-
     # Totaux finaux
     pdf.ln(5)
     pdf.set_font(font,'',10)
-    pdf.cell(0,5,f"Total HT : {total_eur:.2f} {euro}",0,1,'R')
-    pdf.cell(0,5,f"TVA : 0,00 {euro} (Autoliquidation)",0,1,'R')
+    pdf.cell(0,5,f"Total HT : {mise_en_page.total} {euro}",align='R',new_x=XPos.LMARGIN,new_y=YPos.NEXT)
+    pdf.cell(0,5,f"TVA : 0,00 {euro} (Autoliquidation)",align='R',new_x=XPos.LMARGIN,new_y=YPos.NEXT)
     pdf.ln(2)
     pdf.set_font(font,'B',12)
-    pdf.cell(0,7,f"Total TTC : {total_eur:.2f} {euro}",0,1,'R')
+    pdf.cell(0,7,f"Total TTC : {mise_en_page.total} {euro}",align='R',new_x=XPos.LMARGIN,new_y=YPos.NEXT)
     pdf.ln(10)
     pdf.set_font(font,'I',9)
     pdf.multi_cell(0,5,config['messages']['autoliquidation'])
 
-    return pdf, total_eur
+def creer_facture_pdf(marches_data, annee, mois, config, numero_facture=None, date_paiement=None):
+    mise_en_page = construire_mise_en_page(marches_data, annee, mois, config, numero_facture, date_paiement)
+    return rendre_pdf(mise_en_page), mise_en_page.total_cts / 100
+
+
+# ---------- GÉNÉRATION HTML / CSV --------------------------------------------
+ENTETES_TABLEAU = ['Marché', 'Désignation', 'Devise', 'Montant net', 'Taux', 'Montant EUR']
+
+STYLE_HTML = (
+    "body{font-family:Arial,Helvetica,sans-serif;font-size:10pt;margin:2em}"
+    "table{border-collapse:collapse;width:100%;margin-bottom:1.5em}"
+    "th,td{border:1px solid #000;padding:2px 4px}"
+    "td.n{text-align:right}tr.total td{font-weight:bold}"
+    "h2{font-size:11pt;text-align:center}"
+)
+
+def rendre_html(mise_en_page):
+    """
+    Moteur HTML : page autonome (styles en ligne), consultable dans un navigateur.
+    """
+    config = mise_en_page.config
+    ent = config['entreprise']
+    cli = config['client']
+    e = html.escape
+
+    def bloc_texte(lignes):
+        return "<br>".join(e(l) for l in lignes)
+
+    def ligne_html(valeurs, classe=""):
+        *textes, montant_eur = valeurs
+        cellules = [f"<td>{e(t)}</td>" for t in textes[:3]]
+        cellules += [f'<td class="n">{e(t)}</td>' for t in textes[3:]]
+        cellules.append(f'<td class="n">{e(montant_eur)} €</td>')
+        return f"<tr{classe}>{''.join(cellules)}</tr>"
+
+    entreprise = [ent['nom'], *ent['adresse'].splitlines(), f"SIRET : {ent['siret']}",
+                  f"TVA intracommunautaire : {ent['tva_intra']}"]
+    if ent.get('code_ape'):
+        entreprise.append(f"Code APE : {ent['code_ape']}")
+    if ent.get('forme_juridique'):
+        entreprise.append(f"Forme juridique : {ent['forme_juridique']}")
+    client = [cli['nom'], *cli['adresse'].splitlines()]
+    if cli.get('tva_intra'):
+        client.append(f"TVA intracommunautaire : {cli['tva_intra']}")
+    infos = [f"Date de la facture : {mise_en_page.date_facture}",
+             f"Période concernée : Revenus de {mise_en_page.nom_mois} {mise_en_page.annee}",
+             f"Date de paiement constatée : {mise_en_page.date_paiement}",
+             f"Mode de règlement : {config['facture']['mode_reglement']}",
+             f"IBAN : {ent['iban']}", f"BIC : {ent['bic']}"]
+
+    morceaux = [
+        '<!DOCTYPE html>\n<html lang="fr"><head><meta charset="utf-8">',
+        f"<title>Facture {e(mise_en_page.numero)}</title><style>{STYLE_HTML}</style></head><body>",
+        f"<p>{bloc_texte(entreprise)}</p>",
+        f"<p><b>Destinataire de la facture</b><br>{bloc_texte(client)}</p>",
+        f"<p><b>Facture n° : {e(mise_en_page.numero)}</b><br>{bloc_texte(infos)}</p>",
+    ]
+    entetes = "".join(f"<th>{e(h)}</th>" for h in ENTETES_TABLEAU)
+    for bloc in mise_en_page.marches:
+        morceaux.append(f"<h2>Détail pour le marché : {e(bloc['nom'])}</h2>")
+        morceaux.append(f"<table><thead><tr>{entetes}</tr></thead><tbody>")
+        morceaux.extend(ligne_html(ligne) for ligne in bloc['lignes'])
+        morceaux.append(ligne_html(bloc['total'], ' class="total"'))
+        morceaux.append("</tbody></table>")
+    morceaux += [
+        f"<p>Montant total HT : {mise_en_page.total} €<br>TVA : 0,00 € (Autoliquidation)</p>",
+        f"<p><b>Montant TTC : {mise_en_page.total} €</b></p>",
+        f"<p><i>{e(config['messages']['autoliquidation'])}</i></p>",
+        "</body></html>\n",
+    ]
+    return "".join(morceaux)
+
+def rendre_csv(mise_en_page):
+    """
+    Moteur CSV : une ligne par détail puis une ligne TOTAL par marché,
+    séparateur ';' pour une ouverture directe dans Excel en français.
+    """
+    sortie = io.StringIO()
+    writer = csv.writer(sortie, delimiter=';', lineterminator='\n')
+    writer.writerow(['Facture', 'Période', *ENTETES_TABLEAU])
+    periode = f"{mise_en_page.annee}-{mise_en_page.mois:02d}"
+    for bloc in mise_en_page.marches:
+        writer.writerows((mise_en_page.numero, periode, *ligne) for ligne in bloc['lignes'])
+        writer.writerow((mise_en_page.numero, periode, *bloc['total']))
+    writer.writerow((mise_en_page.numero, periode, "", "TOTAL", "EUR", "", "", mise_en_page.total))
+    return sortie.getvalue()
+
+def _octets_docx(doc):
+    tampon = io.BytesIO()
+    doc.save(tampon)
+    return tampon.getvalue()
+
+# Moteurs de rendu : format -> (extension, rendu, conversion en octets)
+MOTEURS_RENDU = {
+    'docx': ('.docx', rendre_docx, _octets_docx),
+    'pdf': ('.pdf', rendre_pdf, lambda pdf: bytes(pdf.output())),
+    'html': ('.html', rendre_html, lambda texte: texte.encode('utf-8')),
+    'csv': ('.csv', rendre_csv, lambda texte: texte.encode('utf-8-sig')),
+}
+
+def rendre_octets(mise_en_page, fmt):
+    """
+    Rend une MiseEnPageFacture dans le format demandé et renvoie (octets, extension).
+    """
+    extension, rendre, vers_octets = MOTEURS_RENDU[fmt]
+    return vers_octets(rendre(mise_en_page)), extension
+
+
+# ---------- MANIFESTE DE SORTIE -----------------------------------------------
+# Version du rendu : à incrémenter quand la mise en page ou un moteur change,
+# pour que les factures déjà générées soient reconstruites.
+VERSION_GENERATEUR = "3.3"
+FICHIER_MANIFESTE = ".manifeste_kdp.json"
+SECTIONS_CONFIG_FACTURE = ('entreprise', 'client', 'facture', 'messages')
+
+class ManifesteSortie:
+    """
+    Manifeste JSON enregistré dans dossier_sortie : pour chaque fichier généré,
+    l'empreinte des données qui l'ont produit (lignes sources de la période,
+    sections de config.json, version du générateur, numéro et date imposés).
+    Une facture dont l'empreinte est inchangée et dont le fichier est intact
+    n'est ni rendue ni réécrite.
+    """
+    def __init__(self, dossier_sortie):
+        self.dossier = Path(dossier_sortie)
+        self.chemin = self.dossier / FICHIER_MANIFESTE
+        self.entrees = {}
+        self.modifie = False
+        try:
+            contenu = json.loads(self.chemin.read_text(encoding='utf-8'))
+            if contenu.get('version') == VERSION_GENERATEUR:
+                self.entrees = contenu.get('fichiers', {})
+        except (OSError, ValueError, AttributeError):
+            pass  # manifeste absent ou illisible : tout sera régénéré
+
+    @staticmethod
+    def empreinte(donnees, config, numero_facture=None, date_paiement=None):
+        h = hashlib.sha256()
+        h.update(json.dumps({
+            'version': VERSION_GENERATEUR,
+            'config': {section: config.get(section) for section in SECTIONS_CONFIG_FACTURE},
+            'numero_facture': numero_facture,
+            'date_paiement': date_paiement,
+            'colonnes': [c for c in donnees.columns if c != 'Période'],
+        }, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+        lignes = donnees.drop(columns='Période', errors='ignore')
+        h.update(pd.util.hash_pandas_object(lignes, index=False).to_numpy().tobytes())
+        return h.hexdigest()
+
+    def _cle(self, chemin):
+        return os.path.relpath(Path(chemin).resolve(), self.dossier.resolve())
+
+    def a_jour(self, chemin, empreinte):
+        """
+        Vrai si le fichier existe, n'a pas été modifié depuis son enregistrement
+        et a été produit à partir de la même empreinte.
+        """
+        entree = self.entrees.get(self._cle(chemin))
+        if not entree or entree.get('empreinte') != empreinte:
+            return False
+        try:
+            return Path(chemin).stat().st_size == entree.get('taille')
+        except OSError:
+            return False
+
+    def total_cts(self, chemin):
+        return self.entrees[self._cle(chemin)]['total_cts']
+
+    def enregistrer(self, chemin, empreinte, total_cts, annee, mois):
+        self.entrees[self._cle(chemin)] = {
+            'empreinte': empreinte,
+            'periode': f"{annee}-{mois:02d}",
+            'total_cts': int(total_cts),
+            'taille': Path(chemin).stat().st_size,
+        }
+        self.modifie = True
+
+    def sauvegarder(self):
+        if not self.modifie:
+            return
+        self.dossier.mkdir(parents=True, exist_ok=True)
+        temporaire = self.chemin.with_name(f"{FICHIER_MANIFESTE}.{os.getpid()}.tmp")
+        temporaire.write_text(json.dumps({'version': VERSION_GENERATEUR, 'fichiers': self.entrees},
+                                         indent=1, sort_keys=True, ensure_ascii=False), encoding='utf-8')
+        os.replace(temporaire, self.chemin)
+        self.modifie = False
+
+
+# ---------- DESTINATIONS DE SORTIE -------------------------------------------
+class SortieFactures:
+    """
+    Destination des factures générées : ecrire() reçoit les octets de chaque
+    facture sous un nom relatif (format_nom_sortie) et renvoie l'identifiant à
+    afficher dans le journal ; fermer() termine l'écriture.
+    """
+    def ecrire(self, nom, octets):
+        raise NotImplementedError
+
+    def fermer(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fermer()
+
+class SortieFichiers(SortieFactures):
+    """
+    Un fichier par facture dans un dossier (dossier_sortie par défaut).
+    Les sous-dossiers ne sont créés qu'une fois par destination.
+    """
+    def __init__(self, dossier='.'):
+        self.dossier = Path(dossier)
+        self._dossiers_crees = set()
+
+    @classmethod
+    def pour_config(cls, config):
+        return cls(config['fichiers'].get('dossier_sortie', '.'))
+
+    def ecrire(self, nom, octets):
+        chemin = self.dossier / nom
+        if chemin.parent not in self._dossiers_crees:
+            chemin.parent.mkdir(parents=True, exist_ok=True)
+            self._dossiers_crees.add(chemin.parent)
+        chemin.write_bytes(octets)
+        return str(chemin)
+
+class SortieMemoire(SortieFactures):
+    """
+    Factures conservées en mémoire : `fichiers` associe chaque nom à ses octets.
+    """
+    def __init__(self):
+        self.fichiers = {}
+
+    def ecrire(self, nom, octets):
+        self.fichiers[str(nom)] = octets
+        return str(nom)
+
+class SortieZip(SortieFactures):
+    """
+    Toutes les factures dans une seule archive ZIP, écrite dans un fichier ou
+    dans un objet fichier (io.BytesIO, réponse HTTP...). fermer() termine l'archive.
+    """
+    def __init__(self, destination):
+        self.archive = zipfile.ZipFile(destination, 'w', compression=zipfile.ZIP_DEFLATED)
+
+    def ecrire(self, nom, octets):
+        nom = Path(nom).as_posix()
+        self.archive.writestr(nom, octets)
+        return nom
+
+    def fermer(self):
+        self.archive.close()
+
+
+# ---------- INSTRUMENTATION ----------------------------------------------------
+class Instrumentation:
+    """
+    Mesures détaillées d'une génération : durée et nombre de lignes de chaque
+    étape (lecture, extraction, regroupement, mise en page, rendu et écriture de
+    chaque format...), avec en option le pic mémoire de chaque étape (memoire,
+    tracemalloc) et un profil cProfile de l'ensemble (profiler, processus courant
+    uniquement : les rendus faits dans des processus fils ne sont que chronométrés).
+    `rappel(mesure)` est appelé à la fin de chaque étape, dans le thread qui l'a
+    exécutée. Les fonctions de génération l'utilisent comme gestionnaire de
+    contexte ; les utilisations imbriquées ne démarrent les mesures qu'une fois.
+    """
+    def __init__(self, profiler=False, memoire=False, rappel=None):
+        self.profiler = profiler
+        self.memoire = memoire
+        self.rappel = rappel
+        self.mesures = []
+        self.profil = None
+        self._profileur = None
+        self._actif = 0
+        self._tracemalloc = False
+
+    def __enter__(self):
+        self._actif += 1
+        if self._actif == 1:
+            if self.memoire and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._tracemalloc = True
+            if self.profiler:
+                import cProfile
+
+                self._profileur = cProfile.Profile()
+                self._profileur.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self._actif -= 1
+        if self._actif == 0:
+            if self._profileur is not None:
+                import pstats
+
+                self._profileur.disable()
+                if self.profil is None:
+                    self.profil = pstats.Stats(self._profileur)
+                else:
+                    self.profil.add(self._profileur)
+                self._profileur = None
+            if self._tracemalloc:
+                tracemalloc.stop()
+                self._tracemalloc = False
+
+    @staticmethod
+    def _texte_periode(periode):
+        return f"{periode[0]}-{periode[1]:02d}" if periode else None
+
+    @contextmanager
+    def etape(self, nom, periode=None):
+        """
+        Chronomètre le bloc ; le dict renvoyé peut recevoir le nombre de lignes
+        traitées (mesure['lignes']).
+        """
+        mesure = {'etape': nom, 'periode': self._texte_periode(periode), 'duree': 0.0, 'lignes': None}
+        suivre_memoire = self.memoire and tracemalloc.is_tracing()
+        if suivre_memoire:
+            tracemalloc.reset_peak()
+        debut = time.perf_counter()
+        try:
+            yield mesure
+        finally:
+            mesure['duree'] = time.perf_counter() - debut
+            if suivre_memoire:
+                mesure['memoire_mo'] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+            self._enregistrer(mesure)
+
+    def ajouter(self, nom, duree, periode=None, lignes=None):
+        """
+        Étape chronométrée ailleurs (rendu dans un processus fils).
+        """
+        self._enregistrer({'etape': nom, 'periode': self._texte_periode(periode), 'duree': duree, 'lignes': lignes})
+
+    def _enregistrer(self, mesure):
+        self.mesures.append(mesure)
+        if self.rappel:
+            self.rappel(mesure)
+
+    def pour_periode(self, annee, mois):
+        return [m for m in self.mesures if m['periode'] == self._texte_periode((annee, mois))]
+
+    def synthese(self):
+        """
+        Cumul par étape, dans l'ordre de première apparition : nombre
+        d'exécutions, durée totale, part du temps mesuré, lignes traitées et,
+        si memoire, pic mémoire le plus élevé (Mo).
+        """
+        etapes = {}
+        for mesure in self.mesures:
+            cumul = etapes.setdefault(mesure['etape'], {'etape': mesure['etape'], 'nombre': 0,
+                                                        'duree': 0.0, 'lignes': None})
+            cumul['nombre'] += 1
+            cumul['duree'] += mesure['duree']
+            if mesure['lignes'] is not None:
+                cumul['lignes'] = (cumul['lignes'] or 0) + mesure['lignes']
+            if 'memoire_mo' in mesure:
+                cumul['memoire_mo'] = max(cumul.get('memoire_mo', 0), mesure['memoire_mo'])
+        total = sum(cumul['duree'] for cumul in etapes.values()) or 1
+        for cumul in etapes.values():
+            cumul['part'] = cumul['duree'] / total
+        return list(etapes.values())
+
+    def resume(self, fonctions=20):
+        """
+        Tableau texte des étapes (et des `fonctions` plus coûteuses du profil).
+        """
+        lignes = [f"{'Étape':<16}{'Nb':>5}{'Durée':>11}{'Part':>8}{'Lignes':>10}"
+                  + (f"{'Mémoire':>11}" if self.memoire else "")]
+        for cumul in self.synthese():
+            ligne = (f"{cumul['etape']:<16}{cumul['nombre']:>5}{cumul['duree']:>9.3f} s"
+                     f"{cumul['part']:>7.1%}{'' if cumul['lignes'] is None else cumul['lignes']:>10}")
+            if 'memoire_mo' in cumul:
+                ligne += f"{cumul['memoire_mo']:>8.1f} Mo"
+            lignes.append(ligne)
+        if self.profil is not None:
+            tampon = io.StringIO()
+            self.profil.stream = tampon
+            self.profil.sort_stats('cumulative').print_stats(fonctions)
+            lignes.append(tampon.getvalue().rstrip())
+        return "\n".join(lignes)
 
 
 # ---------- GÉNÉRATION / SAVE -------------------------------------------------
+def nom_sortie(config, annee, mois, extension=".docx"):
+    """
+    Nom relatif de la facture d'une période (fichiers.format_nom_sortie).
+    """
+    fmt = config['fichiers']['format_nom_sortie']
+    return Path(fmt.format(annee=annee, mois=mois)).with_suffix(extension)
+
 def generer_nom_fichier_sortie(config, annee, mois, nom_personnalise=None, extension=".docx"):
     if nom_personnalise:
         return str(Path(nom_personnalise).with_suffix(extension))
-    fmt = config['fichiers']['format_nom_sortie']
     dossier = Path(config['fichiers'].get('dossier_sortie','.'))
-    dossier.mkdir(parents=True, exist_ok=True)
-    return dossier / Path(fmt.format(annee=annee, mois=mois)).with_suffix(extension)
+    return dossier / nom_sortie(config, annee, mois, extension)
 
-def generer_facture_logic(fichier_excel, annee, mois, format_sortie,
-                          config_path='config.json', numero_facture=None, date_paiement=None):
-    logs = []
-    fichiers = []
+def _manifeste_pour(sortie):
+    # Le manifeste ne suit que les fichiers réellement présents sur disque
+    return ManifesteSortie(sortie.dossier) if isinstance(sortie, SortieFichiers) else None
 
-    # Charger la configuration
-    config, msg = charger_configuration(config_path)
-    logs.append(msg)
-    if not config:
-        return False, "\n".join(logs), []
+FORMATS_SORTIE = {'docx': ('docx',), 'pdf': ('pdf',), 'both': ('docx', 'pdf')}
 
-    # Charger le fichier Excel
-    df, msg = lire_fichier_kdp(fichier_excel)
-    logs.append(msg)
-    if df is None:
-        return False, "\n".join(logs), []
+def formats_demandes(format_sortie):
+    """
+    Traduit format_sortie ('docx', 'pdf', 'both' ou une liste séparée par des
+    virgules comme 'pdf,html,csv') en tuple de formats connus de MOTEURS_RENDU.
+    """
+    if format_sortie in FORMATS_SORTIE:
+        return FORMATS_SORTIE[format_sortie]
+    formats = []
+    for fmt in str(format_sortie).split(','):
+        fmt = fmt.strip().lower()
+        for f in FORMATS_SORTIE.get(fmt, (fmt,)):
+            if f not in MOTEURS_RENDU:
+                raise ValueError(f"Format de sortie inconnu : {fmt}")
+            if f not in formats:
+                formats.append(f)
+    return tuple(formats)
 
-    # Extraire les données de la période
-    donnees, msg = extraire_donnees_periode(df, annee, mois)
-    logs.append(msg)
-    if donnees is None:
-        return False, "\n".join(logs), []
+def _regrouper_periode(donnees):
+    """
+    Regroupe par marché les données extraites d'une période et rapproche les totaux.
+    Renvoie (marches_data ou None, lignes de journal).
+    """
+    logs = []
 
     # Regrouper par marché
     marches_data, msg = regrouper_par_marche(donnees)
     logs.append(msg)
     if not marches_data:
         logs.append("Aucune donnée de revenus regroupée.")
-        return False, "\n".join(logs), []
+        return None, logs
+
+    _, _, msg = rapprocher_totaux(marches_data)
+    logs.append(msg)
+
+    return marches_data, logs
+
+def _preparer_periode(rapport, config, annee, mois, formats, manifeste=None, forcer=False,
+                      numero_facture=None, date_paiement=None, instrumentation=None):
+    """
+    Prépare le rendu d'une période d'un KdpReport : extraction, comparaison au
+    manifeste, puis regroupement et mise en page seulement si au moins un
+    format doit être reconstruit.
+    Renvoie un dict : succes, logs, empreinte, total, mise_en_page (ou None),
+    a_rendre (formats à reconstruire) et reutilises ({format: chemin}).
+    """
+    mesures = instrumentation or Instrumentation()
+    periode = (annee, mois)
+    plan = {'succes': False, 'logs': [], 'empreinte': None, 'total': 0,
+            'mise_en_page': None, 'a_rendre': (), 'reutilises': {}}
+
+    # Extraire les données de la période
+    with mesures.etape('extraction', periode) as mesure:
+        donnees, msg = extraire_donnees_periode(rapport, annee, mois)
+        mesure['lignes'] = 0 if donnees is None else len(donnees)
+    plan['logs'].append(msg)
+    if donnees is None:
+        return plan
+
+    # Numéro attribué avant la comparaison au manifeste : un changement de numéro régénère la facture
+    try:
+        with mesures.etape('numerotation', periode):
+            numero_facture = attribuer_numero_facture(config, annee, mois, donnees, numero_facture)
+    except (ValueError, sqlite3.Error) as e:
+        plan['logs'].append(f"❌ Numérotation : {e}")
+        return plan
 
-    total = 0
+    # Fichiers déjà à jour d'après le manifeste
+    a_rendre = formats
+    if manifeste is not None:
+        with mesures.etape('empreinte', periode):
+            plan['empreinte'] = manifeste.empreinte(donnees, config, numero_facture, date_paiement)
+        if not forcer:
+            for fmt in formats:
+                chemin = manifeste.dossier / nom_sortie(config, annee, mois, MOTEURS_RENDU[fmt][0])
+                if manifeste.a_jour(chemin, plan['empreinte']):
+                    plan['reutilises'][fmt] = str(chemin)
+                    plan['total'] = manifeste.total_cts(chemin) / 100
+            a_rendre = tuple(fmt for fmt in formats if fmt not in plan['reutilises'])
+    if not a_rendre:
+        plan['succes'] = True
+        return plan
+
+    with mesures.etape('regroupement', periode) as mesure:
+        marches_data, logs = _regrouper_periode(donnees)
+        mesure['lignes'] = sum(len(m['details']) for m in (marches_data or {}).values())
+    plan['logs'].extend(logs)
+    if marches_data is None:
+        return plan
+
+    with mesures.etape('mise_en_page', periode) as mesure:
+        plan['mise_en_page'] = construire_mise_en_page(marches_data, annee, mois, config,
+                                                       numero_facture, date_paiement)
+        mesure['lignes'] = sum(len(bloc['lignes']) for bloc in plan['mise_en_page'].marches)
+    plan['total'] = plan['mise_en_page'].total_cts / 100
+    plan['a_rendre'] = a_rendre
+    plan['succes'] = True
+    return plan
+
+def _rendre_format(mise_en_page, fmt):
+    """
+    Rend la facture d'une période dans un format de MOTEURS_RENDU.
+    Fonction de niveau module pour pouvoir être exécutée dans un processus fils ;
+    l'écriture dans la destination reste faite par le processus parent.
+    Une erreur de rendu est relevée en RuntimeError portant seulement son texte :
+    certaines exceptions (fpdf, lxml) ne se désérialisent pas dans le parent et
+    mettraient le pool de processus entier hors service.
+    Renvoie (octets, nom relatif, durée).
+    """
+    debut = time.perf_counter()
     try:
-        if format_sortie in ('docx', 'both'):
-            doc, total = creer_facture_word(marches_data, annee, mois, config, numero_facture, date_paiement)
-            nom_docx = generer_nom_fichier_sortie(config, annee, mois, extension=".docx")
-            doc.save(nom_docx)
-            fichiers.append(str(nom_docx))
-            logs.append(f"✅ DOCX : {nom_docx}")
-
-        if format_sortie in ('pdf', 'both'):
-            pdf, total = creer_facture_pdf(marches_data, annee, mois, config, numero_facture, date_paiement)
-            nom_pdf = generer_nom_fichier_sortie(config, annee, mois, extension=".pdf")
-            pdf.output(nom_pdf)
-            fichiers.append(str(nom_pdf))
-            logs.append(f"✅ PDF : {nom_pdf}")
+        octets, extension = rendre_octets(mise_en_page, fmt)
+    except Exception as e:
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+    nom = nom_sortie(mise_en_page.config, mise_en_page.annee, mise_en_page.mois, extension)
+    return octets, nom, time.perf_counter() - debut
+
+def _generer_facture_periode(rapport, config, annee, mois, format_sortie, sortie,
+                             numero_facture=None, date_paiement=None,
+                             manifeste=None, forcer=False, instrumentation=None):
+    """
+    Génère la ou les factures d'une période à partir d'un KdpReport déjà chargé
+    et les écrit dans la destination `sortie`.
+    Avec un manifeste, les fichiers déjà à jour sont conservés tels quels
+    (sauf si forcer est vrai).
+    Renvoie (succès, lignes de journal, fichiers, montant total, fichiers réutilisés).
+    """
+    logs = []
+    fichiers = {}
+    mesures = instrumentation or Instrumentation()
+    try:
+        formats = formats_demandes(format_sortie)
+        plan = _preparer_periode(rapport, config, annee, mois, formats, manifeste, forcer,
+                                 numero_facture, date_paiement, mesures)
+        logs.extend(plan['logs'])
+        if not plan['succes']:
+            return False, logs, [], 0, []
+
+        fichiers.update(plan['reutilises'])
+        # Mise en page calculée une seule fois, puis rendue dans chaque format à reconstruire
+        for fmt in plan['a_rendre']:
+            with mesures.etape(f"rendu_{fmt}", (annee, mois)):
+                octets, nom, _ = _rendre_format(plan['mise_en_page'], fmt)
+            with mesures.etape(f"ecriture_{fmt}", (annee, mois)):
+                nom = sortie.ecrire(nom, octets)
+            fichiers[fmt] = nom
+            if manifeste is not None:
+                manifeste.enregistrer(nom, plan['empreinte'], plan['mise_en_page'].total_cts, annee, mois)
 
     except Exception as e:
         logs.append(f"❌ Erreur : {e}")
+        return False, logs, [], 0, []
+
+    for fmt in formats:
+        etat = f"♻️ {fmt.upper()} inchangé" if fmt in plan['reutilises'] else f"✅ {fmt.upper()}"
+        logs.append(f"{etat} : {fichiers[fmt]}")
+
+    return True, logs, [fichiers[fmt] for fmt in formats], plan['total'], list(plan['reutilises'].values())
+
+def generer_facture_logic(fichier_excel, annee, mois, format_sortie,
+                          config_path='config.json', numero_facture=None, date_paiement=None,
+                          forcer=False, sortie=None, instrumentation=None):
+    """
+    Génère la facture d'une période. Les fichiers déjà générés à partir des
+    mêmes données (voir ManifesteSortie) sont réutilisés, sauf si forcer est vrai.
+    `sortie` est une destination (SortieFichiers, SortieMemoire, SortieZip) ;
+    par défaut, un fichier par format dans dossier_sortie.
+    `instrumentation` (Instrumentation) reçoit la durée et le nombre de lignes
+    de chaque étape.
+    Renvoie (succès, journal, fichiers).
+    """
+    logs = []
+    mesures = instrumentation or Instrumentation()
+
+    with mesures:
+        # Charger la configuration
+        with mesures.etape('configuration'):
+            config, msg = charger_configuration(config_path)
+        logs.append(msg)
+        if not config:
+            return False, "\n".join(logs), []
+
+        # Charger le fichier Excel
+        with mesures.etape('lecture') as mesure:
+            rapport, msg = charger_rapport_kdp(fichier_excel, Path(config_path).parent / DOSSIER_CACHE)
+            mesure['lignes'] = 0 if rapport is None else len(rapport)
+        logs.append(msg)
+        if rapport is None:
+            return False, "\n".join(logs), []
+
+        sortie = sortie or SortieFichiers.pour_config(config)
+        manifeste = _manifeste_pour(sortie)
+        succes, logs_periode, fichiers, total, reutilises = _generer_facture_periode(
+            rapport, config, annee, mois, format_sortie, sortie, numero_facture, date_paiement,
+            manifeste, forcer, mesures)
+        logs.extend(logs_periode)
+        try:
+            if manifeste is not None:
+                with mesures.etape('manifeste'):
+                    manifeste.sauvegarder()
+        except OSError as e:
+            logs.append(f"Manifeste non enregistré : {e}")
+    if not succes:
         return False, "\n".join(logs), []
 
     logs.append("-" * 50)
     logs.append(f"Montant total : {total:.2f} €")
+    if reutilises and len(reutilises) == len(fichiers):
+        logs.append("♻️ Données inchangées : factures existantes réutilisées.")
     logs.append("🎉 Terminé ! Fichiers : " + ", ".join(fichiers))
 
     return True, "\n".join(logs), fichiers
 
+# ---------- GÉNÉRATION PAR LOT ------------------------------------------------
+def lister_periodes(df):
+    """
+    Renvoie la liste triée des périodes (année, mois) présentes dans le rapport.
+    """
+    rapport = df if hasattr(df, 'periodes') else KdpReport(df)
+    return rapport.periodes()
+
+def periodes_entre(debut, fin):
+    """
+    Liste des périodes (année, mois) comprises entre debut et fin inclus.
+    """
+    (annee, mois), (annee_fin, mois_fin) = debut, fin
+    periodes = []
+    while (annee, mois) <= (annee_fin, mois_fin):
+        periodes.append((annee, mois))
+        annee, mois = (annee + 1, 1) if mois == 12 else (annee, mois + 1)
+    return periodes
+
+def generer_factures_lot(fichier_excel, periodes=None, format_sortie='both',
+                         config_path='config.json', date_paiement=None, jobs=1, forcer=False,
+                         progression=None, annulation=None, sortie=None, instrumentation=None):
+    """
+    Génère les factures de plusieurs périodes en ne lisant qu'une seule fois
+    la configuration et le fichier Excel (ou à partir d'un KdpReport ou d'un
+    RegistrePaiements déjà ouvert).
+    `periodes` est une liste de (année, mois) ; None = toutes les périodes du rapport.
+    Avec jobs > 1, le rendu des périodes et formats est réparti sur un pool de processus.
+    Les périodes dont les données n'ont pas changé depuis la dernière génération
+    sont réutilisées (clé 'reutilise' des résultats), sauf si forcer est vrai.
+    `progression(faites, total, resultat)` est appelée une fois le fichier chargé
+    (resultat None) puis après chaque période ; `annulation` (un threading.Event)
+    interrompt le lot entre deux périodes.
+    `sortie` est une destination (SortieFichiers par défaut, SortieMemoire ou
+    SortieZip pour un lot écrit dans une seule archive) ; elle n'est pas fermée ici.
+    Avec `instrumentation`, chaque résultat reçoit aussi les mesures de ses
+    étapes (clé 'mesures').
+    Renvoie (succès, journal, résultats par période).
+    """
+    logs = []
+    resultats = []
+    debut = time.perf_counter()
+
+    try:
+        formats_demandes(format_sortie)
+    except ValueError as e:
+        return False, str(e), []
+
+    mesures = instrumentation or Instrumentation()
+    with mesures:
+        with mesures.etape('configuration'):
+            config, msg = charger_configuration(config_path)
+        logs.append(msg)
+        if not config:
+            return False, "\n".join(logs), []
+
+        if hasattr(fichier_excel, 'extraire_periode'):
+            rapport = fichier_excel
+        else:
+            with mesures.etape('lecture') as mesure:
+                rapport, msg = charger_rapport_kdp(fichier_excel, Path(config_path).parent / DOSSIER_CACHE)
+                mesure['lignes'] = 0 if rapport is None else len(rapport)
+            logs.append(msg)
+            if rapport is None:
+                return False, "\n".join(logs), []
+
+        if periodes is None:
+            periodes = rapport.periodes()
+        logs.append(f"Chargement : {time.perf_counter() - debut:.2f} s, {len(periodes)} période(s) à traiter.")
+        if progression:
+            progression(0, len(periodes), None)
+
+        sortie = sortie or SortieFichiers.pour_config(config)
+        manifeste = _manifeste_pour(sortie)
+        if jobs > 1:
+            resultats = _generer_periodes_parallele(rapport, config, periodes, format_sortie, sortie, date_paiement,
+                                                    jobs, manifeste, forcer, progression, annulation, mesures)
+        else:
+            for annee, mois in periodes:
+                if annulation is not None and annulation.is_set():
+                    break
+                debut_periode = time.perf_counter()
+                succes, logs_periode, fichiers, total, reutilises = _generer_facture_periode(
+                    rapport, config, annee, mois, format_sortie, sortie, date_paiement=date_paiement,
+                    manifeste=manifeste, forcer=forcer, instrumentation=mesures)
+                resultats.append({
+                    'annee': annee,
+                    'mois': mois,
+                    'succes': succes,
+                    'message': "\n".join(logs_periode),
+                    'fichiers': fichiers,
+                    'total': total,
+                    'reutilise': succes and len(reutilises) == len(fichiers),
+                    'duree': time.perf_counter() - debut_periode
+                })
+                if progression:
+                    progression(len(resultats), len(periodes), resultats[-1])
+        try:
+            if manifeste is not None:
+                with mesures.etape('manifeste'):
+                    manifeste.sauvegarder()
+        except OSError as e:
+            logs.append(f"Manifeste non enregistré : {e}")
+        if instrumentation is not None:
+            for r in resultats:
+                r['mesures'] = mesures.pour_periode(r['annee'], r['mois'])
+
+
+    for r in resultats:
+        etat = "♻️" if r['reutilise'] else "✅" if r['succes'] else "❌"
+        logs.append(f"{etat} {r['annee']}-{r['mois']:02d} : {r['total']:.2f} € en {r['duree']:.2f} s")
+
+    nb_ok = sum(r['succes'] for r in resultats)
+    nb_reutilisees = sum(r['reutilise'] for r in resultats)
+    annule = len(resultats) < len(periodes)
+    logs.append("-" * 50)
+    if annule:
+        logs.append(f"⏹️ Génération annulée : {len(resultats)}/{len(periodes)} période(s) traitée(s).")
+    logs.append(f"{nb_ok}/{len(resultats)} période(s) générée(s) en {time.perf_counter() - debut:.2f} s")
+    logs.append(f"Réutilisées : {nb_reutilisees}, reconstruites : {nb_ok - nb_reutilisees}")
+    total_cts = sum(int(en_centimes(r['total'])) for r in resultats)
+    logs.append(f"Montant total : {formater_montant(total_cts)} €")
+
+    return bool(resultats) and not annule and nb_ok == len(resultats), "\n".join(logs), resultats
+
+def _finaliser_resultat(resultat, formats):
+    """
+    Construit le journal et la liste de fichiers d'une période rendue en
+    parallèle, dans un ordre déterministe (formats dans l'ordre demandé).
+    """
+    fichiers = resultat.pop('fichiers')
+    logs_periode = resultat.pop('logs')
+    reutilises = resultat.pop('reutilises')
+    resultat.pop('restantes')
+    for fmt in formats:
+        if fmt in fichiers:
+            etat = f"♻️ {fmt.upper()} inchangé" if fmt in reutilises else f"✅ {fmt.upper()}"
+            logs_periode.append(f"{etat} : {fichiers[fmt]}")
+    if 'erreur' in resultat:
+        logs_periode.append(resultat.pop('erreur'))
+    resultat['fichiers'] = [] if not resultat['succes'] else \
+        [fichiers[fmt] for fmt in formats]
+    resultat['message'] = "\n".join(logs_periode)
+    if not resultat['succes']:
+        resultat['total'] = 0
+
+def _generer_periodes_parallele(rapport, config, periodes, format_sortie, sortie, date_paiement, jobs,
+                                manifeste=None, forcer=False, progression=None, annulation=None,
+                                instrumentation=None):
+    """
+    Regroupe et met en page chaque période dans le processus courant, puis
+    répartit le rendu (une tâche par période et par format à reconstruire) sur
+    un ProcessPoolExecutor. Seule la MiseEnPageFacture, déjà formatée, est
+    transmise aux processus ; ils renvoient les octets, que le parent écrit
+    dans la destination avant de mettre à jour le manifeste.
+    En cas d'annulation, les rendus non commencés sont abandonnés et seules les
+    périodes terminées sont renvoyées.
+    """
+    from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+    from concurrent.futures.process import BrokenProcessPool
+
+    resultats = []
+    taches = {}
+    formats = formats_demandes(format_sortie)
+    terminees = 0
+    mesures = instrumentation or Instrumentation()
+    pool_hors_service = False
+
+    def soumettre(pool, mise_en_page, fmt):
+        # Pool cassé (processus fils tué) : les rendus restants sont faits ici
+        nonlocal pool_hors_service
+        if not pool_hors_service:
+            try:
+                return pool.submit(_rendre_format, mise_en_page, fmt)
+            except BrokenProcessPool:
+                pool_hors_service = True
+        future = Future()
+        try:
+            future.set_result(_rendre_format(mise_en_page, fmt))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def terminer(resultat):
+        nonlocal terminees
+        _finaliser_resultat(resultat, formats)
+        terminees += 1
+        if progression:
+            progression(terminees, len(periodes), resultat)
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for annee, mois in periodes:
+            if annulation is not None and annulation.is_set():
+                break
+            debut_periode = time.perf_counter()
+            plan = _preparer_periode(rapport, config, annee, mois, formats, manifeste, forcer,
+                                     date_paiement=date_paiement, instrumentation=mesures)
+            resultat = {
+                'annee': annee,
+                'mois': mois,
+                'succes': plan['succes'],
+                'logs': plan['logs'],
+                'fichiers': dict(plan['reutilises']),
+                'reutilises': set(plan['reutilises']),
+                'restantes': len(plan['a_rendre']),
+                'total': plan['total'],
+                'reutilise': plan['succes'] and not plan['a_rendre'],
+                'duree': time.perf_counter() - debut_periode
+            }
+            resultats.append(resultat)
+            for fmt in plan['a_rendre']:
+                future = soumettre(pool, plan['mise_en_page'], fmt)
+                taches[future] = (resultat, plan, fmt)
+            if not plan['a_rendre']:
+                terminer(resultat)
+
+        for future in as_completed(taches):
+            if annulation is not None and annulation.is_set():
+                for tache in taches:
+                    tache.cancel()
+                break
+            resultat, plan, fmt = taches[future]
+            try:
+                octets, nom, duree = future.result()
+                periode = (resultat['annee'], resultat['mois'])
+                mesures.ajouter(f"rendu_{fmt}", duree, periode)
+                with mesures.etape(f"ecriture_{fmt}", periode):
+                    nom = sortie.ecrire(nom, octets)
+                resultat['fichiers'][fmt] = nom
+                resultat['duree'] += duree
+                if manifeste is not None:
+                    manifeste.enregistrer(nom, plan['empreinte'], plan['mise_en_page'].total_cts,
+                                          resultat['annee'], resultat['mois'])
+            except Exception as e:
+                resultat['succes'] = False
+                resultat['erreur'] = f"❌ Erreur ({fmt}) : {e}"
+            resultat['restantes'] -= 1
+            if resultat['restantes'] == 0:
+                terminer(resultat)
+
+    return [r for r in resultats if 'message' in r]
+
+
+# ---------- BILAN ANNUEL -------------------------------------------------------
+ENTETES_REGISTRE = ['Période', 'Facture', 'Marché', 'Devise', 'Montant net', 'Montant EUR']
+
+def _lignes_registre(mises_en_page):
+    """
+    Registre des factures : une ligne par marché (montants en centimes), une
+    ligne TOTAL par facture et le total de l'ensemble.
+    """
+    total_cts = 0
+    for mise_en_page in mises_en_page:
+        periode = f"{mise_en_page.annee}-{mise_en_page.mois:02d}"
+        for bloc in mise_en_page.marches:
+            yield (periode, mise_en_page.numero, bloc['nom'], bloc['devise'],
+                   bloc['total_origine_cts'], bloc['total_eur_cts'])
+        yield periode, mise_en_page.numero, "TOTAL", "EUR", None, mise_en_page.total_cts
+        total_cts += mise_en_page.total_cts
+    yield "", "", "TOTAL GÉNÉRAL", "EUR", None, total_cts
+
+def registre_csv(mises_en_page):
+    sortie = io.StringIO()
+    writer = csv.writer(sortie, delimiter=';', lineterminator='\n')
+    writer.writerow(ENTETES_REGISTRE)
+    for *textes, net_cts, eur_cts in _lignes_registre(mises_en_page):
+        writer.writerow((*textes, "" if net_cts is None else formater_montant(net_cts), formater_montant(eur_cts)))
+    return sortie.getvalue().encode('utf-8-sig')
+
+def registre_xlsx(mises_en_page):
+    from openpyxl import Workbook
+
+    classeur = Workbook(write_only=True)
+    feuille = classeur.create_sheet("Registre")
+    feuille.append(ENTETES_REGISTRE)
+    for *textes, net_cts, eur_cts in _lignes_registre(mises_en_page):
+        feuille.append((*textes, None if net_cts is None else net_cts / 100, eur_cts / 100))
+    tampon = io.BytesIO()
+    classeur.save(tampon)
+    return tampon.getvalue()
+
+def _octets_pdf_fusionne(mises_en_page):
+    # Erreur relevée en texte seul, comme dans _rendre_format
+    try:
+        return bytes(rendre_pdf_fusionne(mises_en_page).output())
+    except Exception as e:
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+def generer_bilan_annuel(fichier_excel, annee, archive=None, format_sortie='pdf',
+                         config_path='config.json', date_paiement=None, jobs=1, periodes=None):
+    """
+    Produit en un seul passage sur le rapport KDP le dossier annuel du comptable,
+    dans une seule archive ZIP : les factures mensuelles (factures/…), un PDF
+    regroupant toutes les factures et le registre des factures en CSV et XLSX.
+    `archive` est un chemin ou un objet fichier ; par défaut
+    dossier_sortie/Bilan_KDP_{annee}.zip. Les durées de chaque étape sont mesurées.
+    Renvoie (succès, journal, bilan).
+    """
+    logs = []
+    durees = {}
+    debut = etape = time.perf_counter()
+
+    def chronometrer(nom):
+        nonlocal etape
+        maintenant = time.perf_counter()
+        durees[nom] = maintenant - etape
+        etape = maintenant
+
+    try:
+        formats = formats_demandes(format_sortie)
+    except ValueError as e:
+        return False, str(e), None
+
+    config, msg = charger_configuration(config_path)
+    logs.append(msg)
+    if not config:
+        return False, "\n".join(logs), None
+
+    rapport, msg = charger_rapport_kdp(fichier_excel, Path(config_path).parent / DOSSIER_CACHE)
+    logs.append(msg)
+    if rapport is None:
+        return False, "\n".join(logs), None
+    if periodes is None:
+        periodes = [periode for periode in rapport.periodes() if periode[0] == annee]
+    if not periodes:
+        logs.append(f"Aucune période trouvée pour {annee}.")
+        return False, "\n".join(logs), None
+    chronometrer('chargement')
+
+    # Mise en page de chaque mois, une seule fois pour tous les documents
+    mises_en_page = []
+    erreurs = 0
+    for annee_periode, mois in periodes:
+        plan = _preparer_periode(rapport, config, annee_periode, mois, formats, date_paiement=date_paiement)
+        if plan['succes']:
+            mises_en_page.append(plan['mise_en_page'])
+        else:
+            erreurs += 1
+            logs.append(f"❌ {annee_periode}-{mois:02d} : " + " / ".join(plan['logs']))
+    chronometrer('mise_en_page')
+    if not mises_en_page:
+        return False, "\n".join(logs), None
+
+    # Rendu des factures mensuelles et du PDF regroupé. Une période dont un rendu
+    # échoue est écartée de l'archive (factures, PDF regroupé et registre).
+    from concurrent.futures.process import BrokenProcessPool
+
+    def executer(obtenir):
+        try:
+            return obtenir(), None
+        except BrokenProcessPool:
+            raise
+        except Exception as e:
+            return None, str(e)
+
+    taches = [(_rendre_format, (mise_en_page, fmt)) for mise_en_page in mises_en_page for fmt in formats]
+    taches.append((_octets_pdf_fusionne, (mises_en_page,)))
+    resultats = None
+    if jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        try:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                futures = [pool.submit(f, *args) for f, args in taches]
+                resultats = [executer(future.result) for future in futures]
+        except BrokenProcessPool as e:
+            logs.append(f"Pool de processus hors service ({e}) : rendu dans le processus courant.")
+    if resultats is None:
+        resultats = [executer(lambda f=f, args=args: f(*args)) for f, args in taches]
+    pdf_fusionne, erreur_fusion = resultats.pop()
+
+    en_echec = set()
+    for (_, (mise_en_page, fmt)), (_, erreur) in zip(taches, resultats):
+        if erreur is not None:
+            en_echec.add(id(mise_en_page))
+            logs.append(f"❌ {mise_en_page.annee}-{mise_en_page.mois:02d} ({fmt}) : {erreur}")
+    rendus = [rendu for (_, (mise_en_page, _)), (rendu, _) in zip(taches, resultats)
+              if id(mise_en_page) not in en_echec]
+    if en_echec:
+        erreurs += len(en_echec)
+        mises_en_page = [m for m in mises_en_page if id(m) not in en_echec]
+        if not mises_en_page:
+            return False, "\n".join(logs), None
+        pdf_fusionne, erreur_fusion = executer(lambda: _octets_pdf_fusionne(mises_en_page))
+    if erreur_fusion is not None:
+        erreurs += 1
+        logs.append(f"❌ PDF regroupé : {erreur_fusion}")
+    chronometrer('rendu')
+
+    registre = {'csv': registre_csv(mises_en_page), 'xlsx': registre_xlsx(mises_en_page)}
+    chronometrer('registre')
+
+    if archive is None:
+        archive = Path(config['fichiers'].get('dossier_sortie', '.')) / f"Bilan_KDP_{annee}.zip"
+    if isinstance(archive, (str, Path)):
+        Path(archive).parent.mkdir(parents=True, exist_ok=True)
+    fichiers = []
+    with SortieZip(archive) as sortie:
+        for octets, nom, _ in rendus:
+            fichiers.append(sortie.ecrire(Path("factures") / nom.name, octets))
+        if pdf_fusionne is not None:
+            fichiers.append(sortie.ecrire(f"Factures_KDP_{annee}.pdf", pdf_fusionne))
+        for extension, octets in registre.items():
+            fichiers.append(sortie.ecrire(f"Registre_KDP_{annee}.{extension}", octets))
+    chronometrer('archive')
+    durees['total'] = time.perf_counter() - debut
+
+    total_cts = sum(mise_en_page.total_cts for mise_en_page in mises_en_page)
+    logs.append(f"{len(mises_en_page)} facture(s) pour {annee}, {len(fichiers)} fichier(s) dans l'archive.")
+    logs.append("Durées : " + ", ".join(f"{nom} {duree:.2f} s" for nom, duree in durees.items()))
+    logs.append(f"Montant total : {formater_montant(total_cts)} €")
+    if isinstance(archive, (str, Path)):
+        logs.append(f"🎉 Bilan annuel : {archive}")
+
+    return erreurs == 0, "\n".join(logs), {
+        'archive': str(archive) if isinstance(archive, (str, Path)) else None,
+        'periodes': [(m.annee, m.mois) for m in mises_en_page],
+        'fichiers': fichiers,
+        'total': total_cts / 100,
+        'durees': durees,
+    }
+
+
+# ---------- PLUSIEURS AUTEURS ---------------------------------------------------
+# Un sous-dossier par auteur (ou nom de plume) contenant son config.json et ses
+# exports KDP (*.xlsx). Les exports d'un même auteur peuvent se chevaucher : un
+# paiement présent dans plusieurs exports n'est compté qu'une fois.
+
+def lister_auteurs(dossier):
+    """
+    Sous-dossiers de `dossier` contenant un config.json.
+    Renvoie une liste triée de (nom, chemin de config.json, exports KDP triés).
+    """
+    auteurs = []
+    for sous_dossier in sorted(Path(dossier).iterdir()):
+        config_path = sous_dossier / "config.json"
+        if sous_dossier.is_dir() and config_path.is_file():
+            exports = sorted(f for f in sous_dossier.iterdir()
+                             if f.suffix.lower() == '.xlsx' and not f.name.startswith('~$'))
+            auteurs.append((sous_dossier.name, config_path, exports))
+    return auteurs
+
+def fusionner_exports(feuilles):
+    """
+    Concatène les feuilles 'Paiements' de plusieurs exports d'un même auteur.
+    Chaque paiement (ligne principale et ses détails) est conservé depuis le
+    premier export qui le contient ; ses copies dans les exports suivants sont
+    écartées. Renvoie (DataFrame, nombre de paiements en double écartés).
+    """
+    vus = set()
+    parties = []
+    doublons = 0
+    for df in feuilles:
+        # Numéro du paiement auquel appartient chaque ligne (les détails suivent leur ligne principale)
+        numeros = df['Numéro de paiement'].ffill().astype('string')
+        deja_vus = numeros.isin(vus).fillna(False).to_numpy(dtype=bool)
+        doublons += numeros[deja_vus].nunique()
+        parties.append(df[~deja_vus])
+        vus.update(numeros.dropna().unique())
+    if not parties:
+        return pd.DataFrame(columns=COLONNES_REQUISES), 0
+    return pd.concat(parties, ignore_index=True), doublons
+
+def _lire_exports(exports, dossier_cache, jobs):
+    """
+    Lit chaque export une seule fois : les empreintes sont calculées dans un
+    pool de threads (lecture disque), les copies identiques sont écartées, puis
+    les fichiers distincts sont analysés (ou repris du cache) dans un pool de
+    processus. Renvoie ({chemin: empreinte}, {empreinte: (DataFrame ou None, message)}).
+    """
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=min(32, len(exports)) or 1) as pool:
+        empreintes = dict(zip(exports, pool.map(_empreinte_contenu, exports)))
+    uniques = {}
+    for chemin in exports:
+        uniques.setdefault(empreintes[chemin], chemin)
+
+    taches = [(chemin, dossier_cache, _cle_cache(chemin, empreinte)) for empreinte, chemin in uniques.items()]
+    if jobs > 1 and len(taches) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            lues = list(pool.map(lire_paiements, *zip(*taches)))
+    else:
+        lues = [lire_paiements(*tache) for tache in taches]
+    return empreintes, dict(zip(uniques, lues))
+
+def generer_factures_auteurs(dossier, periodes=None, format_sortie='both', date_paiement=None,
+                             jobs=1, forcer=False, annulation=None):
+    """
+    Génère les factures de tous les auteurs d'un dossier (voir lister_auteurs).
+    Tous les exports sont lus une seule fois (cache commun dossier/cache_kdp),
+    puis les exports de chaque auteur sont fusionnés sans doublons et ses
+    factures sont générées avec sa configuration, dans son dossier_sortie
+    (relatif à son sous-dossier). `periodes` = None : toutes les périodes de
+    chaque auteur.
+    Renvoie (succès, journal, résultats par auteur).
+    """
+    logs = []
+    resultats = []
+    debut = time.perf_counter()
+
+    try:
+        auteurs = lister_auteurs(dossier)
+    except OSError as e:
+        return False, f"Erreur lors de la lecture du dossier {dossier}: {e}", []
+    if not auteurs:
+        return False, f"Aucun dossier d'auteur (avec config.json) dans {dossier}.", []
+
+    exports = sorted({export for _, _, liste in auteurs for export in liste})
+    empreintes, feuilles = _lire_exports(exports, Path(dossier) / DOSSIER_CACHE, jobs)
+    logs.append(f"{len(auteurs)} auteur(s), {len(exports)} export(s) dont "
+                f"{len(exports) - len(feuilles)} copie(s) identique(s), lus en {time.perf_counter() - debut:.2f} s.")
+
+    for nom, config_path, liste in auteurs:
+        if annulation is not None and annulation.is_set():
+            logs.append("⏹️ Génération annulée.")
+            break
+        resultat = {'auteur': nom, 'succes': False, 'exports': len(liste), 'doublons': 0, 'periodes': []}
+        resultats.append(resultat)
+        erreurs = [f"{chemin.name} : {feuilles[empreintes[chemin]][1]}" for chemin in liste
+                   if feuilles[empreintes[chemin]][0] is None]
+        config, msg = charger_configuration(config_path)
+        if erreurs or not config or not liste:
+            resultat['message'] = "\n".join(erreurs or [msg if not config else "Aucun export KDP."])
+            logs.append(f"❌ {nom} : {resultat['message']}")
+            continue
+
+        df, resultat['doublons'] = fusionner_exports([feuilles[empreintes[chemin]][0] for chemin in liste])
+        sortie = SortieFichiers(config_path.parent / config['fichiers'].get('dossier_sortie', '.'))
+        succes, journal, par_periode = generer_factures_lot(
+            KdpReport(df), periodes, format_sortie, config_path, date_paiement, jobs, forcer,
+            annulation=annulation, sortie=sortie)
+        resultat.update(succes=succes, message=journal, periodes=par_periode)
+        total_cts = sum(int(en_centimes(r['total'])) for r in par_periode)
+        logs.append(f"{'✅' if succes else '❌'} {nom} : {sum(r['succes'] for r in par_periode)} facture(s), "
+                    f"{len(liste)} export(s), {resultat['doublons']} paiement(s) en double écarté(s), "
+                    f"{formater_montant(total_cts)} €")
+
+    nb_ok = sum(r['succes'] for r in resultats)
+    logs.append("-" * 50)
+    logs.append(f"{nb_ok}/{len(auteurs)} auteur(s) traité(s) en {time.perf_counter() - debut:.2f} s")
+    return nb_ok == len(auteurs), "\n".join(logs), resultats
+
 
 # ---------- MAIN CLI (optionnel) ---------------------------------------------
+# Ligne de commande sans interface graphique (tkinter n'est jamais importé) :
+#   python kdp_invoice_generator.py [fichier] --annee 2025 --mois 5 --format both
+#   python -m kdp_invoice_generator generate [fichier] --from 2024-01 --to 2025-06 --format pdf --jobs 4 --json
+# Code de retour : 0 si tout est généré, 1 en cas d'échec, 2 si les arguments sont invalides.
+
+def _periode_argument(texte):
+    try:
+        date = datetime.strptime(texte, "%Y-%m")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"période invalide '{texte}' (format attendu : AAAA-MM)")
+    return date.year, date.month
+
+def _format_argument(texte):
+    try:
+        formats_demandes(texte)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return texte
+
+def _mois_precedent():
+    aujourd_hui = datetime.now()
+    return (aujourd_hui.year - 1, 12) if aujourd_hui.month == 1 else (aujourd_hui.year, aujourd_hui.month - 1)
+
+def _fichier_kdp_par_defaut(config_path):
+    """
+    Fichier Excel configuré dans config.json (fichiers.nom_fichier_excel_kdp),
+    cherché dans le dossier courant puis à côté de la configuration.
+    """
+    config, _ = charger_configuration(config_path)
+    nom = (config or {}).get('fichiers', {}).get('nom_fichier_excel_kdp')
+    if not nom:
+        return None
+    if not Path(nom).is_file() and (Path(config_path).parent / nom).is_file():
+        return str(Path(config_path).parent / nom)
+    return nom
+
+def _options_communes(parser):
+    parser.add_argument('fichier', nargs='?',
+                        help="Paiements KDP (.xlsx, .csv, .json) ou registre .sqlite (défaut : celui de config.json)")
+    parser.add_argument('--config', default='config.json', help="Fichier de configuration (défaut : config.json)")
+    parser.add_argument('--format', default='both', type=_format_argument,
+                        help="docx, pdf, both ou une liste comme pdf,html,csv (défaut : both)")
+    parser.add_argument('--date-paiement', help="Date de paiement constatée")
+    parser.add_argument('--forcer', action='store_true',
+                        help="Régénérer même les factures dont les données n'ont pas changé")
+    parser.add_argument('--mesures', action='store_true',
+                        help="Afficher la durée et le nombre de lignes de chaque étape")
+    parser.add_argument('--profil', action='store_true',
+                        help="Avec --mesures : profil cProfile des fonctions les plus coûteuses")
+    parser.add_argument('--memoire', action='store_true',
+                        help="Avec --mesures : pic mémoire de chaque étape (tracemalloc, plus lent)")
+
+def _instrumentation_cli(args, en_direct=True):
+    """
+    Instrumentation demandée par --mesures (None sinon) ; en_direct affiche
+    chaque étape sur la sortie d'erreur dès qu'elle se termine.
+    """
+    if not (args.mesures or args.profil or args.memoire):
+        return None
+
+    def afficher(mesure):
+        periode = f" {mesure['periode']}" if mesure['periode'] else ""
+        lignes = f", {mesure['lignes']} lignes" if mesure['lignes'] is not None else ""
+        print(f"⏱️ {mesure['etape']}{periode} : {mesure['duree']:.3f} s{lignes}", file=sys.stderr)
+
+    return Instrumentation(profiler=args.profil, memoire=args.memoire, rappel=afficher if en_direct else None)
+
+def _parser_generate():
+    parser = argparse.ArgumentParser(
+        prog="kdp_invoice_generator generate",
+        description="Génère les factures KDP d'une plage de périodes (toutes par défaut).")
+    _options_communes(parser)
+    parser.add_argument('--from', dest='debut', type=_periode_argument, help="Première période (AAAA-MM)")
+    parser.add_argument('--to', dest='fin', type=_periode_argument,
+                        help="Dernière période (AAAA-MM, défaut : celle de --from)")
+    parser.add_argument('--jobs', type=int, default=1, help="Nombre de processus de rendu (défaut : 1)")
+    parser.add_argument('--json', action='store_true', help="Résultats par période au format JSON sur la sortie standard")
+    parser.add_argument('--zip', metavar='ARCHIVE',
+                        help="Écrire toutes les factures dans cette archive ZIP plutôt que dans dossier_sortie")
+    return parser
+
+def _parser_facture():
+    parser = argparse.ArgumentParser(
+        prog="kdp_invoice_generator",
+        description="Génère la facture KDP d'une période (mois précédent par défaut).",
+        epilog="Pour une plage de périodes : kdp_invoice_generator generate --help ; "
+               "pour le bilan annuel : kdp_invoice_generator bilan --help")
+    _options_communes(parser)
+    parser.add_argument('--annee', type=int, help="Année de la période")
+    parser.add_argument('--mois', type=int, choices=range(1, 13), metavar='{1..12}', help="Mois de la période")
+    parser.add_argument('--numero-facture', help="Numéro de facture personnalisé")
+    return parser
+
+def _parser_bilan():
+    parser = argparse.ArgumentParser(
+        prog="kdp_invoice_generator bilan",
+        description="Archive ZIP de fin d'année : factures mensuelles, PDF regroupé et registre CSV/XLSX.")
+    parser.add_argument('fichier', nargs='?', help="Paiements KDP (.xlsx, .csv, .json) (défaut : celui de config.json)")
+    parser.add_argument('--config', default='config.json', help="Fichier de configuration (défaut : config.json)")
+    parser.add_argument('--annee', type=int, help="Année du bilan (défaut : année précédente)")
+    parser.add_argument('--format', default='pdf', type=_format_argument,
+                        help="Format des factures mensuelles de l'archive (défaut : pdf)")
+    parser.add_argument('--date-paiement', help="Date de paiement constatée")
+    parser.add_argument('--archive', help="Archive ZIP à écrire (défaut : dossier_sortie/Bilan_KDP_AAAA.zip)")
+    parser.add_argument('--jobs', type=int, default=1, help="Nombre de processus de rendu (défaut : 1)")
+    parser.add_argument('--json', action='store_true', help="Résumé du bilan au format JSON sur la sortie standard")
+    return parser
+
+def _commande_bilan(argv):
+    parser = _parser_bilan()
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs doit être au moins 1")
+    annee = datetime.now().year - 1 if args.annee is None else args.annee
+
+    fichier = args.fichier or _fichier_kdp_par_defaut(args.config)
+    if not fichier:
+        parser.error("aucun fichier KDP indiqué ni configuré dans fichiers.nom_fichier_excel_kdp")
+
+    succes, journal, bilan = generer_bilan_annuel(
+        fichier, annee, args.archive, args.format, args.config, args.date_paiement, args.jobs)
+    if args.json:
+        bilan = dict(bilan or {}, succes=succes, annee=annee, journal=journal)
+        if 'durees' in bilan:
+            bilan['durees'] = {nom: round(duree, 3) for nom, duree in bilan['durees'].items()}
+            bilan['periodes'] = [f"{a}-{m:02d}" for a, m in bilan['periodes']]
+        json.dump(bilan, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print(journal)
+    return 0 if succes else 1
+
+def _parser_auteurs():
+    parser = argparse.ArgumentParser(
+        prog="kdp_invoice_generator auteurs",
+        description="Génère les factures de plusieurs auteurs : un sous-dossier par auteur "
+                    "avec son config.json et ses exports KDP (*.xlsx).")
+    parser.add_argument('dossier', help="Dossier contenant un sous-dossier par auteur")
+    parser.add_argument('--format', default='both', type=_format_argument,
+                        help="docx, pdf, both ou une liste comme pdf,html,csv (défaut : both)")
+    parser.add_argument('--date-paiement', help="Date de paiement constatée")
+    parser.add_argument('--forcer', action='store_true',
+                        help="Régénérer même les factures dont les données n'ont pas changé")
+    parser.add_argument('--from', dest='debut', type=_periode_argument, help="Première période (AAAA-MM)")
+    parser.add_argument('--to', dest='fin', type=_periode_argument,
+                        help="Dernière période (AAAA-MM, défaut : celle de --from)")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="Nombre de processus de lecture et de rendu (défaut : 1)")
+    parser.add_argument('--json', action='store_true', help="Résultats par auteur au format JSON sur la sortie standard")
+    return parser
+
+def _commande_auteurs(argv):
+    parser = _parser_auteurs()
+    args = parser.parse_args(argv)
+    if args.fin and not args.debut:
+        parser.error("--to nécessite --from")
+    if args.debut and args.fin and args.fin < args.debut:
+        parser.error("--to doit être postérieur ou égal à --from")
+    if args.jobs < 1:
+        parser.error("--jobs doit être au moins 1")
+    periodes = periodes_entre(args.debut, args.fin or args.debut) if args.debut else None
+
+    succes, journal, resultats = generer_factures_auteurs(
+        args.dossier, periodes, args.format, args.date_paiement, args.jobs, args.forcer)
+    if args.json:
+        json.dump({
+            'succes': succes,
+            'auteurs': [{
+                'auteur': r['auteur'],
+                'succes': r['succes'],
+                'exports': r['exports'],
+                'doublons': r['doublons'],
+                'fichiers': [f for p in r['periodes'] for f in p['fichiers']],
+                'total': formater_montant(sum(int(en_centimes(p['total'])) for p in r['periodes'])),
+                'message': r['message'],
+            } for r in resultats],
+            'journal': journal,
+        }, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print(journal)
+    return 0 if succes else 1
+
+def _parser_importer():
+    parser = argparse.ArgumentParser(
+        prog="kdp_invoice_generator importer",
+        description="Importe des exports KDP dans un registre SQLite des paiements ; "
+                    "les factures peuvent ensuite être générées depuis ce registre.")
+    parser.add_argument('registre', help="Registre des paiements (.sqlite), créé s'il n'existe pas")
+    parser.add_argument('fichiers', nargs='+', help="Exports KDP (.xlsx, .csv, .json) à importer")
+    return parser
+
+def _commande_importer(argv):
+    from registre_paiements_kdp import EXTENSIONS_REGISTRE, RegistrePaiements
+
+    parser = _parser_importer()
+    args = parser.parse_args(argv)
+    if Path(args.registre).suffix.lower() not in EXTENSIONS_REGISTRE:
+        parser.error(f"le registre doit avoir l'extension {', '.join(EXTENSIONS_REGISTRE)}")
+
+    try:
+        registre = RegistrePaiements(args.registre)
+    except sqlite3.Error as e:
+        print(f"Erreur lors de l'ouverture du registre: {e}")
+        return 1
+    succes = True
+    for fichier in args.fichiers:
+        debut = time.perf_counter()
+        try:
+            nombre, msg = registre.importer(fichier)
+        except sqlite3.Error as e:
+            nombre, msg = 0, f"Erreur lors de l'import de {fichier}: {e}"
+        print(f"{'✅' if nombre else '❌'} {msg} ({time.perf_counter() - debut:.2f} s)")
+        succes = succes and bool(nombre)
+    print(f"Registre : {len(registre)} lignes, {len(registre.periodes())} période(s).")
+    return 0 if succes else 1
+
+def _parser_registre():
+    parser = argparse.ArgumentParser(
+        prog="kdp_invoice_generator registre",
+        description="Consulte le registre des numéros de facture (facture.registre) : "
+                    "toutes les factures, la facture d'un paiement ou les paiements d'une facture.")
+    parser.add_argument('--config', default='config.json', help="Fichier de configuration (défaut : config.json)")
+    groupe = parser.add_mutually_exclusive_group()
+    groupe.add_argument('--paiement', help="Numéro de paiement KDP dont on cherche la facture")
+    groupe.add_argument('--facture', help="Numéro de facture dont on cherche la période et les paiements")
+    return parser
+
+def _commande_registre(argv):
+    from registre_factures_kdp import registre_factures
+
+    args = _parser_registre().parse_args(argv)
+    config, msg = charger_configuration(args.config)
+    if not config:
+        print(msg)
+        return 1
+    registre = registre_factures(config)
+    if registre is None:
+        print(f"Le registre des factures n'est pas activé (facture.registre dans {args.config}).")
+        return 1
+
+    if args.paiement:
+        factures = registre.facture_du_paiement(args.paiement)
+        if not factures:
+            print(f"Aucune facture ne couvre le paiement {args.paiement}.")
+            return 1
+        for numero, periode in factures:
+            print(f"{numero} ({periode})")
+    elif args.facture:
+        periode, paiements = registre.paiements_de_facture(args.facture)
+        if periode is None:
+            print(f"Facture {args.facture} inconnue.")
+            return 1
+        print(f"{args.facture} : période {periode}, {len(paiements)} paiement(s)")
+        for paiement in paiements:
+            print(f"  {paiement}")
+    else:
+        for periode, numero, nombre in registre.factures():
+            print(f"{periode}  {numero}  {nombre} paiement(s)")
+    return 0
+
+def _commande_generate(argv):
+    parser = _parser_generate()
+    args = parser.parse_args(argv)
+    if args.fin and not args.debut:
+        parser.error("--to nécessite --from")
+    if args.debut and args.fin and args.fin < args.debut:
+        parser.error("--to doit être postérieur ou égal à --from")
+    if args.jobs < 1:
+        parser.error("--jobs doit être au moins 1")
+
+    fichier = args.fichier or _fichier_kdp_par_defaut(args.config)
+    if not fichier:
+        parser.error("aucun fichier KDP indiqué ni configuré dans fichiers.nom_fichier_excel_kdp")
+    periodes = periodes_entre(args.debut, args.fin or args.debut) if args.debut else None
+
+    debut = time.perf_counter()
+    sortie = SortieZip(args.zip) if args.zip else None
+    mesures = _instrumentation_cli(args, en_direct=not args.json)
+    try:
+        succes, journal, resultats = generer_factures_lot(
+            fichier, periodes, args.format, args.config, args.date_paiement, args.jobs, args.forcer,
+            sortie=sortie, instrumentation=mesures)
+    finally:
+        if sortie:
+            sortie.fermer()
+
+    if args.json:
+        json.dump({
+            'succes': succes,
+            'fichier': str(fichier),
+            'format': args.format,
+            'duree': round(time.perf_counter() - debut, 3),
+            'total': formater_montant(sum(int(en_centimes(r['total'])) for r in resultats)),
+            'periodes': [{
+                'periode': f"{r['annee']}-{r['mois']:02d}",
+                'succes': r['succes'],
+                'reutilise': r['reutilise'],
+                'total': formater_montant(en_centimes(r['total'])),
+                'duree': round(r['duree'], 3),
+                'fichiers': r['fichiers'],
+                'message': r['message'],
+                **({'mesures': r['mesures']} if mesures else {}),
+            } for r in resultats],
+            'journal': journal,
+            **({'etapes': mesures.synthese()} if mesures else {}),
+        }, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print(journal)
+        if mesures:
+            print(mesures.resume())
+    return 0 if succes else 1
+
+def _commande_facture(argv):
+    parser = _parser_facture()
+    args = parser.parse_args(argv)
+    annee_defaut, mois_defaut = _mois_precedent()
+    annee = annee_defaut if args.annee is None else args.annee
+    mois = mois_defaut if args.mois is None else args.mois
+
+    fichier = args.fichier or _fichier_kdp_par_defaut(args.config)
+    if not fichier:
+        parser.error("aucun fichier KDP indiqué ni configuré dans fichiers.nom_fichier_excel_kdp")
+
+    mesures = _instrumentation_cli(args)
+    succes, journal, _ = generer_facture_logic(
+        fichier, annee, mois, args.format, args.config,
+        args.numero_facture, args.date_paiement, args.forcer, instrumentation=mesures)
+    print(journal)
+    if mesures:
+        print(mesures.resume())
+    return 0 if succes else 1
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    try:
+        if argv and argv[0] == 'generate':
+            return _commande_generate(argv[1:])
+        if argv and argv[0] == 'bilan':
+            return _commande_bilan(argv[1:])
+        if argv and argv[0] == 'auteurs':
+            return _commande_auteurs(argv[1:])
+        if argv and argv[0] == 'importer':
+            return _commande_importer(argv[1:])
+        if argv and argv[0] == 'registre':
+            return _commande_registre(argv[1:])
+        return _commande_facture(argv)
+    except SystemExit as e:
+        # argparse : 0 pour --help, 2 pour des arguments invalides
+        return e.code if isinstance(e.code, int) else 2
+
+
 if __name__ == "__main__":
-    print("Utilisez generateur_factures_kdp.py pour l’interface graphique.")
+    sys.exit(main())
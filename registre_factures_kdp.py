@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Registre SQLite des numéros de facture (facture.registre dans config.json) :
+période ↔ numéro de facture ↔ numéros de paiement KDP couverts.
+Usage : python kdp_invoice_generator.py registre [--paiement N | --facture N]
+"""
+
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from donnees_kdp import generer_numero_facture, normaliser_numeros_paiement
+
+# Activé par facture.registre dans config.json. Chaque période reçoit un numéro
+# une fois pour toutes : les régénérations le retrouvent par la clé primaire en
+# lecture seule, et un nouveau numéro n'est attribué que dans une transaction
+# BEGIN IMMEDIATE, qui sérialise les attributions entre processus (lots
+# parallèles, CLI et interface lancés en même temps). {sequence} dans format_numero reçoit le
+# numéro d'ordre suivant. Les numéros de paiement couverts par chaque facture
+# sont indexés.
+SCHEMA_FACTURES = """
+CREATE TABLE IF NOT EXISTS factures (
+    periode TEXT PRIMARY KEY,
+    numero TEXT NOT NULL UNIQUE,
+    sequence INTEGER,
+    cree_le TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS factures_paiements (
+    numero_paiement TEXT NOT NULL,
+    periode TEXT NOT NULL REFERENCES factures (periode),
+    PRIMARY KEY (numero_paiement, periode)
+);
+CREATE INDEX IF NOT EXISTS factures_paiements_periode ON factures_paiements (periode);
+"""
+
+class RegistreFactures:
+    """
+    Registre SQLite des numéros de facture : période ↔ numéro ↔ paiements.
+    """
+    def __init__(self, chemin):
+        self.chemin = Path(chemin)
+        self.chemin.parent.mkdir(parents=True, exist_ok=True)
+        cnx = sqlite3.connect(self.chemin, timeout=30)
+        try:
+            cnx.executescript(SCHEMA_FACTURES)
+            with cnx:
+                self._normaliser_numeros(cnx)
+        finally:
+            cnx.close()
+
+    @staticmethod
+    def _normaliser_numeros(cnx):
+        # Paiements indexés avant normaliser_numeros_paiement : '1234567005.0' devient
+        # '1234567005', sans doublon avec l'entrée déjà présente sous ce numéro.
+        anciens = [n for n, in cnx.execute("SELECT DISTINCT numero_paiement FROM factures_paiements "
+                                           "WHERE numero_paiement LIKE '%.0'")]
+        if not anciens:
+            return
+        for ancien, numero in zip(anciens, normaliser_numeros_paiement(anciens).tolist()):
+            if numero != ancien:
+                cnx.execute("UPDATE OR IGNORE factures_paiements SET numero_paiement = ? "
+                            "WHERE numero_paiement = ?", (numero, ancien))
+                cnx.execute("DELETE FROM factures_paiements WHERE numero_paiement = ?", (ancien,))
+
+    @contextmanager
+    def _transaction(self):
+        # isolation_level=None : transactions explicites, BEGIN IMMEDIATE prend le
+        # verrou d'écriture dès le début (les autres processus attendent jusqu'à 30 s)
+        cnx = sqlite3.connect(self.chemin, timeout=30, isolation_level=None)
+        try:
+            cnx.execute("BEGIN IMMEDIATE")
+            try:
+                yield cnx
+            except BaseException:
+                cnx.execute("ROLLBACK")
+                raise
+            cnx.execute("COMMIT")
+        finally:
+            cnx.close()
+
+    def _lire(self, requete, parametres):
+        cnx = sqlite3.connect(self.chemin, timeout=30)
+        try:
+            return cnx.execute(requete, parametres).fetchall()
+        finally:
+            cnx.close()
+
+    def numero(self, config, annee, mois, paiements=(), numero_personnalise=None):
+        """
+        Numéro de la facture de la période : celui déjà attribué, sinon
+        numero_personnalise ou un nouveau numéro (séquence suivante).
+        Un numéro émis n'est jamais remplacé ni sa séquence réutilisée : lève
+        ValueError si numero_personnalise diffère du numéro déjà attribué à la
+        période, ou s'il est déjà celui d'une autre période.
+        """
+        periode = f"{annee}-{mois:02d}"
+        paiements = set(normaliser_numeros_paiement(list(paiements)).dropna())
+        # Cas courant (régénération) : lecture seule, sans prendre le verrou d'écriture
+        # quand la période a déjà son numéro et que tous ses paiements sont indexés
+        ligne = self._lire("SELECT numero FROM factures WHERE periode = ?", (periode,))
+        if ligne:
+            self._verifier_numero(periode, ligne[0][0], numero_personnalise)
+            if paiements <= {p for p, in self._lire("SELECT numero_paiement FROM factures_paiements "
+                                                     "WHERE periode = ?", (periode,))}:
+                return ligne[0][0]
+        with self._transaction() as cnx:
+            ligne = cnx.execute("SELECT numero FROM factures WHERE periode = ?", (periode,)).fetchone()
+            if ligne:
+                self._verifier_numero(periode, ligne[0], numero_personnalise)
+                numero = ligne[0]
+            else:
+                sequence = None
+                if not numero_personnalise:
+                    sequence = cnx.execute("SELECT COALESCE(MAX(sequence), 0) + 1 FROM factures").fetchone()[0]
+                numero = generer_numero_facture(config, annee, mois, numero_personnalise, sequence)
+                autre = cnx.execute("SELECT periode FROM factures WHERE numero = ?", (numero,)).fetchone()
+                if autre:
+                    raise ValueError(f"Le numéro {numero} est déjà attribué à la facture de {autre[0]}.")
+                cnx.execute("INSERT INTO factures VALUES (?, ?, ?, ?)",
+                            (periode, numero, sequence, datetime.now().isoformat(timespec='seconds')))
+            cnx.executemany("INSERT OR IGNORE INTO factures_paiements VALUES (?, ?)",
+                            ((p, periode) for p in paiements))
+        return numero
+
+    @staticmethod
+    def _verifier_numero(periode, numero, numero_personnalise):
+        if numero_personnalise not in (None, numero):
+            raise ValueError(f"La facture de {periode} porte déjà le numéro {numero} ; "
+                             f"un numéro émis ne peut pas être remplacé par {numero_personnalise}.")
+
+    def factures(self):
+        """
+        [(période, numéro, nombre de paiements)] par période.
+        """
+        return self._lire("SELECT f.periode, f.numero, COUNT(p.numero_paiement) FROM factures f "
+                          "LEFT JOIN factures_paiements p ON p.periode = f.periode "
+                          "GROUP BY f.periode ORDER BY f.periode", ())
+
+    def facture_du_paiement(self, numero_paiement):
+        """
+        [(numéro de facture, période)] des factures couvrant ce paiement.
+        """
+        return self._lire("SELECT f.numero, f.periode FROM factures_paiements p "
+                          "JOIN factures f ON f.periode = p.periode WHERE p.numero_paiement = ? "
+                          "ORDER BY f.periode", (normaliser_numeros_paiement([numero_paiement])[0],))
+
+    def paiements_de_facture(self, numero):
+        """
+        (période, [numéros de paiement]) de la facture, ou (None, []) si elle est inconnue.
+        """
+        lignes = self._lire("SELECT f.periode, p.numero_paiement FROM factures f "
+                            "LEFT JOIN factures_paiements p ON p.periode = f.periode "
+                            "WHERE f.numero = ? ORDER BY p.numero_paiement", (numero,))
+        if not lignes:
+            return None, []
+        return lignes[0][0], [paiement for _, paiement in lignes if paiement is not None]
+
+_registres_factures = {}
+
+def registre_factures(config):
+    """
+    RegistreFactures de la configuration (facture.registre), None s'il n'est pas activé.
+    """
+    chemin = config.get('facture', {}).get('registre')
+    if not chemin:
+        return None
+    if chemin not in _registres_factures:
+        _registres_factures[chemin] = RegistreFactures(chemin)
+    return _registres_factures[chemin]
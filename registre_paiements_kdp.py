@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Registre SQLite des paiements KDP : les lignes 'Paiements' de plusieurs exports
+conservées dans une base locale, utilisable à la place du fichier Excel.
+Usage : python kdp_invoice_generator.py importer paiements.sqlite KDP_Payments.xlsx [...]
+"""
+
+import calendar
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+from donnees_kdp import (
+    KdpReport, en_centimes, lire_fichier_kdp, normaliser_numeros_paiement, typer_colonnes,
+)
+
+# Les lignes 'Paiements' de tous les exports importés sont conservées dans une
+# base SQLite locale. Chaque ligne est identifiée par son numéro de paiement
+# (celui de la ligne principale qui la précède, pour les détails) et sa position
+# dans ce paiement : réimporter un export, ou un export qui en chevauche un autre,
+# met à jour les lignes existantes au lieu de les dupliquer. La colonne `ordre`
+# conserve l'ordre des fichiers : les paiements d'une période sont relus dans
+# l'ordre de leur ligne principale, chacun suivi de ses détails par position
+# (dont dépend le rattachement des détails).
+EXTENSIONS_REGISTRE = ('.sqlite', '.sqlite3', '.db')
+
+SCHEMA_REGISTRE = """
+CREATE TABLE IF NOT EXISTS paiements (
+    numero TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    ordre INTEGER NOT NULL,
+    principale INTEGER NOT NULL,
+    periode TEXT,
+    date_debut TEXT,
+    marche TEXT,
+    devise TEXT,
+    redevance REAL,
+    taux_change REAL,
+    montant REAL,
+    redevance_cts INTEGER NOT NULL,
+    montant_cts INTEGER NOT NULL,
+    detail TEXT,
+    source TEXT,
+    avec_source INTEGER NOT NULL,
+    fichier TEXT,
+    PRIMARY KEY (numero, position)
+);
+CREATE INDEX IF NOT EXISTS paiements_periode ON paiements (periode, ordre);
+CREATE INDEX IF NOT EXISTS paiements_marche ON paiements (marche, periode);
+"""
+
+class RegistrePaiements:
+    """
+    Registre SQLite des paiements KDP, utilisable partout où un KdpReport l'est
+    (periodes(), extraire_periode(), len()). Une connexion est ouverte pour
+    chaque opération : le registre peut être partagé entre threads.
+    """
+    def __init__(self, chemin):
+        self.chemin = Path(chemin)
+        with self._connexion() as cnx:
+            cnx.executescript(SCHEMA_REGISTRE)
+            self._normaliser_numeros(cnx)
+
+    @staticmethod
+    def _normaliser_numeros(cnx):
+        # Registres importés avant normaliser_numeros_paiement : '1234567005.0' devient
+        # '1234567005' ; la ligne déjà présente sous le numéro canonique est conservée.
+        anciens = [n for n, in cnx.execute("SELECT DISTINCT numero FROM paiements WHERE numero LIKE '%.0'")]
+        if not anciens:
+            return
+        for ancien, numero in zip(anciens, normaliser_numeros_paiement(anciens).tolist()):
+            if numero != ancien:
+                cnx.execute("UPDATE OR IGNORE paiements SET numero = ? WHERE numero = ?", (numero, ancien))
+                cnx.execute("DELETE FROM paiements WHERE numero = ?", (ancien,))
+
+    @contextmanager
+    def _connexion(self):
+        cnx = sqlite3.connect(self.chemin)
+        try:
+            with cnx:  # transaction validée ou annulée en bloc
+                yield cnx
+        finally:
+            cnx.close()
+
+    def __len__(self):
+        with self._connexion() as cnx:
+            return cnx.execute("SELECT COUNT(*) FROM paiements").fetchone()[0]
+
+    def importer(self, source, nom=None):
+        """
+        Ajoute ou met à jour les lignes d'un export KDP (chemin d'un fichier ou
+        DataFrame de la feuille 'Paiements'). Les détails qu'un paiement n'a
+        plus dans la nouvelle version de l'export sont supprimés.
+        Renvoie (nombre de lignes importées, message).
+        """
+        if isinstance(source, (str, Path)):
+            df, msg = lire_fichier_kdp(source)
+            if df is None:
+                return 0, msg
+            nom = nom or Path(source).name
+        else:
+            df = source
+
+        # Numéro du paiement de chaque ligne (les détails suivent leur ligne principale)
+        numeros = normaliser_numeros_paiement(df['Numéro de paiement'])
+        est_principale = numeros.notna()
+        numeros = numeros.ffill()
+        rattachees = numeros.notna().to_numpy()
+        lignes = df[rattachees]
+        numeros = numeros[rattachees].astype(str)
+        positions = numeros.groupby(numeros, sort=False).cumcount()
+        periodes = KdpReport(df).df['Période'][rattachees]
+        dates = pd.to_datetime(lignes['Période de vente - Date de début'], errors='coerce')
+
+        def colonne(nom_colonne, convertir=None):
+            if nom_colonne not in lignes.columns:
+                return [None] * len(lignes)
+            valeurs = lignes[nom_colonne].astype(object)
+            return [None if pd.isna(v) else (convertir(v) if convertir else v) for v in valeurs]
+
+        valeurs = list(zip(
+            numeros.tolist(),
+            positions.tolist(),
+            range(len(lignes)),
+            est_principale[rattachees].astype(int).tolist(),
+            [None if pd.isna(p) else str(p) for p in periodes],
+            [None if pd.isna(d) else d.date().isoformat() for d in dates],
+            colonne('Marché', str),
+            colonne('Devise', str),
+            colonne('Redevance accumulée', float),
+            colonne('Taux de change', float),
+            colonne('Montant du paiement', float),
+            en_centimes(lignes['Redevance accumulée'].fillna(0)).tolist(),
+            en_centimes(lignes['Montant du paiement'].fillna(0)).tolist(),
+            colonne('Détail', str),
+            colonne('Source', str),
+            [int('Source' in lignes.columns)] * len(lignes),
+            [nom] * len(lignes),
+        ))
+        nb_positions = numeros.value_counts(sort=False)
+
+        with self._connexion() as cnx:
+            premier = cnx.execute("SELECT COALESCE(MAX(ordre), -1) + 1 FROM paiements").fetchone()[0]
+            cnx.executemany("""
+                INSERT INTO paiements VALUES (?, ?, ? + ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (numero, position) DO UPDATE SET
+                    principale = excluded.principale, periode = excluded.periode,
+                    date_debut = excluded.date_debut, marche = excluded.marche, devise = excluded.devise,
+                    redevance = excluded.redevance, taux_change = excluded.taux_change,
+                    montant = excluded.montant, redevance_cts = excluded.redevance_cts,
+                    montant_cts = excluded.montant_cts, detail = excluded.detail, source = excluded.source,
+                    avec_source = excluded.avec_source, fichier = excluded.fichier
+                """, ((v[0], v[1], premier, *v[2:]) for v in valeurs))
+            cnx.executemany("DELETE FROM paiements WHERE numero = ? AND position >= ?",
+                            nb_positions.items())
+        return len(valeurs), f"{len(valeurs)} lignes importées ({len(nb_positions)} paiements) depuis {nom or 'le rapport'}."
+
+    def periodes(self):
+        """
+        Liste triée des périodes (année, mois) ayant au moins une ligne principale.
+        """
+        with self._connexion() as cnx:
+            lignes = cnx.execute("SELECT DISTINCT periode FROM paiements "
+                                 "WHERE principale = 1 AND periode IS NOT NULL ORDER BY periode").fetchall()
+        return [(int(p[:4]), int(p[5:7])) for p, in lignes]
+
+    def extraire_periode(self, annee, mois):
+        """
+        Lignes d'une période, dans l'ordre des exports et avec les colonnes d'un
+        fichier KDP. Les totaux des lignes principales par marché sont agrégés
+        par SQL et joints au DataFrame (attrs['totaux_marches'], en centimes)
+        pour regrouper_par_marche.
+        """
+        periode = f"{annee}-{mois:02d}"
+        with self._connexion() as cnx:
+            # Chaque paiement reste d'un bloc, à la place de sa ligne principale : un détail
+            # ajouté par un export plus récent a un `ordre` postérieur à tous les autres.
+            lignes = pd.read_sql_query(
+                "SELECT d.* FROM paiements d LEFT JOIN paiements p ON p.numero = d.numero AND p.position = 0 "
+                "WHERE d.periode = ? ORDER BY COALESCE(p.ordre, d.ordre), d.position",
+                cnx, params=(periode,))
+            totaux = cnx.execute("SELECT marche, SUM(redevance_cts), SUM(montant_cts) FROM paiements "
+                                 "WHERE periode = ? AND principale = 1 GROUP BY marche", (periode,)).fetchall()
+        if lignes.empty or not (lignes['principale'] == 1).any():
+            return None, f"Aucune donnée trouvée pour {calendar.month_name[mois]} {annee}"
+
+        donnees = pd.DataFrame({
+            'Période de vente - Date de début': pd.to_datetime(lignes['date_debut']),
+            'Marché': lignes['marche'],
+            'Numéro de paiement': lignes['numero'].where(lignes['principale'] == 1),
+            'Devise': lignes['devise'],
+            'Redevance accumulée': lignes['redevance'].astype('float64'),
+            'Montant du paiement': lignes['montant'].astype('float64'),
+            'Taux de change': lignes['taux_change'].astype('float64'),
+            'Détail': lignes['detail'],
+        })
+        if lignes['avec_source'].any():
+            donnees['Source'] = lignes['source']
+        typer_colonnes(donnees)
+        donnees['Période'] = pd.Period(periode, freq='M')
+        donnees.attrs['totaux_marches'] = {marche: (origine, eur) for marche, origine, eur in totaux}
+        return donnees, f"Données trouvées : {len(donnees)} lignes."
+
+def ouvrir_registre_paiements(chemin):
+    """
+    Ouvre un registre existant. Renvoie (RegistrePaiements ou None, message).
+    """
+    if not Path(chemin).is_file():
+        return None, f"ERREUR: Le registre '{chemin}' est introuvable."
+    try:
+        registre = RegistrePaiements(chemin)
+        return registre, f"Registre ouvert : {len(registre)} lignes."
+    except sqlite3.Error as e:
+        return None, f"Erreur lors de l'ouverture du registre: {e}"
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Service HTTP local de génération de factures KDP (asyncio, bibliothèque standard).
+Usage : python serveur_factures_kdp.py [--hote 127.0.0.1] [--port 8765] [--config config.json] [--jobs N]
+
+  POST /invoices   corps JSON : {"fichier": "KDP_Payments.xlsx", "annee": 2025, "mois": 5,
+                                 "format": "pdf", "numero_facture": "...", "date_paiement": "...",
+                                 "sortie": "octets" | "fichier"}
+      sortie "octets" (défaut) : renvoie directement le PDF / DOCX / HTML / CSV (une archive ZIP
+                                 pour plusieurs formats, ex. "both" ou "pdf,csv"), rien n'est
+                                 écrit dans dossier_sortie ;
+      sortie "fichier"         : appelle generer_facture_logic et renvoie son résultat en JSON.
+  GET /health      état du service.
+
+Les rapports KDP lus restent en mémoire (rechargés si le fichier change) et le
+rendu est confié à un pool de processus préchauffé (pandas, python-docx, fpdf2
+et la police PDF déjà chargés).
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import kdp_invoice_generator as kdp
+
+TYPES_MIME = {
+    'pdf': 'application/pdf',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'html': 'text/html; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+    'zip': 'application/zip',
+}
+RAPPORTS_EN_MEMOIRE = 8
+TAILLE_MAX_REQUETE = 1 << 20
+STATUTS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 422: "Unprocessable Entity", 500: "Internal Server Error"}
+
+
+class ErreurRequete(Exception):
+    def __init__(self, statut, message):
+        super().__init__(message)
+        self.statut = statut
+
+
+def _prechauffer():
+    """
+    Initialisation de chaque processus de rendu : imports lourds et police PDF
+    chargés une fois pour toutes, avant la première facture.
+    """
+    import pandas  # noqa: F401
+    import docx  # noqa: F401
+    import fpdf  # noqa: F401
+    kdp.setup_locale()
+    kdp._police_pdf()
+
+
+class ServeurFactures:
+    def __init__(self, config_path='config.json', dossier_rapports='.', jobs=None):
+        self.config_path = config_path
+        self.dossier_rapports = Path(dossier_rapports).resolve()
+        self.jobs = jobs or os.cpu_count() or 1
+        self.pool = None
+        self.rapports = OrderedDict()  # chemin -> (signature du fichier, KdpReport)
+        self.verrous = {}
+
+    # ---------- DONNÉES ----------------------------------------------------------
+    def _configuration(self):
+        config, msg = kdp.charger_configuration(self.config_path)
+        if not config:
+            raise ErreurRequete(500, msg)
+        return config
+
+    def _chemin_rapport(self, fichier):
+        chemin = (self.dossier_rapports / fichier).resolve()
+        if self.dossier_rapports not in chemin.parents:
+            raise ErreurRequete(400, f"Fichier hors du dossier des rapports : {fichier}")
+        if not chemin.is_file():
+            raise ErreurRequete(404, f"Fichier introuvable : {fichier}")
+        return chemin
+
+    async def _rapport(self, chemin):
+        """
+        KdpReport du fichier, lu une seule fois tant qu'il n'est pas modifié.
+        Un verrou par fichier évite de lire deux fois le même rapport en parallèle.
+        """
+        verrou = self.verrous.setdefault(chemin, asyncio.Lock())
+        async with verrou:
+            st = chemin.stat()
+            signature = (st.st_size, st.st_mtime_ns)
+            entree = self.rapports.get(chemin)
+            if entree and entree[0] == signature:
+                self.rapports.move_to_end(chemin)
+                return entree[1]
+            dossier_cache = Path(self.config_path).parent / kdp.DOSSIER_CACHE
+            rapport, msg = await asyncio.get_running_loop().run_in_executor(
+                None, kdp.charger_rapport_kdp, chemin, dossier_cache)
+            if rapport is None:
+                raise ErreurRequete(422, msg)
+            self.rapports[chemin] = (signature, rapport)
+            while len(self.rapports) > RAPPORTS_EN_MEMOIRE:
+                self.rapports.popitem(last=False)
+            return rapport
+
+    # ---------- FACTURES ---------------------------------------------------------
+    @staticmethod
+    def _lire_demande(corps):
+        try:
+            demande = json.loads(corps or b'{}')
+            annee, mois = int(demande['annee']), int(demande['mois'])
+        except (ValueError, KeyError, TypeError) as e:
+            raise ErreurRequete(400, f"Demande invalide : {e}")
+        if not 1 <= mois <= 12:
+            raise ErreurRequete(400, f"Mois invalide : {mois}")
+        if not demande.get('fichier'):
+            raise ErreurRequete(400, "Champ 'fichier' manquant")
+        return demande, annee, mois
+
+    async def facture(self, corps):
+        demande, annee, mois = self._lire_demande(corps)
+        chemin = self._chemin_rapport(demande['fichier'])
+        fmt = demande.get('format', 'pdf')
+        boucle = asyncio.get_running_loop()
+
+        if demande.get('sortie', 'octets') == 'fichier':
+            succes, message, fichiers = await boucle.run_in_executor(
+                None, kdp.generer_facture_logic, str(chemin), annee, mois, fmt, self.config_path,
+                demande.get('numero_facture'), demande.get('date_paiement'))
+            return 200 if succes else 422, self._json({'succes': succes, 'message': message,
+                                                       'fichiers': fichiers}), {}
+
+        try:
+            formats = kdp.formats_demandes(fmt)
+        except ValueError as e:
+            raise ErreurRequete(400, str(e))
+        config = self._configuration()
+        rapport = await self._rapport(chemin)
+
+        # Regroupement et mise en page dans un thread, rendu dans le pool de processus
+        def mettre_en_page():
+            donnees, msg = rapport.extraire_periode(annee, mois)
+            if donnees is None:
+                raise ErreurRequete(422, msg)
+            marches_data, logs = kdp._regrouper_periode(donnees)
+            if marches_data is None:
+                raise ErreurRequete(422, "\n".join(logs))
+            try:
+                numero = kdp.attribuer_numero_facture(config, annee, mois, donnees, demande.get('numero_facture'))
+            except (ValueError, sqlite3.Error) as e:
+                raise ErreurRequete(422, str(e))
+            return kdp.construire_mise_en_page(marches_data, annee, mois, config,
+                                               numero, demande.get('date_paiement'))
+
+        mise_en_page = await boucle.run_in_executor(None, mettre_en_page)
+        rendus = await asyncio.gather(*(boucle.run_in_executor(self.pool, kdp._rendre_format, mise_en_page, f)
+                                        for f in formats))
+        if len(formats) == 1:
+            octets, nom, _ = rendus[0]
+        else:
+            # Plusieurs formats : une archive ZIP construite en mémoire
+            tampon = io.BytesIO()
+            with kdp.SortieZip(tampon) as archive:
+                for octets, nom, _ in rendus:
+                    archive.ecrire(nom.name, octets)
+            octets, nom = tampon.getvalue(), nom.with_suffix('.zip')
+        return 200, octets, {
+            'Content-Type': TYPES_MIME[nom.suffix[1:]],
+            'Content-Disposition': f'attachment; filename="{nom.name}"',
+            'X-Numero-Facture': mise_en_page.numero,
+            'X-Montant-Total': mise_en_page.total,
+        }
+
+    # ---------- HTTP -------------------------------------------------------------
+    @staticmethod
+    def _json(valeur):
+        return json.dumps(valeur, ensure_ascii=False).encode('utf-8')
+
+    async def _router(self, methode, chemin, corps):
+        chemin = chemin.split('?', 1)[0]
+        if chemin == '/invoices':
+            if methode != 'POST':
+                raise ErreurRequete(405, "Utilisez POST /invoices")
+            return await self.facture(corps)
+        if chemin == '/health':
+            return 200, self._json({'statut': 'ok', 'processus': self.jobs,
+                                    'rapports_en_memoire': len(self.rapports)}), {}
+        raise ErreurRequete(404, f"Chemin inconnu : {chemin}")
+
+    async def connexion(self, reader, writer):
+        """
+        Traite les requêtes HTTP/1.1 d'une connexion (keep-alive) jusqu'à sa fermeture.
+        """
+        try:
+            while True:
+                ligne = await reader.readline()
+                if not ligne:
+                    break
+                try:
+                    methode, chemin, version = ligne.decode('latin-1').split()
+                except ValueError:
+                    break
+                entetes = {}
+                while True:
+                    ligne = await reader.readline()
+                    if ligne in (b'\r\n', b'\n', b''):
+                        break
+                    cle, _, valeur = ligne.decode('latin-1').partition(':')
+                    entetes[cle.strip().lower()] = valeur.strip()
+
+                debut = time.perf_counter()
+                supplementaires = {}
+                try:
+                    longueur = int(entetes.get('content-length', 0))
+                    if longueur > TAILLE_MAX_REQUETE:
+                        raise ErreurRequete(413, "Requête trop volumineuse")
+                    corps = await reader.readexactly(longueur) if longueur else b''
+                    statut, reponse, supplementaires = await self._router(methode, chemin, corps)
+                except ErreurRequete as e:
+                    statut, reponse = e.statut, self._json({'erreur': str(e)})
+                except Exception as e:
+                    statut, reponse = 500, self._json({'erreur': f"{type(e).__name__}: {e}"})
+
+                garder = version == 'HTTP/1.1' and entetes.get('connection', '').lower() != 'close'
+                entete = {
+                    'Content-Type': 'application/json; charset=utf-8',
+                    'Content-Length': str(len(reponse)),
+                    'Connection': 'keep-alive' if garder else 'close',
+                    'X-Duree': f"{time.perf_counter() - debut:.3f}",
+                    **supplementaires,
+                }
+                tete = f"HTTP/1.1 {statut} {STATUTS.get(statut, '')}\r\n" + \
+                       "".join(f"{cle}: {valeur}\r\n" for cle, valeur in entete.items()) + "\r\n"
+                writer.write(tete.encode('latin-1', 'replace') + reponse)
+                await writer.drain()
+                if not garder:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def demarrer(self, hote='127.0.0.1', port=8765):
+        self._configuration()  # erreur immédiate si config.json est invalide
+        self.pool = ProcessPoolExecutor(max_workers=self.jobs, initializer=_prechauffer)
+        # Démarre tous les processus maintenant plutôt qu'à la première facture
+        boucle = asyncio.get_running_loop()
+        await asyncio.gather(*(boucle.run_in_executor(self.pool, time.sleep, 0) for _ in range(self.jobs)))
+        serveur = await asyncio.start_server(self.connexion, hote, port)
+        print(f"Service de factures KDP sur http://{hote}:{port} ({self.jobs} processus de rendu)", flush=True)
+        try:
+            async with serveur:
+                await serveur.serve_forever()
+        finally:
+            self.pool.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Service HTTP local de génération de factures KDP.")
+    parser.add_argument('--hote', default='127.0.0.1', help="Adresse d'écoute (défaut : 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8765, help="Port d'écoute (défaut : 8765)")
+    parser.add_argument('--config', default='config.json', help="Fichier de configuration (défaut : config.json)")
+    parser.add_argument('--dossier-rapports', default='.',
+                        help="Dossier contenant les fichiers KDP accessibles au service (défaut : dossier courant)")
+    parser.add_argument('--jobs', type=int, help="Nombre de processus de rendu (défaut : nombre de cœurs)")
+    args = parser.parse_args(argv)
+
+    serveur = ServeurFactures(args.config, args.dossier_rapports, args.jobs)
+    try:
+        asyncio.run(serveur.demarrer(args.hote, args.port))
+    except ErreurRequete as e:
+        print(e, file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+import json
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+ENTETES = ['Période de vente - Date de début', 'Marché', 'Numéro de paiement', 'Devise',
+           'Redevance accumulée', 'Taux de change', 'Montant du paiement', 'Détail', 'Source']
+
+CONFIG = {
+    'entreprise': {'nom': "DUBOIS Jean", 'adresse': "12, Rue des Lilas\n44340 Bouguenais\nFRANCE",
+                   'siret': "123 456 789 00012", 'tva_intra': "FRXX123456789",
+                   'iban': "FR7612345987650123456789012", 'bic': "BDFEFRPPXXX"},
+    'client': {'nom': "Amazon Media EU S.à r.l.", 'adresse': "5 rue Plaetis\nL-2338 Luxembourg\nLUXEMBOURG",
+               'tva_intra': "LU20260743"},
+    'facture': {'prefixe_numero': "FACT", 'format_numero': "{annee}-{mois:02d}-01",
+                'date_paiement_defaut': "30 jours date de facture", 'mode_reglement': "Virement bancaire"},
+    'fichiers': {'dossier_sortie': "./", 'format_nom_sortie': "Facture_KDP_{annee}-{mois:02d}.docx"},
+    'messages': {'autoliquidation': "Autoliquidation -- TVA due par le preneur."},
+}
+
+
+def ligne_paiement(numero, marche, devise, redevance, montant, taux=None, mois=1):
+    return [datetime(2025, mois, 1), marche, numero, devise, redevance, taux, montant, None, None]
+
+
+def ligne_detail(devise, montant, titre, mois=1):
+    return [None, None, None, devise, montant, None, None, f"2025-{mois:02d} eBook", titre]
+
+
+@pytest.fixture
+def export_kdp(tmp_path):
+    """
+    Écrit une feuille 'Paiements' (ENTETES puis `lignes`) dans un xlsx et renvoie son chemin.
+    """
+    def ecrire(lignes, nom="export.xlsx"):
+        from openpyxl import Workbook
+
+        classeur = Workbook()
+        feuille = classeur.active
+        feuille.title = "Paiements"
+        feuille.append(ENTETES)
+        for ligne in lignes:
+            feuille.append(ligne)
+        chemin = tmp_path / nom
+        classeur.save(chemin)
+        return chemin
+    return ecrire
+
+
+@pytest.fixture
+def config_kdp(tmp_path):
+    """
+    Chemin d'un config.json valide (CONFIG) dans tmp_path.
+    """
+    chemin = tmp_path / "config.json"
+    chemin.write_text(json.dumps(CONFIG), encoding='utf-8')
+    return chemin
@@ -0,0 +1,48 @@
+import io
+import multiprocessing
+import zipfile
+
+import pytest
+
+import kdp_invoice_generator as kdp
+from conftest import ligne_detail, ligne_paiement
+
+LIGNES = [
+    ligne
+    for mois in (1, 2, 3)
+    for ligne in (ligne_paiement(f"P{mois}", "Amazon.fr", "EUR", 3.0, 3.0, mois=mois),
+                  ligne_detail("EUR", 3.0, "Livre A", mois=mois))
+]
+
+
+def _rendu_html_sauf_fevrier(mise_en_page):
+    if mise_en_page.mois == 2:
+        raise RuntimeError("caractère absent de la police")
+    return kdp.rendre_html(mise_en_page)
+
+
+@pytest.fixture
+def rendu_html_en_erreur_en_fevrier(monkeypatch):
+    monkeypatch.setitem(kdp.MOTEURS_RENDU, 'html', ('.html', _rendu_html_sauf_fevrier,
+                                                    lambda texte: texte.encode('utf-8')))
+
+
+@pytest.mark.parametrize('jobs', [
+    1,
+    pytest.param(2, marks=pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                                             reason="le rendu de remplacement doit être hérité")),
+])
+def test_rendu_en_echec_ecarte_la_periode(rendu_html_en_erreur_en_fevrier, export_kdp, config_kdp, jobs):
+    archive = io.BytesIO()
+    succes, journal, bilan = kdp.generer_bilan_annuel(
+        export_kdp(LIGNES), 2025, archive=archive, format_sortie='html', config_path=config_kdp, jobs=jobs)
+    assert not succes
+    assert "❌ 2025-02 (html) : RuntimeError: caractère absent de la police" in journal
+    assert bilan['periodes'] == [(2025, 1), (2025, 3)]
+    with zipfile.ZipFile(archive) as zf:
+        assert sorted(zf.namelist()) == [
+            'Factures_KDP_2025.pdf', 'Registre_KDP_2025.csv', 'Registre_KDP_2025.xlsx',
+            'factures/Facture_KDP_2025-01.html', 'factures/Facture_KDP_2025-03.html',
+        ]
+        registre = zf.read('Registre_KDP_2025.csv').decode('utf-8-sig')
+    assert '2025-02' not in registre
@@ -0,0 +1,59 @@
+import importlib.util
+
+import pandas as pd
+import pytest
+
+import kdp_invoice_generator as kdp
+from conftest import ligne_detail, ligne_paiement
+
+LIGNES = [
+    ligne_paiement(1234567001, "Amazon.fr", "EUR", 12.5, 12.5),
+    ligne_detail("EUR", 10.0, "Livre A"),
+    ligne_detail("EUR", 2.5, "Livre B"),
+    ligne_paiement(1234567002, "Amazon.com", "USD", 20.0, 18.42, 0.921),
+    ligne_detail("USD", 20.0, "Livre A"),
+]
+
+MOTEURS = ['streaming', 'pandas'] + (['calamine'] if importlib.util.find_spec('python_calamine') else [])
+
+
+def _types(df):
+    return {col: str(df[col].dtype) for col in df.columns}
+
+
+@pytest.mark.parametrize('moteur', MOTEURS)
+def test_types_explicites_quel_que_soit_le_moteur(export_kdp, moteur):
+    df, msg = kdp.lire_fichier_kdp(export_kdp(LIGNES), moteur=moteur)
+    assert df is not None, msg
+    types = _types(df)
+    assert types['Période de vente - Date de début'] == 'datetime64[ns]'
+    assert types['Redevance accumulée'] == 'float64'
+    for col in ('Marché', 'Numéro de paiement', 'Devise', 'Détail', 'Source'):
+        assert types[col] == 'string'
+    assert df['Numéro de paiement'].dropna().tolist() == ['1234567001', '1234567002']
+
+
+def test_cache_conserve_les_types_et_l_empreinte(export_kdp, tmp_path):
+    chemin = export_kdp(LIGNES)
+    premier, _ = kdp.lire_paiements(chemin, tmp_path / "cache")
+    relu, msg = kdp.lire_paiements(chemin, tmp_path / "cache")
+    assert "cache" in msg
+    assert _types(relu) == _types(premier)
+    pd.testing.assert_frame_equal(relu, premier)
+    assert kdp.ManifesteSortie.empreinte(relu, {}) == kdp.ManifesteSortie.empreinte(premier, {})
+
+
+def test_csv_et_xlsx_donnent_le_meme_rapport(export_kdp):
+    xlsx, _ = kdp.lire_fichier_kdp(export_kdp(LIGNES), moteur='streaming')
+    chemin_csv = export_kdp(LIGNES).with_suffix('.csv')
+    xlsx.to_csv(chemin_csv, index=False)
+    csv, msg = kdp.lire_fichier_kdp(chemin_csv)
+    assert csv is not None, msg
+    pd.testing.assert_frame_equal(csv, xlsx)
+
+
+def test_normaliser_numeros_paiement():
+    valeurs = pd.Series([1234567005, 1234567005.0, ' 1234567005 ', '1234567005.0', '0042', None, ''],
+                        dtype=object)
+    assert kdp.normaliser_numeros_paiement(valeurs).tolist() == \
+        ['1234567005'] * 4 + ['0042', pd.NA, pd.NA]
@@ -0,0 +1,53 @@
+import multiprocessing
+import pickle
+
+import pytest
+
+import kdp_invoice_generator as kdp
+from conftest import CONFIG, ligne_detail, ligne_paiement
+
+LIGNES = [
+    row
+    for mois in (1, 2)
+    for row in (ligne_paiement(f"P{mois}", "Amazon.fr", "EUR", 3.0, 3.0, mois=mois),
+                ligne_detail("EUR", 3.0, "Livre A", mois=mois))
+]
+
+
+class ErreurNonSerialisable(Exception):
+    # Comme FPDFUnicodeEncodingException : ne se reconstruit pas à partir de ses args
+    def __init__(self, caractere, police):
+        super().__init__(f"caractère {caractere!r} absent de la police {police}")
+
+
+def _rendu_en_erreur(mise_en_page):
+    raise ErreurNonSerialisable("–", "helvetica")
+
+
+@pytest.fixture
+def rendu_html_en_erreur(monkeypatch):
+    monkeypatch.setitem(kdp.MOTEURS_RENDU, 'html', ('.html', _rendu_en_erreur, bytes))
+
+
+def test_erreur_de_rendu_transmise_en_texte(rendu_html_en_erreur, export_kdp):
+    rapport, _ = kdp.charger_rapport_kdp(export_kdp(LIGNES))
+    marches_data, _ = kdp.regrouper_par_marche(rapport.extraire_periode(2025, 1)[0])
+    mise_en_page = kdp.construire_mise_en_page(marches_data, 2025, 1, CONFIG)
+    with pytest.raises(RuntimeError) as erreur:
+        kdp._rendre_format(mise_en_page, 'html')
+    copie = pickle.loads(pickle.dumps(erreur.value))
+    assert str(copie) == "ErreurNonSerialisable: caractère '–' absent de la police helvetica"
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason="le rendu de remplacement doit être hérité par les processus fils")
+def test_lot_parallele_rapporte_la_vraie_erreur(rendu_html_en_erreur, export_kdp, config_kdp):
+    sortie = kdp.SortieMemoire()
+    succes, journal, resultats = kdp.generer_factures_lot(
+        export_kdp(LIGNES), format_sortie='csv,html', config_path=config_kdp, jobs=2, sortie=sortie)
+    assert not succes
+    assert [(r['annee'], r['mois']) for r in resultats] == [(2025, 1), (2025, 2)]
+    for r in resultats:
+        assert "ErreurNonSerialisable: caractère '–'" in r['message']
+        assert "terminated abruptly" not in r['message']
+    assert sorted(sortie.fichiers) == ['Facture_KDP_2025-01.csv', 'Facture_KDP_2025-02.csv']
@@ -0,0 +1,39 @@
+import os
+import stat
+import tempfile
+from pathlib import Path
+
+import pytest
+
+import kdp_invoice_generator as kdp
+
+POLICE = Path("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf")
+
+pytestmark = pytest.mark.skipif(not POLICE.is_file(), reason="police DejaVu Sans absente")
+
+
+@pytest.fixture(autouse=True)
+def cache_utilisateur(tmp_path, monkeypatch):
+    pytest.importorskip("fontTools")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setattr(kdp, "_POLICE_PDF", {})
+    return tmp_path / "cache"
+
+
+def test_sous_ensemble_dans_le_cache_utilisateur(cache_utilisateur):
+    chemin = kdp._sous_ensemble_police(POLICE)
+    dossier = cache_utilisateur / "kdp_factures" / "polices"
+    assert chemin.parent == dossier and chemin.is_file()
+    assert not chemin.is_relative_to(Path(tempfile.gettempdir()) / "kdp_polices")
+    assert [p.name for p in dossier.iterdir()] == [chemin.name]  # aucun fichier temporaire résiduel
+    if os.name == 'posix':
+        assert stat.S_IMODE(dossier.stat().st_mode) == 0o700
+    assert kdp._sous_ensemble_police(POLICE) == chemin
+
+
+def test_cache_inaccessible_repli_prive(cache_utilisateur):
+    cache_utilisateur.write_text("")  # un fichier à la place du dossier : création impossible
+    chemin = kdp._sous_ensemble_police(POLICE)
+    assert chemin.is_file() and chemin.parent == kdp._POLICE_PDF['dossier_prive']
+    if os.name == 'posix':
+        assert stat.S_IMODE(chemin.parent.stat().st_mode) == 0o700
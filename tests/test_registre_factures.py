@@ -0,0 +1,61 @@
+import sqlite3
+
+import pytest
+
+from registre_factures_kdp import RegistreFactures
+
+CONFIG = {'facture': {'prefixe_numero': "F", 'format_numero': "{sequence:04d}"}}
+
+
+@pytest.fixture
+def registre(tmp_path):
+    return RegistreFactures(tmp_path / "factures.sqlite")
+
+
+def test_paiements_indexes_sous_une_seule_forme(registre):
+    registre.numero(CONFIG, 2025, 1, [1234567005])
+    registre.numero(CONFIG, 2025, 1, [1234567005.0, '1234567005'])
+    assert registre.factures() == [('2025-01', 'F-0001', 1)]
+    assert registre.facture_du_paiement(1234567005.0) == [('F-0001', '2025-01')]
+
+
+def test_numeros_flottants_existants_normalises_a_l_ouverture(registre):
+    registre.numero(CONFIG, 2025, 1, ['1234567005'])
+    cnx = sqlite3.connect(registre.chemin)
+    with cnx:
+        cnx.executemany("INSERT INTO factures_paiements VALUES (?, '2025-01')",
+                        [('1234567005.0',), ('1234567006.0',)])
+    cnx.close()
+    rouvert = RegistreFactures(registre.chemin)
+    assert rouvert.paiements_de_facture('F-0001') == ('2025-01', ['1234567005', '1234567006'])
+
+
+def test_numero_emis_jamais_remplace_ni_reutilise(registre):
+    assert [registre.numero(CONFIG, 2025, mois) for mois in (1, 2, 3)] == ['F-0001', 'F-0002', 'F-0003']
+    with pytest.raises(ValueError, match="F-0003"):
+        registre.numero(CONFIG, 2025, 3, numero_personnalise="MANUEL-1")
+    assert registre.numero(CONFIG, 2025, 3, numero_personnalise="F-0003") == 'F-0003'
+    assert registre.numero(CONFIG, 2025, 4) == 'F-0004'
+
+
+def test_numero_personnalise_pour_une_nouvelle_periode(registre):
+    registre.numero(CONFIG, 2025, 1)
+    assert registre.numero(CONFIG, 2025, 2, numero_personnalise="MANUEL-1") == 'MANUEL-1'
+    assert registre.numero(CONFIG, 2025, 3) == 'F-0002'
+    with pytest.raises(ValueError, match="2025-02"):
+        registre.numero(CONFIG, 2025, 4, numero_personnalise="MANUEL-1")
+
+
+def test_numero_existant_lu_sans_verrou_d_ecriture(registre):
+    assert registre.numero(CONFIG, 2025, 1, ['1234567005']) == 'F-0001'
+    autre = sqlite3.connect(registre.chemin, isolation_level=None)
+    autre.execute("BEGIN IMMEDIATE")  # un autre processus détient le verrou d'écriture
+    try:
+        assert registre.numero(CONFIG, 2025, 1, ['1234567005']) == 'F-0001'
+        with pytest.raises(ValueError, match="F-0001"):
+            registre.numero(CONFIG, 2025, 1, numero_personnalise="MANUEL-1")
+    finally:
+        autre.execute("ROLLBACK")
+        autre.close()
+    assert registre.numero(CONFIG, 2025, 1, ['1234567005', '1234567006']) == 'F-0001'
+    assert registre.paiements_de_facture('F-0001') == ('2025-01', ['1234567005', '1234567006'])
@@ -0,0 +1,62 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import kdp_invoice_generator as kdp
+from conftest import ligne_detail, ligne_paiement
+from registre_paiements_kdp import RegistrePaiements
+
+
+def _details_par_marche(donnees):
+    marches_data, _ = kdp.regrouper_par_marche(donnees)
+    return {marche: [d['designation'] for d in data['details']] for marche, data in marches_data.items()}
+
+
+def test_reimport_avec_un_detail_de_plus(export_kdp, tmp_path):
+    avant = export_kdp([
+        ligne_paiement("P1", "Amazon.fr", "EUR", 3.0, 3.0),
+        ligne_detail("EUR", 1.0, "FR livre 0"),
+        ligne_detail("EUR", 2.0, "FR livre 1"),
+        ligne_paiement("P2", "Amazon.com", "USD", 4.0, 3.68, 0.921),
+        ligne_detail("USD", 4.0, "US livre"),
+    ], "avant.xlsx")
+    apres = export_kdp([
+        ligne_paiement("P1", "Amazon.fr", "EUR", 6.0, 6.0),
+        ligne_detail("EUR", 1.0, "FR livre 0"),
+        ligne_detail("EUR", 2.0, "FR livre 1"),
+        ligne_detail("EUR", 3.0, "FR livre 2"),
+        ligne_paiement("P2", "Amazon.com", "USD", 4.0, 3.68, 0.921),
+        ligne_detail("USD", 4.0, "US livre"),
+    ], "apres.xlsx")
+
+    registre = RegistrePaiements(tmp_path / "paiements.sqlite")
+    registre.importer(avant)
+    registre.importer(apres)
+
+    depuis_registre, _ = registre.extraire_periode(2025, 1)
+    depuis_fichier, _ = kdp.extraire_donnees_periode(kdp.lire_fichier_kdp(apres)[0], 2025, 1)
+    attendu = {'Amazon.fr': ['FR livre 0', 'FR livre 1', 'FR livre 2'], 'Amazon.com': ['US livre']}
+    assert _details_par_marche(depuis_fichier) == attendu
+    assert _details_par_marche(depuis_registre) == attendu
+    assert len(registre) == 6
+
+
+def test_reimport_identique_sans_doublon(export_kdp, tmp_path):
+    export = export_kdp([
+        ligne_paiement("P1", "Amazon.fr", "EUR", 3.0, 3.0),
+        ligne_detail("EUR", 3.0, "FR livre 0"),
+    ])
+    registre = RegistrePaiements(tmp_path / "paiements.sqlite")
+    registre.importer(export)
+    registre.importer(export)
+    assert len(registre) == 2
+    assert registre.periodes() == [(2025, 1)]
+
+
+def test_registres_independants_du_generateur():
+    # Sous `python kdp_invoice_generator.py importer`, le générateur est __main__ :
+    # un import par les registres en chargerait une seconde copie.
+    code = ("import sys, registre_paiements_kdp, registre_factures_kdp; "
+            "sys.exit('kdp_invoice_generator' in sys.modules)")
+    racine = Path(__file__).resolve().parent.parent
+    assert subprocess.run([sys.executable, '-c', code], cwd=racine).returncode == 0
@@ -0,0 +1,172 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+import kdp_invoice_generator as kdp
+from conftest import CONFIG, ligne_detail, ligne_paiement
+
+
+def regrouper_par_marche_reference(donnees):
+    """
+    Implémentation historique (deux passes iterrows), conservée comme référence.
+    """
+    marches_data = {}
+
+    # 1) Lignes principales (avec numéro de paiement)
+    principales = donnees[donnees['Numéro de paiement'].notna()].copy()
+    principales['Redevance accumulée'] = pd.to_numeric(
+        principales['Redevance accumulée'], errors='coerce').fillna(0)
+    principales['Montant du paiement'] = pd.to_numeric(
+        principales['Montant du paiement'], errors='coerce').fillna(0)
+
+    marche_par_idx = {}
+    for idx, ligne in principales.iterrows():
+        marche = ligne['Marché']
+        if marche not in marches_data:
+            marches_data[marche] = {
+                'devise_origine': ligne['Devise'],
+                'taux_change': ligne.get('Taux de change'),
+                'total_origine': 0.0,
+                'total_eur': 0.0,
+                'details': []
+            }
+        marches_data[marche]['total_origine'] += ligne['Redevance accumulée']
+        marches_data[marche]['total_eur'] += ligne['Montant du paiement']
+        marche_par_idx[idx] = marche
+
+    # 2) Détails (lignes sans numéro de paiement)
+    marche_actuel = None
+    for idx, ligne in donnees.iterrows():
+        if idx in marche_par_idx:
+            marche_actuel = marche_par_idx[idx]
+            continue
+        if marche_actuel and pd.notna(ligne.get('Redevance accumulée')):
+            col = 'Source' if 'Source' in donnees.columns else 'Détail'
+            designation = ligne.get(col, '') or 'Redevance KDP'
+            devise = ligne.get('Devise') or marches_data[marche_actuel]['devise_origine']
+            montant = float(ligne['Redevance accumulée'])
+            marches_data[marche_actuel]['details'].append({
+                'designation': designation,
+                'devise': devise,
+                'montant': montant
+            })
+
+    return marches_data, f"Marchés trouvés: {list(marches_data.keys())}"
+
+
+def _comparable(marches_data):
+    return {
+        marche: {
+            'devise_origine': data['devise_origine'],
+            'taux_change': None if pd.isna(data['taux_change']) else data['taux_change'],
+            'total_origine': round(data['total_origine'], 2),
+            'total_eur': round(data['total_eur'], 2),
+            'details': [(d['designation'], d['devise'], round(d['montant'], 2)) for d in data['details']],
+        }
+        for marche, data in marches_data.items()
+    }
+
+
+def _verifier_equivalence(donnees):
+    attendu, msg_attendu = regrouper_par_marche_reference(donnees)
+    obtenu, msg = kdp.regrouper_par_marche(donnees)
+    assert msg == msg_attendu
+    assert list(obtenu) == list(attendu)
+    assert _comparable(obtenu) == _comparable(attendu)
+    return obtenu
+
+
+COLONNES = ['Période de vente - Date de début', 'Marché', 'Numéro de paiement', 'Devise',
+            'Redevance accumulée', 'Taux de change', 'Montant du paiement', 'Détail', 'Source']
+DEBUT = datetime(2025, 1, 1)
+
+
+def _cadre(lignes, colonnes=COLONNES):
+    return pd.DataFrame([ligne[:len(colonnes)] for ligne in lignes], columns=colonnes, dtype=object) \
+        .astype({'Redevance accumulée': 'float64', 'Taux de change': 'float64', 'Montant du paiement': 'float64'})
+
+
+def test_disposition_detail_et_source():
+    donnees = _cadre([
+        [DEBUT, "Amazon.fr", "P1", "EUR", 12.5, None, 12.5, None, None],
+        [None, None, None, "EUR", 10.0, None, None, "2025-01 eBook", "Livre A"],
+        [None, None, None, "EUR", 2.5, None, None, "2025-01 Broché", "Livre B"],
+        [DEBUT, "Amazon.com", "P2", "USD", 20.0, 0.921, 18.42, None, None],
+        [None, None, None, "USD", 20.0, None, None, "2025-01 eBook", "Livre A"],
+        [DEBUT, "Amazon.fr", "P3", "EUR", 1.0, None, 1.0, None, None],
+        [None, None, None, "EUR", 1.0, None, None, "2025-01 eBook", "Livre C"],
+    ])
+    obtenu = _verifier_equivalence(donnees)
+    assert [d['designation'] for d in obtenu['Amazon.fr']['details']] == ["Livre A", "Livre B", "Livre C"]
+
+
+def test_disposition_detail_seul():
+    donnees = _cadre([
+        [DEBUT, "Amazon.de", "P1", "EUR", 7.0, None, 7.0, None],
+        [None, None, None, "EUR", 3.0, None, None, "2025-01 Livre A"],
+        [None, None, None, "EUR", 4.0, None, None, "2025-01 Livre B"],
+        [DEBUT, "Amazon.co.uk", "P2", "GBP", 5.0, 1.17, 5.85, None],
+        [None, None, None, "GBP", 5.0, None, None, "2025-01 Livre A"],
+    ], COLONNES[:-1])
+    _verifier_equivalence(donnees)
+
+
+@pytest.mark.parametrize('vide', ['', None])
+def test_devise_et_designation_vides(vide):
+    donnees = _cadre([
+        [DEBUT, "Amazon.com", "P1", "USD", 6.0, 0.921, 5.53, None, None],
+        [None, None, None, vide, 2.0, None, None, "2025-01 eBook", vide],
+        [None, None, None, "USD", 4.0, None, None, "2025-01 eBook", "Livre A"],
+    ])
+    obtenu = _verifier_equivalence(donnees)
+    assert list(obtenu['Amazon.com']['details'])[0] == \
+        {'designation': 'Redevance KDP', 'devise': 'USD', 'montant': 2.0}
+
+
+def test_details_avant_la_premiere_ligne_principale():
+    donnees = _cadre([
+        [None, None, None, "EUR", 9.0, None, None, "2024-12 eBook", "Orphelin"],
+        [None, None, None, "EUR", None, None, None, "2025-01 eBook", "Sans montant"],
+        [DEBUT, "Amazon.fr", "P1", "EUR", 3.0, None, 3.0, None, None],
+        [None, None, None, "EUR", 3.0, None, None, "2025-01 eBook", "Livre A"],
+        [None, None, None, "EUR", None, None, None, "2025-01 eBook", "Sans montant"],
+    ])
+    obtenu = _verifier_equivalence(donnees)
+    assert len(obtenu['Amazon.fr']['details']) == 1
+
+
+def test_periode_lue_depuis_un_export(export_kdp):
+    rapport, _ = kdp.charger_rapport_kdp(export_kdp([
+        ligne_paiement("P1", "Amazon.fr", "EUR", 3.0, 3.0),
+        ligne_detail("EUR", 1.0, "Livre A"),
+        ligne_detail("EUR", 2.0, "Livre B"),
+        ligne_paiement("P2", "Amazon.com", "USD", 4.0, 3.68, 0.921),
+        ligne_detail("USD", 4.0, "Livre A"),
+        ligne_paiement("P3", "Amazon.fr", "EUR", 5.0, 5.0, mois=2),
+        ligne_detail("EUR", 5.0, "Livre C", mois=2),
+    ]))
+    for annee, mois in rapport.periodes():
+        _verifier_equivalence(rapport.extraire_periode(annee, mois)[0])
+
+
+@pytest.mark.parametrize('vide', [None, float('nan'), pd.NA])
+def test_taux_conversion_devise_absente(vide):
+    assert kdp.taux_conversion(vide, 0.921) == 0.921
+    assert kdp.taux_conversion('EUR', 0.921) == 1
+
+
+def test_devise_principale_vide(export_kdp):
+    rapport, _ = kdp.charger_rapport_kdp(export_kdp([
+        ligne_paiement("P1", "Amazon.com", None, 4.0, 3.68, 0.921),
+        ligne_detail(None, 4.0, "Livre A"),
+    ]))
+    marches_data, _ = kdp.regrouper_par_marche(rapport.extraire_periode(2025, 1)[0])
+    marche = marches_data['Amazon.com']
+    assert marche['devise_origine'] == ''
+    assert marche['details'].taux == 0.921
+    assert list(marche['details']) == [{'designation': 'Livre A', 'devise': '', 'montant': 4.0}]
+    mise_en_page = kdp.construire_mise_en_page(marches_data, 2025, 1, CONFIG)
+    for fmt in kdp.MOTEURS_RENDU:
+        octets, _ = kdp.rendre_octets(mise_en_page, fmt)
+        assert octets